@@ -17,8 +17,13 @@
 
 import numpy as np
 import os
-import multiprocessing
 import argparse
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_runner"))
+import allocator
+import topology
+
 parser = argparse.ArgumentParser(description="Benchmark 3D U-Net",add_help=True)
 parser.add_argument("--dim_length",
 					type = int,
@@ -49,12 +54,12 @@ parser.add_argument("--epochs",
 					help="Number of epochs")
 parser.add_argument("--intraop_threads",
 					type = int,
-					default=multiprocessing.cpu_count()-1, # All but one core
-					help="Number of intraop threads")
+					default=None,
+					help="Number of intraop threads (default: one per physical core)")
 parser.add_argument("--interop_threads",
 					type = int,
-					default=2,
-					help="Number of interop threads")
+					default=None,
+					help="Number of interop threads (default: one per socket)")
 parser.add_argument("--blocktime",
 					type = int,
 					default=0,
@@ -67,15 +72,40 @@ parser.add_argument("--use_upsampling",
 					action="store_true",
 					default=False,
 					help="Use upsampling instead of transposed convolution")
+parser.add_argument("--channels_first",
+					action="store_true",
+					default=False,
+					help="Use NCDHW (channels_first) instead of NDHWC tensors")
+parser.add_argument("--warmup_steps",
+					type = int,
+					default=3,
+					help="Number of initial steps excluded from the timing")
+parser.add_argument("--trace_steps",
+					type = int,
+					nargs="*",
+					default=None,
+					help="Step indices (counting from 0 across all epochs) "
+					"to trace. Default is the last step. Traced steps are "
+					"excluded from the timing.")
+parser.add_argument("--output_dir",
+					default=".",
+					help="Directory for the chrome traces and the JSON results")
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
 args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args)
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
-os.environ["OMP_NUM_THREADS"] = str(args.intraop_threads)
-os.environ["KMP_BLOCKTIME"] = str(args.blocktime)
-os.environ["KMP_AFFINITY"] = "granularity=thread,compact,1,0"
 
+import json
+import time
 import tensorflow as tf
+import keras as K
+from tensorflow.python.client import timeline
 from model import define_model, dice_coef_loss, dice_coef
+from model import set_channels_first
 from model import sensitivity, specificity
 from tqdm import trange, tqdm
 tqdm.monitor_interval = 0
@@ -92,9 +122,17 @@ tf.keras.backend.set_session(sess)
 
 global_step = tf.Variable(0, name="global_step", trainable=False)
 
+set_channels_first(args.channels_first)
+
 # Define the shape of the input images
 # For segmentation models, the label (mask) is the same shape.
-shape = (None, args.dim_length,
+if args.channels_first:
+	shape = (None, args.num_channels,
+					args.dim_length,
+					args.dim_length,
+					args.dim_length)
+else:
+	shape = (None, args.dim_length,
 					args.dim_length,
 					args.dim_length,
 					args.num_channels)
@@ -116,58 +154,125 @@ specificity_score = specificity(msk, preds)
 train_op = tf.train.AdamOptimizer(args.lr).minimize(loss, global_step=global_step)
 
 # Just feed completely random data in for the benchmark testing
-imgs = np.random.rand(args.bz, args.dim_length,
-			args.dim_length,
-			args.dim_length,
-			args.num_channels)
-msks = imgs + np.random.rand(args.bz, args.dim_length,
-			args.dim_length,
-			args.dim_length,
-			args.num_channels)
+imgs = np.random.rand(args.bz, *shape[1:])
+msks = imgs + np.random.rand(args.bz, *shape[1:])
 
 # Initialize all variables
 init_op = tf.global_variables_initializer()
 sess.run(init_op)
 
-# Set up trace for operations
-run_metadata = tf.RunMetadata()
+# Same number of sample to process regardless of batch size
+# So if we have a larger batch size we can take fewer steps.
+steps_per_epoch = args.num_datapoints//args.bz
+total_steps = args.epochs*steps_per_epoch
+
+# Only trace the requested steps since FULL_TRACE slows down the step
+if args.trace_steps is None:
+	trace_steps = set([total_steps-1])
+else:
+	trace_steps = set(args.trace_steps)
 run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
 
+if not os.path.isdir(args.output_dir):
+	os.makedirs(args.output_dir)
+
+feed_dict = {img: imgs, msk:msks}
+# Same fetches as the original benchmark so the step times compare
+fetches = [train_op, loss, dice_score, sensitivity_score, specificity_score]
+step_times = []   # Seconds for each timed (untraced, post-warmup) step
+trace_files = []
+step_idx = 0
+
 for epoch in range(args.epochs):
 
-	# Same number of sample to process regardless of batch size
-	# So if we have a larger batch size we can take fewer steps.
-	total_steps = args.num_datapoints//args.bz
-	progressbar = trange(total_steps) # tqdm progress bar
-	last_step = 0
-	for i in range(total_steps):
-		feed_dict = {img: imgs, msk:msks}
+	progressbar = trange(steps_per_epoch) # tqdm progress bar
+	for i in range(steps_per_epoch):
+
+		if step_idx in trace_steps:
+			run_metadata = tf.RunMetadata()
+			history, loss_v, dice_v, sensitivity_v, specificity_v = \
+				sess.run(fetches, feed_dict=feed_dict,
+					options=run_options, run_metadata=run_metadata)
 
-		history, loss_v, dice_v, sensitivity_v, specificity_v, this_step = \
-				sess.run([train_op, loss, dice_score,
-				sensitivity_score, specificity_score, global_step],
-				feed_dict=feed_dict,
-				options=run_options, run_metadata=run_metadata)
+			'''
+			Save the training timeline for this step
+			'''
+			timeline_filename = os.path.join(args.output_dir,
+						"3dunet_timeline_trace_step{}.json".format(step_idx))
+			fetched_timeline = timeline.Timeline(run_metadata.step_stats)
+			chrome_trace = fetched_timeline.generate_chrome_trace_format()
+			with open(timeline_filename, "w") as f:
+				f.write(chrome_trace)
+			trace_files.append(timeline_filename)
+		else:
+			start_time = time.time()
+			history, loss_v, dice_v, sensitivity_v, specificity_v = \
+				sess.run(fetches, feed_dict=feed_dict)
+			if step_idx >= args.warmup_steps:
+				step_times.append(time.time() - start_time)
 
 		# Print the loss and dice metric in the progress bar.
 		progressbar.set_description(
 					"Epoch {}/{}: (loss={:.4f}, dice={:.4f})".format(
 					epoch+1, args.epochs, loss_v, dice_v))
-		progressbar.update(this_step-last_step)
-		last_step = this_step
+		progressbar.update(1)
+		step_idx += 1
+
+	progressbar.close()
 
 '''
-Save the training timeline
+Save the step latency statistics
 '''
-from tensorflow.python.client import timeline
+results = {"dim_length": args.dim_length,
+		   "num_channels": args.num_channels,
+		   "bz": args.bz,
+		   "data_format": "channels_first" if args.channels_first
+						  else "channels_last",
+		   "intraop_threads": args.intraop_threads,
+		   "interop_threads": args.interop_threads,
+		   "blocktime": args.blocktime,
+		   "warmup_steps": args.warmup_steps,
+		   "timed_steps": len(step_times),
+		   "traced_steps": sorted(trace_steps),
+		   "trace_files": trace_files}
+
+if len(step_times) > 0:
+	latency_ms = 1000.0*np.array(step_times)
+	results["latency_ms"] = {"mean": float(np.mean(latency_ms)),
+							 "std": float(np.std(latency_ms)),
+							 "min": float(np.min(latency_ms)),
+							 "p50": float(np.percentile(latency_ms, 50)),
+							 "p90": float(np.percentile(latency_ms, 90)),
+							 "p95": float(np.percentile(latency_ms, 95)),
+							 "p99": float(np.percentile(latency_ms, 99)),
+							 "max": float(np.max(latency_ms))}
+	results["images_per_sec"] = args.bz*len(step_times)/np.sum(step_times)
+
+	print("\nStep latency (ms): mean={:.2f}, p50={:.2f}, p90={:.2f}, "
+		  "p99={:.2f}".format(results["latency_ms"]["mean"],
+		  results["latency_ms"]["p50"], results["latency_ms"]["p90"],
+		  results["latency_ms"]["p99"]))
+	print("Speed = {:,.3f} images per second".format(results["images_per_sec"]))
+else:
+	print("\nNo timed steps. Increase --num_datapoints or --epochs.")
 
-timeline_filename = "./3dunet_timeline_trace.json"
-fetched_timeline = timeline.Timeline(run_metadata.step_stats)
-chrome_trace = fetched_timeline.generate_chrome_trace_format()
-with open(timeline_filename, "w") as f:
-	print("Saved Tensorflow trace to: {}".format(timeline_filename))
-	print("To view the trace:\n(1) Open Chrome browser.\n"
+results_filename = os.path.join(args.output_dir, "3dunet_benchmark.json")
+with open(results_filename, "w") as f:
+	json.dump(results, f, indent=2)
+print("Saved benchmark results to: {}".format(results_filename))
+
+if len(trace_files) > 0:
+	print("Saved Tensorflow traces to: {}".format(", ".join(trace_files)))
+	print("To view a trace:\n(1) Open Chrome browser.\n"
 	"(2) Go to this url -- chrome://tracing\n"
 	"(3) Click the load button.\n"
-	"(4) Load the file {}.".format(timeline_filename))
-	f.write(chrome_trace)
+	"(4) Load the trace file.")
+
+	# Layer shapes for the FLOP counts in benchmark_runner/analyze_trace.py
+	model_filename = os.path.join(args.output_dir, "3dunet_model.json")
+	with open(model_filename, "w") as f:
+		f.write(K.models.Model(inputs=img, outputs=preds).to_json())
+	print("Saved Keras model JSON to: {}".format(model_filename))
+	print("Summarize a trace with:\n"
+	"python analyze_trace.py summary <trace> --model_json {} "
+	"--batch_size {}".format(model_filename, args.bz))
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Benchmark the spatially parallel 3D U-Net.
+Each Horovod rank owns a slab of the volume along --partition_axis.
+
+To run on 4 local processes:
+	mpirun -np 4 python benchmark_spatial_model.py \
+		--dim_lengthx 240 --dim_lengthy 240 --dim_lengthz 160 \
+		--partition_axis 3 --intraop_threads 8
+
+To check that the spatially parallel model matches the single node
+model on a small volume:
+	mpirun -np 2 python benchmark_spatial_model.py --check \
+		--dim_lengthx 32 --dim_lengthy 32 --dim_lengthz 32
+"""
+
+import numpy as np
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_runner"))
+import allocator
+import topology
+
+parser = argparse.ArgumentParser(
+	description="Benchmark spatially parallel 3D U-Net",add_help=True)
+parser.add_argument("--dim_lengthx",
+					type = int,
+					default=240,
+					help="Tensor length of side x")
+parser.add_argument("--dim_lengthy",
+					type = int,
+					default=240,
+					help="Tensor length of side y")
+parser.add_argument("--dim_lengthz",
+					type = int,
+					default=160,
+					help="Tensor length of side z")
+parser.add_argument("--partition_axis",
+					type = int,
+					default=3,
+					choices=[1, 2, 3],
+					help="Spatial axis (1=x, 2=y, 3=z) to split across ranks")
+parser.add_argument("--num_channels",
+					type = int,
+					default=1,
+					help="Number of channels")
+parser.add_argument("--bz",
+					type = int,
+					default=1,
+					help="Batch size")
+parser.add_argument("--lr",
+					type = float,
+					default=0.001,
+					help="Learning rate")
+parser.add_argument("--num_datapoints",
+					type = int,
+					default=16,
+					help="Number of datapoints")
+parser.add_argument("--epochs",
+					type = int,
+					default=3,
+					help="Number of epochs")
+parser.add_argument("--intraop_threads",
+					type = int,
+					default=None,
+					help="Number of intraop threads (default: one per physical core)")
+parser.add_argument("--interop_threads",
+					type = int,
+					default=None,
+					help="Number of interop threads (default: one per socket)")
+parser.add_argument("--blocktime",
+					type = int,
+					default=0,
+					help="Block time for CPU threads")
+parser.add_argument("--print_model",
+					action="store_true",
+					default=False,
+					help="Print the summary of the model layers")
+parser.add_argument("--use_upsampling",
+					action="store_true",
+					default=False,
+					help="Use upsampling instead of transposed convolution")
+parser.add_argument("--check",
+					action="store_true",
+					default=False,
+					help="Compare against the single node model instead of benchmarking")
+parser.add_argument("--tolerance",
+					type = float,
+					default=1e-4,
+					help="Maximum absolute difference allowed by --check")
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
+args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args)
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
+
+import tensorflow as tf
+import keras as K
+import horovod.tensorflow as hvd
+from spatial_model import define_spatial_model, get_slab, gather_slabs
+from spatial_model import spatial_dice_coef, spatial_dice_coef_loss
+from model import define_model, dice_coef_loss
+
+hvd.init()
+
+if hvd.rank() == 0:
+	print("\nArgs = {}".format(args))
+	print("Partitioning axis {} across {} ranks".format(args.partition_axis,
+														hvd.size()))
+
+# Optimize CPU threads for TensorFlow
+config = tf.ConfigProto(
+		inter_op_parallelism_threads=args.interop_threads,
+		intra_op_parallelism_threads=args.intraop_threads)
+
+full_shape = (args.bz, args.dim_lengthx, args.dim_lengthy,
+			  args.dim_lengthz, args.num_channels)
+
+# Every rank generates the same random volume and keeps its own slab
+np.random.seed(816)
+imgs = np.random.rand(*full_shape).astype(np.float32)
+msks = (np.random.rand(*full_shape) > 0.5).astype(np.float32)
+
+imgs_slab = get_slab(imgs, args.partition_axis, hvd.rank(), hvd.size())
+msks_slab = get_slab(msks, args.partition_axis, hvd.rank(), hvd.size())
+
+# No dropout when checking so that the outputs are deterministic
+dropout = 0.0 if args.check else 0.2
+
+
+def build_graph(slab_shape, distributed):
+	"""
+	Build the model, loss and metrics for a slab (or the full volume)
+	"""
+	K.backend.set_learning_phase(True)
+	K.backend.manual_variable_initialization(False)
+
+	img = tf.placeholder(tf.float32, shape=slab_shape)
+	msk = tf.placeholder(tf.float32, shape=slab_shape)
+
+	pred, model = define_spatial_model(img,
+					partition_axis=args.partition_axis,
+					use_upsampling=args.use_upsampling,
+					dropout=dropout,
+					distributed=distributed,
+					print_summary=args.print_model and (hvd.rank() == 0),
+					return_model=True)
+
+	loss = spatial_dice_coef_loss(msk, pred, distributed=distributed)
+	dice = spatial_dice_coef(msk, pred, distributed=distributed)
+
+	return img, msk, pred, model, loss, dice
+
+
+def check_against_single_node():
+	"""
+	Run one forward/backward pass on the partitioned volume and with
+	the single node model.define_model on the full volume (rank 0 only)
+	with the same weights and compare the predictions, loss and weight
+	gradients.
+	"""
+	sess = tf.Session(config=config)
+	K.backend.set_session(sess)
+
+	img, msk, pred, model, loss, dice = build_graph(imgs_slab.shape, True)
+	full_pred = gather_slabs(pred, args.partition_axis)
+	# Averaging the local gradients gives the single node gradient
+	grads = [hvd.allreduce(g) for g in
+			 tf.gradients(loss, model.trainable_weights)]
+
+	sess.run(tf.global_variables_initializer())
+	sess.run(hvd.broadcast_global_variables(0))
+
+	pred_v, loss_v, grads_v = sess.run([full_pred, loss, grads],
+						feed_dict={img: imgs_slab, msk: msks_slab})
+	weights = model.get_weights()
+
+	if hvd.rank() != 0:
+		return True
+
+	with tf.Graph().as_default():
+		ref_sess = tf.Session(config=config)
+		K.backend.set_session(ref_sess)
+
+		ref_img = tf.placeholder(tf.float32, shape=imgs.shape)
+		ref_msk = tf.placeholder(tf.float32, shape=msks.shape)
+		ref_pred, ref_model = define_model(ref_img,
+						use_upsampling=args.use_upsampling,
+						dropout=dropout, return_model=True)
+		ref_loss = dice_coef_loss(ref_msk, ref_pred)
+		ref_grads = tf.gradients(ref_loss, ref_model.trainable_weights)
+
+		ref_sess.run(tf.global_variables_initializer())
+		# Same layers in the same order, so the weights line up
+		for weight, value in zip(ref_model.weights, weights):
+			if tuple(weight.get_shape().as_list()) != value.shape:
+				raise ValueError("Weight {} of the single node model has "
+								 "shape {}, not {}".format(weight.name,
+								 weight.get_shape(), value.shape))
+		ref_model.set_weights(weights)
+
+		ref_pred_v, ref_loss_v, ref_grads_v = \
+				ref_sess.run([ref_pred, ref_loss, ref_grads],
+				feed_dict={ref_img: imgs, ref_msk: msks})
+
+	pred_diff = np.max(np.abs(pred_v - ref_pred_v))
+	loss_diff = np.abs(loss_v - ref_loss_v)
+	grad_diff = np.max([np.max(np.abs(g - rg))
+						for g, rg in zip(grads_v, ref_grads_v)])
+
+	print("Max absolute difference vs single node ({} ranks):".format(
+			hvd.size()))
+	print("  prediction = {:.3e}".format(pred_diff))
+	print("  loss       = {:.3e}".format(loss_diff))
+	print("  gradients  = {:.3e}".format(grad_diff))
+
+	passed = max(pred_diff, loss_diff, grad_diff) <= args.tolerance
+	print("PASSED" if passed else "FAILED")
+
+	return passed
+
+
+def benchmark():
+	"""
+	Time training steps on the partitioned volume
+	"""
+	sess = tf.Session(config=config)
+	K.backend.set_session(sess)
+
+	img, msk, pred, model, loss, dice = build_graph(imgs_slab.shape, True)
+
+	global_step = tf.train.get_or_create_global_step()
+	opt = hvd.DistributedOptimizer(tf.train.AdamOptimizer(args.lr))
+	train_op = opt.minimize(loss, global_step=global_step)
+
+	sess.run(tf.global_variables_initializer())
+	sess.run(hvd.broadcast_global_variables(0))
+
+	feed_dict = {img: imgs_slab, msk: msks_slab}
+
+	# Same number of sample to process regardless of batch size
+	# So if we have a larger batch size we can take fewer steps.
+	total_steps = args.num_datapoints//args.bz
+
+	start_time = time.time()
+	for epoch in range(args.epochs):
+		for i in range(total_steps):
+			_, loss_v, dice_v = sess.run([train_op, loss, dice],
+										 feed_dict=feed_dict)
+
+		if hvd.rank() == 0:
+			print("Epoch {}/{}: (loss={:.4f}, dice={:.4f})".format(
+				epoch+1, args.epochs, loss_v, dice_v))
+
+	stop_time = time.time()
+
+	if hvd.rank() == 0:
+		print("\n\nTotal time = {:,.3f} seconds".format(stop_time - start_time))
+		print("Total volumes = {:,}".format(args.epochs*total_steps*args.bz))
+		print("Speed = {:,.3f} volumes per second".format(
+			(args.epochs*total_steps*args.bz)/(stop_time - start_time)))
+
+	return True
+
+
+if args.check:
+	passed = check_against_single_node()
+else:
+	passed = benchmark()
+
+sys.exit(0 if passed else 1)
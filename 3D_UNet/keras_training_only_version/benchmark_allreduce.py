@@ -0,0 +1,214 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Measure the Horovod allreduce bandwidth for the 3D U-Net gradients
+and the training step time for one communication setting.
+
+Run under mpirun (or use sweep_allreduce.py to try several settings):
+    mpirun -np 2 python benchmark_allreduce.py --compression fp16
+
+Rank 0 prints a single line starting with "RESULT " followed by JSON.
+"""
+
+import numpy as np
+import os
+import argparse
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "benchmark_runner"))
+import allocator
+import topology
+
+import time
+import json
+
+parser = argparse.ArgumentParser(
+    description="Benchmark Horovod allreduce for 3D U-Net", add_help=True)
+parser.add_argument("--bz",
+                    type=int,
+                    default=1,
+                    help="Batch size")
+parser.add_argument("--patch_dim",
+                    type=int,
+                    default=64,
+                    help="Size of the 3D patch")
+parser.add_argument("--number_input_channels",
+                    type=int,
+                    default=1,
+                    help="Number of input channels")
+parser.add_argument("--use_upsampling",
+                    action="store_true",
+                    default=False,
+                    help="Use upsampling instead of transposed convolution")
+parser.add_argument("--channels_first",
+                    action="store_true",
+                    default=False,
+                    help="Use NCDHW (channels_first) instead of NDHWC tensors")
+parser.add_argument("--compression",
+                    default="none",
+                    choices=["none", "fp16"],
+                    help="Compress the gradients for the Horovod allreduce")
+parser.add_argument("--fusion_threshold_mb",
+                    type=float,
+                    default=None,
+                    help="Horovod tensor fusion buffer size in MB")
+parser.add_argument("--cycle_time_ms",
+                    type=float,
+                    default=None,
+                    help="Horovod cycle time in ms")
+parser.add_argument("--warmup_steps",
+                    type=int,
+                    default=3,
+                    help="Number of untimed steps")
+parser.add_argument("--num_steps",
+                    type=int,
+                    default=10,
+                    help="Number of timed steps")
+parser.add_argument("--intraop_threads",
+                    type=int,
+                    default=None,
+                    help="Number of intraop threads "
+                    "(default: one per physical core)")
+parser.add_argument("--interop_threads",
+                    type=int,
+                    default=None,
+                    help="Number of interop threads "
+                    "(default: one per socket)")
+parser.add_argument("--blocktime",
+                    type=int,
+                    default=1,
+                    help="Block time for CPU threads")
+
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
+args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args)
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
+
+# Horovod reads the fusion settings when it is initialized
+if args.fusion_threshold_mb is not None:
+    os.environ["HOROVOD_FUSION_THRESHOLD"] = str(
+        int(args.fusion_threshold_mb * 1024 * 1024))
+if args.cycle_time_ms is not None:
+    os.environ["HOROVOD_CYCLE_TIME"] = str(args.cycle_time_ms)
+
+import tensorflow as tf
+import keras as K
+import horovod.keras as hvd
+import horovod.tensorflow as hvd_tf
+from model import *
+
+hvd.init()
+
+config = tf.ConfigProto(
+    inter_op_parallelism_threads=args.interop_threads,
+    intra_op_parallelism_threads=args.intraop_threads)
+
+sess = tf.Session(config=config)
+K.backend.set_session(sess)
+
+if args.compression == "fp16":
+    compression = hvd.Compression.fp16
+    bytes_per_element = 2
+else:
+    compression = hvd.Compression.none
+    bytes_per_element = 4
+
+set_channels_first(args.channels_first)
+if args.channels_first:
+    input_shape = [args.number_input_channels,
+                   args.patch_dim, args.patch_dim, args.patch_dim]
+    mask_shape = [1, args.patch_dim, args.patch_dim, args.patch_dim]
+else:
+    input_shape = [args.patch_dim, args.patch_dim, args.patch_dim,
+                   args.number_input_channels]
+    mask_shape = [args.patch_dim, args.patch_dim, args.patch_dim, 1]
+
+model, opt = unet_3d(input_shape=input_shape,
+                     use_upsampling=args.use_upsampling,
+                     n_cl_in=args.number_input_channels,
+                     learning_rate=0.001*hvd.size(),
+                     n_cl_out=1,
+                     dropout=0.2,
+                     print_summary=False)
+
+opt = hvd.DistributedOptimizer(opt, compression=compression)
+model.compile(optimizer=opt, loss=[dice_coef_loss], metrics=[dice_coef])
+
+"""
+Allreduce only: the same set of tensors as the gradients
+so that the fusion buffer sees the same sizes as in training.
+"""
+grad_tensors = [tf.Variable(tf.random_uniform(K.backend.int_shape(w)),
+                            trainable=False)
+                for w in model.trainable_weights]
+allreduce_op = tf.group(*[hvd_tf.allreduce(t, compression=compression)
+                          for t in grad_tensors])
+num_elements = int(np.sum([K.backend.count_params(w)
+                           for w in model.trainable_weights]))
+wire_bytes = num_elements * bytes_per_element
+
+sess.run(tf.variables_initializer(grad_tensors))
+sess.run(hvd_tf.broadcast_global_variables(0))
+
+
+def time_steps(step_fn):
+    """
+    Run the warmup steps then return the time of each timed step
+    """
+    for _ in range(args.warmup_steps):
+        step_fn()
+    times = []
+    for _ in range(args.num_steps):
+        start = time.time()
+        step_fn()
+        times.append(time.time() - start)
+    return np.array(times)
+
+
+allreduce_times = time_steps(lambda: sess.run(allreduce_op))
+
+imgs = np.random.rand(args.bz, *input_shape)
+msks = (np.random.rand(args.bz, *mask_shape) > 0.5).astype(np.float32)
+step_times = time_steps(lambda: model.train_on_batch(imgs, msks))
+
+# Average the timings over all of the ranks
+allreduce_mean = hvd_tf.allreduce(tf.constant(np.mean(allreduce_times)),
+                                  average=True)
+step_mean = hvd_tf.allreduce(tf.constant(np.mean(step_times)), average=True)
+allreduce_mean, step_mean = sess.run([allreduce_mean, step_mean])
+
+if hvd.rank() == 0:
+    result = {"num_workers": hvd.size(),
+              "compression": args.compression,
+              "fusion_threshold_mb": args.fusion_threshold_mb,
+              "cycle_time_ms": args.cycle_time_ms,
+              "patch_dim": args.patch_dim,
+              "bz": args.bz,
+              "data_format": "channels_first" if args.channels_first
+                             else "channels_last",
+              "gradient_elements": num_elements,
+              "allreduce_bytes": wire_bytes,
+              "allreduce_time": float(allreduce_mean),
+              "allreduce_bytes_per_sec": wire_bytes / float(allreduce_mean),
+              "step_time": float(step_mean)}
+    print("RESULT {}".format(json.dumps(result)))
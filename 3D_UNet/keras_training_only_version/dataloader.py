@@ -50,7 +50,8 @@ class DataGenerator(K.utils.Sequence):
                  n_out_channels=1,  # Number of channels in mask
                  shuffle=True,  # Shuffle list after each epoch
                  augment=False,   # Augment images
-                 seed=816):     # Seed for random number generator
+                 seed=816,      # Seed for random number generator
+                 channels_first=False):  # Return NCDHW instead of NDHWC
         """
         Initialization
         """
@@ -61,10 +62,21 @@ class DataGenerator(K.utils.Sequence):
         self.n_out_channels = n_out_channels
         self.shuffle = shuffle
         self.augment = augment
+        self.channels_first = channels_first
 
         np.random.seed(seed)
         self.on_epoch_end()   # Generate the sequence
 
+    def set_patch(self, dim, batch_size):
+        """
+        Reconfigure the patch dimension and batch size in place.
+        Used by the patch-size curriculum in train.py so that the
+        same generator (and its shuffled file list) can be reused
+        as the patch grows between epochs.
+        """
+        self.dim = dim
+        self.batch_size = batch_size
+
     def __len__(self):
         """
         The number of batches per epoch
@@ -239,4 +251,10 @@ class DataGenerator(K.utils.Sequence):
 
             idx += 1
 
+        # The files are loaded channels last. Move the channels
+        # next to the batch axis for a channels_first model.
+        if self.channels_first:
+            imgs = np.transpose(imgs, (0, 4, 1, 2, 3))
+            msks = np.transpose(msks, (0, 4, 1, 2, 3))
+
         return imgs, msks
@@ -2,7 +2,13 @@ import numpy as np
 import random
 import os
 import argparse
-import psutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "benchmark_runner"))
+import allocator
+import topology
+
 import time
 import datetime
 import tensorflow as tf
@@ -21,26 +27,35 @@ parser.add_argument("--patch_dim",
                     help="Size of the 3D patch")
 parser.add_argument("--intraop_threads",
                     type=int,
-                    default=psutil.cpu_count(logical=False)-4,
-                    help="Number of intraop threads")
+                    default=None,
+                    help="Number of intraop threads "
+                    "(default: one per physical core)")
 parser.add_argument("--interop_threads",
                     type=int,
-                    default=2,
-                    help="Number of interop threads")
+                    default=None,
+                    help="Number of interop threads "
+                    "(default: one per socket)")
 parser.add_argument("--blocktime",
                     type=int,
                     default=0,
                     help="Block time for CPU threads")
+parser.add_argument("--channels_first",
+                    action="store_true",
+                    default=False,
+                    help="The model was trained with NCDHW (channels_first) "
+                    "tensors")
 parser.add_argument("--model",
                     default="3d_unet_brats2018.hdf5",
                     help="Trained model to load")
 
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
 args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args)
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
-os.environ["OMP_NUM_THREADS"] = str(args.intraop_threads)
-os.environ["KMP_BLOCKTIME"] = str(args.blocktime)
-os.environ["KMP_AFFINITY"] = "granularity=thread,compact,1,0"
 
 # Optimize CPU threads for TensorFlow
 config = tf.ConfigProto(
@@ -50,6 +65,9 @@ config = tf.ConfigProto(
 sess = tf.Session(config=config)
 K.backend.set_session(sess)
 
+# The Dice metrics need the layout before the model is compiled
+set_channels_first(args.channels_first)
+
 model = K.models.load_model(args.model,
                             custom_objects={"dice_coef":dice_coef,
                             "dice_coef_loss":dice_coef_loss,
@@ -62,6 +80,11 @@ print("imgs_test_3d.npy, msks_test_3d.npy")
 imgs = np.load("imgs_test_3d.npy")
 msks = np.load("msks_test_3d.npy")
 
+# The test set is saved channels last
+if args.channels_first:
+    imgs = np.transpose(imgs, (0, 4, 1, 2, 3))
+    msks = np.transpose(msks, (0, 4, 1, 2, 3))
+
 m = model.evaluate(imgs, msks, batch_size=args.bz, verbose=1)
 
 print("Test metrics")
@@ -79,6 +102,13 @@ except:
 
 print("Predicting masks")
 preds = model.predict(imgs, args.bz)
+
+# Back to channels last for the Nifti files
+if args.channels_first:
+    imgs = np.transpose(imgs, (0, 2, 3, 4, 1))
+    msks = np.transpose(msks, (0, 2, 3, 4, 1))
+    preds = np.transpose(preds, (0, 2, 3, 4, 1))
+
 np.save(os.path.join(save_directory, "msks_pred_3d.npy"), preds)
 
 """
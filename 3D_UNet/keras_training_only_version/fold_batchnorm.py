@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Export a trained 3D U-Net for inference with the BatchNormalization
+layers folded into the preceding Conv3D kernel and bias and the
+following ReLU fused into the convolution activation.
+Dropout layers are dropped since they are the identity at inference.
+
+The folded model is checked against the original on random data
+(or a test set) and the per volume latency of both is reported.
+
+    python fold_batchnorm.py --input_filename 3d_unet_brats2018.hdf5 \
+        --output_filename 3d_unet_brats2018_folded.hdf5 \
+        --output_directory saved_3dunet_model_folded
+
+--self_test runs the same check on untrained 3D U-Nets in both layouts
+(channels last and channels first) with random BatchNormalization
+statistics, without a trained model:
+
+    python fold_batchnorm.py --self_test
+"""
+
+import numpy as np
+import os
+import sys
+import argparse
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "benchmark_runner"))
+import allocator
+import topology
+
+parser = argparse.ArgumentParser(
+    description="Fold BatchNormalization into Conv3D for inference",
+    add_help=True)
+parser.add_argument("--input_filename",
+                    default="3d_unet_brats2018.hdf5",
+                    help="Trained Keras model (HDF5)")
+parser.add_argument("--output_filename",
+                    default="3d_unet_brats2018_folded.hdf5",
+                    help="Save the folded Keras model to this file")
+parser.add_argument("--output_directory",
+                    default=None,
+                    help="Also save the folded model as a TensorFlow "
+                    "SavedModel to this directory")
+parser.add_argument("--test_data",
+                    default=None,
+                    help="Numpy file of images to verify on "
+                    "(e.g. imgs_test_3d.npy). Default is random data.")
+parser.add_argument("--bz",
+                    type=int,
+                    default=1,
+                    help="Batch size for verification and timing")
+parser.add_argument("--num_runs",
+                    type=int,
+                    default=10,
+                    help="Number of timed inference runs")
+parser.add_argument("--tolerance",
+                    type=float,
+                    default=1e-5,
+                    help="Maximum absolute difference in the outputs")
+parser.add_argument("--self_test",
+                    action="store_true",
+                    default=False,
+                    help="Check the folding on untrained 3D U-Nets in both "
+                    "layouts instead of --input_filename")
+parser.add_argument("--patch_dim",
+                    type=int,
+                    default=16,
+                    help="Size of the --self_test volumes")
+parser.add_argument("--intraop_threads",
+                    type=int,
+                    default=None,
+                    help="Number of intraop threads "
+                    "(default: one per physical core)")
+parser.add_argument("--interop_threads",
+                    type=int,
+                    default=None,
+                    help="Number of interop threads "
+                    "(default: one per socket)")
+parser.add_argument("--blocktime",
+                    type=int,
+                    default=0,
+                    help="Block time for CPU threads")
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
+
+args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args)
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
+
+import tensorflow as tf
+import keras as K
+
+config = tf.ConfigProto(
+    inter_op_parallelism_threads=args.interop_threads,
+    intra_op_parallelism_threads=args.intraop_threads)
+
+sess = tf.Session(config=config)
+K.backend.set_session(sess)
+K.backend.set_learning_phase(0)   # Inference graph
+
+
+def get_inbound_layers(layer):
+    """
+    Layers that feed into this layer
+    """
+    inputs = layer.input if isinstance(layer.input, list) else [layer.input]
+    return [x._keras_history[0] for x in inputs]
+
+
+def get_consumers(model):
+    """
+    Map each layer name to the list of layers that use its output
+    """
+    consumers = {layer.name: [] for layer in model.layers}
+    for layer in model.layers:
+        if isinstance(layer, K.layers.InputLayer):
+            continue
+        for inbound in get_inbound_layers(layer):
+            consumers[inbound.name].append(layer)
+    return consumers
+
+
+def fold_weights(conv, bn):
+    """
+    Fold the BatchNormalization moving statistics into the
+    convolution kernel and bias.
+    The BN has to normalize the channel axis of the convolution output
+    (the last axis, or axis 1 for channels_first). The output channels
+    are the last axis of the Conv3D kernel in both layouts.
+    """
+    bn_config = bn.get_config()
+    conv_config = conv.get_config()
+    ndim = len(bn.input_shape)
+    axis = bn_config["axis"]
+    if isinstance(axis, (list, tuple)):   # tf.keras saves a list of axes
+        axis = axis[0] if len(axis) == 1 else None
+    channel_axis = 1 if conv_config["data_format"] == "channels_first" \
+        else ndim - 1
+    if (axis is None) or (axis % ndim != channel_axis):
+        raise ValueError("Layer {} normalizes axis {}, but the channels of "
+                         "{} ({}) are axis {}.".format(
+                             bn.name, bn_config["axis"], conv.name,
+                             conv_config["data_format"], channel_axis))
+
+    conv_weights = conv.get_weights()
+    kernel = conv_weights[0]
+    if conv_config["use_bias"]:
+        bias = conv_weights[1]
+    else:
+        bias = np.zeros(kernel.shape[-1], dtype=kernel.dtype)
+
+    bn_weights = list(bn.get_weights())
+    gamma = bn_weights.pop(0) if bn_config["scale"] else 1.0
+    beta = bn_weights.pop(0) if bn_config["center"] else 0.0
+    moving_mean, moving_variance = bn_weights
+
+    scale = gamma / np.sqrt(moving_variance + bn_config["epsilon"])
+    folded_kernel = kernel * scale
+    folded_bias = (bias - moving_mean) * scale + beta
+
+    return [folded_kernel.astype(kernel.dtype), folded_bias.astype(kernel.dtype)]
+
+
+def fold_batchnorm(model):
+    """
+    Rebuild the model layer by layer, replacing every
+    Conv3D -> BatchNormalization (-> ReLU) chain with a single Conv3D.
+    """
+    consumers = get_consumers(model)
+    new_tensors = {}   # Original layer name -> output tensor in new model
+    folded = 0
+
+    for layer in model.layers:
+
+        if isinstance(layer, K.layers.InputLayer):
+            new_tensors[layer.name] = K.layers.Input(
+                batch_shape=layer.batch_input_shape, name=layer.name)
+            continue
+
+        if layer.name in new_tensors:  # Already fused into a convolution
+            continue
+
+        inputs = [new_tensors[l.name] for l in get_inbound_layers(layer)]
+
+        if isinstance(layer, (K.layers.Dropout, K.layers.SpatialDropout3D)):
+            new_tensors[layer.name] = inputs[0]
+            continue
+
+        following = consumers[layer.name]
+        if isinstance(layer, K.layers.Conv3D) and \
+                not isinstance(layer, K.layers.Conv3DTranspose) and \
+                (len(following) == 1) and \
+                isinstance(following[0], K.layers.BatchNormalization):
+
+            bn = following[0]
+            conv_config = layer.get_config()
+            conv_config["use_bias"] = True
+            output_names = [layer.name, bn.name]
+
+            # Fuse the ReLU if it is the only consumer of the BN
+            after_bn = consumers[bn.name]
+            if (conv_config["activation"] == "linear") and \
+                    (len(after_bn) == 1) and \
+                    isinstance(after_bn[0], K.layers.Activation) and \
+                    (after_bn[0].get_config()["activation"] == "relu"):
+                conv_config["activation"] = "relu"
+                output_names.append(after_bn[0].name)
+
+            new_layer = K.layers.Conv3D.from_config(conv_config)
+            x = new_layer(inputs[0])
+            new_layer.set_weights(fold_weights(layer, bn))
+            for name in output_names:
+                new_tensors[name] = x
+            folded += 1
+            continue
+
+        new_layer = layer.__class__.from_config(layer.get_config())
+        x = new_layer(inputs if len(inputs) > 1 else inputs[0])
+        new_layer.set_weights(layer.get_weights())
+        new_tensors[layer.name] = x
+
+    outputs = [new_tensors[x._keras_history[0].name] for x in model.outputs]
+    inputs = [new_tensors[x._keras_history[0].name] for x in model.inputs]
+    new_model = K.models.Model(inputs=inputs, outputs=outputs,
+                               name=model.name + "_folded")
+
+    print("Folded {} BatchNormalization layers".format(folded))
+
+    return new_model
+
+
+def time_inference(model, imgs):
+    """
+    Average seconds per volume for model.predict
+    """
+    model.predict(imgs, batch_size=args.bz)   # Warm up
+    start_time = time.time()
+    for _ in range(args.num_runs):
+        model.predict(imgs, batch_size=args.bz)
+    return (time.time() - start_time) / (args.num_runs * imgs.shape[0])
+
+
+def get_data_format(model):
+    """
+    Layout of the model, from its first convolution
+    """
+    for layer in model.layers:
+        if isinstance(layer, K.layers.Conv3D):
+            return layer.get_config()["data_format"]
+    return "channels_last"
+
+
+def check_folding(model, imgs):
+    """
+    Fold the model, compare the outputs of both models on imgs
+    and report their latency.
+    Returns the folded model and the maximum absolute difference.
+    """
+    folded_model = fold_batchnorm(model)
+
+    preds = model.predict(imgs, batch_size=args.bz)
+    folded_preds = folded_model.predict(imgs, batch_size=args.bz)
+    max_diff = np.max(np.abs(preds - folded_preds))
+    print("Maximum absolute difference in outputs = {:.3e}".format(max_diff))
+
+    original_latency = time_inference(model, imgs)
+    folded_latency = time_inference(folded_model, imgs)
+    print("Original model latency = {:.4f} seconds per volume".format(
+        original_latency))
+    print("Folded model latency   = {:.4f} seconds per volume".format(
+        folded_latency))
+    print("Speedup = {:.2f}x".format(original_latency / folded_latency))
+
+    return folded_model, max_diff
+
+
+if args.self_test:
+
+    from model import unet_3d, set_channels_first
+
+    failed = []
+    for data_format in ["channels_last", "channels_first"]:
+        print("Self test, {}".format(data_format))
+        channels_first = data_format == "channels_first"
+        set_channels_first(channels_first)
+        shape = [args.patch_dim] * 3
+        shape = [1] + shape if channels_first else shape + [1]
+        model, _ = unet_3d(shape)
+
+        # Untrained BN layers are the identity, so give them statistics
+        for layer in model.layers:
+            if isinstance(layer, K.layers.BatchNormalization):
+                weights = layer.get_weights()
+                layer.set_weights([np.random.uniform(0.5, 1.5, w.shape)
+                                   for w in weights])
+
+        imgs = np.random.rand(args.bz, *shape)
+        _, max_diff = check_folding(model, imgs)
+        if max_diff > args.tolerance:
+            failed.append(data_format)
+
+    if failed:
+        print("ERROR: Outputs differ by more than {} for {}".format(
+            args.tolerance, ", ".join(failed)))
+        sys.exit(1)
+    print("Self test passed")
+    sys.exit(0)
+
+print("Loading saved Keras model {}".format(args.input_filename))
+# The custom losses and metrics are only needed for training
+model = K.models.load_model(args.input_filename, compile=False)
+
+if args.test_data is not None:
+    imgs = np.load(args.test_data, mmap_mode="r")[:args.bz]
+    # The test set is saved channels last
+    if get_data_format(model) == "channels_first":
+        imgs = np.transpose(imgs, (0, 4, 1, 2, 3))
+else:
+    imgs = np.random.rand(args.bz, *model.input_shape[1:])
+
+folded_model, max_diff = check_folding(model, imgs)
+folded_model.summary()
+
+if max_diff > args.tolerance:
+    print("ERROR: Outputs differ by more than {}. "
+          "Not saving the folded model.".format(args.tolerance))
+    sys.exit(1)
+
+folded_model.save(args.output_filename, include_optimizer=False)
+print("Saved folded Keras model to {}".format(args.output_filename))
+
+if args.output_directory is not None:
+
+    signature = tf.saved_model.signature_def_utils.predict_signature_def(
+        inputs={"input": folded_model.input},
+        outputs={"output": folded_model.output})
+
+    builder = tf.saved_model.builder.SavedModelBuilder(args.output_directory)
+    builder.add_meta_graph_and_variables(
+        sess=K.backend.get_session(),
+        tags=[tf.saved_model.tag_constants.SERVING],
+        signature_def_map={
+            tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY:
+                signature
+        })
+    builder.save()
+    print("Saved folded TensorFlow SavedModel to {}".format(
+        args.output_directory))
@@ -23,12 +23,14 @@ import tensorflow as tf
 import keras as K
 
 
-def dice_coef(y_true, y_pred, axis=(1, 2, 3), smooth=1.):
+def dice_coef(y_true, y_pred, axis=None, smooth=1.):
     """
     Sorenson (Soft) Dice
     2 * |TP| / |T|*|P|
     where T is ground truth mask and P is the prediction mask
     """
+    if axis is None:
+        axis = get_spatial_axis(y_pred)
     intersection = tf.reduce_sum(y_true * y_pred, axis=axis)
     union = tf.reduce_sum(y_true + y_pred, axis=axis)
     numerator = tf.constant(2.) * intersection + smooth
@@ -38,13 +40,15 @@ def dice_coef(y_true, y_pred, axis=(1, 2, 3), smooth=1.):
     return tf.reduce_mean(coef)
 
 
-def dice_coef_loss(target, prediction, axis=(1, 2, 3), smooth=1.):
+def dice_coef_loss(target, prediction, axis=None, smooth=1.):
     """
     Sorenson (Soft) Dice loss
     Using -log(Dice) as the loss since it is better behaved.
     Also, the log allows avoidance of the division which
     can help prevent underflow when the numbers are very small.
     """
+    if axis is None:
+        axis = get_spatial_axis(prediction)
     intersection = tf.reduce_sum(prediction * target, axis=axis)
     p = tf.reduce_sum(prediction, axis=axis)
     t = tf.reduce_sum(target, axis=axis)
@@ -55,7 +59,7 @@ def dice_coef_loss(target, prediction, axis=(1, 2, 3), smooth=1.):
     return dice_loss
 
 
-def combined_dice_ce_loss(target, prediction, axis=(1, 2, 3), smooth=1., weight=.7):
+def combined_dice_ce_loss(target, prediction, axis=None, smooth=1., weight=.7):
     """
     Combined Dice and Binary Cross Entropy Loss
     """
@@ -64,13 +68,37 @@ def combined_dice_ce_loss(target, prediction, axis=(1, 2, 3), smooth=1., weight=
 
 
 CHANNEL_LAST = True
-if CHANNEL_LAST:
-    concat_axis = -1
-    data_format = "channels_last"
+concat_axis = -1
+data_format = "channels_last"
 
-else:
-    concat_axis = 1
-    data_format = "channels_first"
+
+def set_channels_first(channels_first=True):
+    """
+    Build the models with NCDHW (channels_first) instead of NDHWC
+    (channels_last) tensors. Call this before the model is defined.
+    """
+    global CHANNEL_LAST, concat_axis, data_format
+    CHANNEL_LAST = not channels_first
+    if CHANNEL_LAST:
+        concat_axis = -1
+        data_format = "channels_last"
+    else:
+        concat_axis = 1
+        data_format = "channels_first"
+
+    # The pooling and upsampling layers use the Keras default format
+    K.backend.set_image_data_format(data_format)
+
+
+def get_spatial_axis(tensor):
+    """
+    Image axes of the tensor (all but the batch and channel axes)
+    """
+    ndim = len(tensor.get_shape())
+    if CHANNEL_LAST:
+        return tuple(range(1, ndim-1))
+    else:
+        return tuple(range(2, ndim))
 
 
 def unet_3d(input_shape, use_upsampling=False, learning_rate=0.001,
@@ -88,39 +116,39 @@ def unet_3d(input_shape, use_upsampling=False, learning_rate=0.001,
                   kernel_regularizer=K.regularizers.l2(1e-5))
 
     conv1 = K.layers.Conv3D(name="conv1a", filters=32, **params)(inputs)
-    conv1 = K.layers.BatchNormalization()(conv1)
+    conv1 = K.layers.BatchNormalization(axis=concat_axis)(conv1)
     conv1 = K.layers.Activation("relu")(conv1)
     conv1 = K.layers.Conv3D(name="conv1b", filters=64, **params)(conv1)
-    conv1 = K.layers.BatchNormalization()(conv1)
+    conv1 = K.layers.BatchNormalization(axis=concat_axis)(conv1)
     conv1 = K.layers.Activation("relu")(conv1)
     pool1 = K.layers.MaxPooling3D(name="pool1", pool_size=(2, 2, 2))(conv1)
 
     conv2 = K.layers.Conv3D(name="conv2a", filters=64, **params)(pool1)
-    conv2 = K.layers.BatchNormalization()(conv2)
+    conv2 = K.layers.BatchNormalization(axis=concat_axis)(conv2)
     conv2 = K.layers.Activation("relu")(conv2)
     conv2 = K.layers.Conv3D(name="conv2b", filters=128, **params)(conv2)
-    conv2 = K.layers.BatchNormalization()(conv2)
+    conv2 = K.layers.BatchNormalization(axis=concat_axis)(conv2)
     conv2 = K.layers.Activation("relu")(conv2)
     pool2 = K.layers.MaxPooling3D(name="pool2", pool_size=(2, 2, 2))(conv2)
 
     conv3 = K.layers.Conv3D(name="conv3a", filters=128, **params)(pool2)
-    conv3 = K.layers.BatchNormalization()(conv3)
+    conv3 = K.layers.BatchNormalization(axis=concat_axis)(conv3)
     conv3 = K.layers.Activation("relu")(conv3)
     # Trying dropout layers earlier on, as indicated in the paper
     conv3 = K.layers.SpatialDropout3D(dropout)(conv3)
     conv3 = K.layers.Conv3D(name="conv3b", filters=256, **params)(conv3)
-    conv3 = K.layers.BatchNormalization()(conv3)
+    conv3 = K.layers.BatchNormalization(axis=concat_axis)(conv3)
     conv3 = K.layers.Activation("relu")(conv3)
     pool3 = K.layers.MaxPooling3D(name="pool3", pool_size=(2, 2, 2))(conv3)
 
     conv4 = K.layers.Conv3D(name="conv4a", filters=256, **params)(pool3)
-    conv4 = K.layers.BatchNormalization()(conv4)
+    conv4 = K.layers.BatchNormalization(axis=concat_axis)(conv4)
     conv4 = K.layers.Activation("relu")(conv4)
     # Trying dropout layers earlier on, as indicated in the paper
     conv4 = K.layers.SpatialDropout3D(dropout)(conv4)
 
     conv4 = K.layers.Conv3D(name="conv4b", filters=512, **params)(conv4)
-    conv4 = K.layers.BatchNormalization()(conv4)
+    conv4 = K.layers.BatchNormalization(axis=concat_axis)(conv4)
     conv4 = K.layers.Activation("relu")(conv4)
 
     if use_upsampling:
@@ -137,10 +165,10 @@ def unet_3d(input_shape, use_upsampling=False, learning_rate=0.001,
     up4 = K.layers.concatenate([up, conv3], axis=concat_axis)
 
     conv5 = K.layers.Conv3D(name="conv5a", filters=256, **params)(up4)
-    conv5 = K.layers.BatchNormalization()(conv5)
+    conv5 = K.layers.BatchNormalization(axis=concat_axis)(conv5)
     conv5 = K.layers.Activation("relu")(conv5)
     conv5 = K.layers.Conv3D(name="conv5b", filters=256, **params)(conv5)
-    conv5 = K.layers.BatchNormalization()(conv5)
+    conv5 = K.layers.BatchNormalization(axis=concat_axis)(conv5)
     conv5 = K.layers.Activation("relu")(conv5)
 
     if use_upsampling:
@@ -157,10 +185,10 @@ def unet_3d(input_shape, use_upsampling=False, learning_rate=0.001,
     up5 = K.layers.concatenate([up, conv2], axis=concat_axis)
 
     conv6 = K.layers.Conv3D(name="conv6a", filters=128, **params)(up5)
-    conv6 = K.layers.BatchNormalization()(conv6)
+    conv6 = K.layers.BatchNormalization(axis=concat_axis)(conv6)
     conv6 = K.layers.Activation("relu")(conv6)
     conv6 = K.layers.Conv3D(name="conv6b", filters=128, **params)(conv6)
-    conv6 = K.layers.BatchNormalization()(conv6)
+    conv6 = K.layers.BatchNormalization(axis=concat_axis)(conv6)
     conv6 = K.layers.Activation("relu")(conv6)
 
     if use_upsampling:
@@ -177,10 +205,10 @@ def unet_3d(input_shape, use_upsampling=False, learning_rate=0.001,
     up6 = K.layers.concatenate([up, conv1], axis=concat_axis)
 
     conv7 = K.layers.Conv3D(name="conv7a", filters=64, **params)(up6)
-    conv7 = K.layers.BatchNormalization()(conv7)
+    conv7 = K.layers.BatchNormalization(axis=concat_axis)(conv7)
     conv7 = K.layers.Activation("relu")(conv7)
     conv7 = K.layers.Conv3D(name="conv7b", filters=64, **params)(conv7)
-    conv7 = K.layers.BatchNormalization()(conv7)
+    conv7 = K.layers.BatchNormalization(axis=concat_axis)(conv7)
     conv7 = K.layers.Activation("relu")(conv7)
     pred = K.layers.Conv3D(name="Prediction_Mask", filters=n_cl_out,
                            kernel_size=(1, 1, 1),
@@ -198,20 +226,24 @@ def unet_3d(input_shape, use_upsampling=False, learning_rate=0.001,
     return model, opt
 
 
-def sensitivity(target, prediction, axis=(1, 2, 3), smooth=1.):
+def sensitivity(target, prediction, axis=None, smooth=1.):
     """
     Sensitivity
     """
+    if axis is None:
+        axis = get_spatial_axis(prediction)
     intersection = tf.reduce_sum(prediction * target, axis=axis)
     coef = (intersection + smooth) / (tf.reduce_sum(target,
                                                     axis=axis) + smooth)
     return tf.reduce_mean(coef)
 
 
-def specificity(target, prediction, axis=(1, 2, 3), smooth=1.):
+def specificity(target, prediction, axis=None, smooth=1.):
     """
     Specificity
     """
+    if axis is None:
+        axis = get_spatial_axis(prediction)
     intersection = tf.reduce_sum(prediction * target, axis=axis)
     coef = (intersection + smooth) / (tf.reduce_sum(prediction,
                                                     axis=axis) + smooth)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Post-training INT8 quantization of an ONNX U-Net for CPU inference.
+
+Convert the Keras 3D model first with convert_keras_to_onnx_model.py, or
+the 2D checkpoint of distributed_unet/Horovod/main.py with
+distributed_unet/Horovod/convert_checkpoint_to_onnx.py.
+Calibration runs patches from the memory mapped test set through the
+FP32 model and records the range of every activation tensor. The ranges
+are saved to JSON and ONNX Runtime static quantization writes the
+INT8 model. The Dice and throughput of the FP32 and INT8 models are
+then compared.
+
+3D U-Net (imgs_test_3d.npy from load_brats_images.py):
+    python quantize_onnx_model.py \
+        --input_filename saved_3dunet_model_onnx/onnx_model.onnx \
+        --imgs imgs_test_3d.npy --msks msks_test_3d.npy
+
+2D U-Net from distributed_unet (mode 1 = whole tumor from FLAIR):
+    python ../../distributed_unet/Horovod/convert_checkpoint_to_onnx.py \
+        --checkpoint_dir <output_path>/no_hvd/<date>
+    python quantize_onnx_model.py \
+        --input_filename saved_2dunet_model_onnx/onnx_model.onnx \
+        --imgs imgs_test.npy --msks msks_test.npy \
+        --image_channel 2 --mask_channels 0 1 2 3
+"""
+
+import numpy as np
+import os
+import argparse
+import sys
+import time
+import json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "benchmark_runner"))
+import allocator
+import topology
+
+parser = argparse.ArgumentParser(
+    description="INT8 quantization of an ONNX U-Net", add_help=True)
+parser.add_argument("--input_filename",
+                    default=os.path.join("saved_3dunet_model_onnx",
+                                         "onnx_model.onnx"),
+                    help="FP32 ONNX model")
+parser.add_argument("--output_filename",
+                    default=None,
+                    help="INT8 ONNX model (default is <input>_int8.onnx)")
+parser.add_argument("--imgs",
+                    default="imgs_test_3d.npy",
+                    help="Numpy file of test images")
+parser.add_argument("--msks",
+                    default="msks_test_3d.npy",
+                    help="Numpy file of test masks")
+parser.add_argument("--image_channel",
+                    type=int,
+                    default=0,
+                    help="Channel of the image file to use as the input")
+parser.add_argument("--mask_channels",
+                    type=int,
+                    nargs="+",
+                    default=None,
+                    help="Channels of the mask file to combine (default all)")
+parser.add_argument("--num_calibration",
+                    type=int,
+                    default=32,
+                    help="Number of patches used for calibration")
+parser.add_argument("--num_eval",
+                    type=int,
+                    default=None,
+                    help="Number of patches used to compare Dice "
+                    "(default is the rest of the test set)")
+parser.add_argument("--per_channel",
+                    action="store_true",
+                    default=False,
+                    help="Quantize the weights per output channel")
+parser.add_argument("--bz",
+                    type=int,
+                    default=8,
+                    help="Batch size N for the throughput comparison")
+parser.add_argument("--num_runs",
+                    type=int,
+                    default=10,
+                    help="Number of timed batches")
+parser.add_argument("--intraop_threads",
+                    type=int,
+                    default=None,
+                    help="Number of intraop threads "
+                    "(default: one per physical core)")
+parser.add_argument("--interop_threads",
+                    type=int,
+                    default=None,
+                    help="Number of interop threads "
+                    "(default: one per socket)")
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
+
+args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args, blocktime=None)
+
+import onnxruntime as ort
+from onnxruntime.quantization import CalibrationDataReader, \
+    CalibrationMethod, QuantFormat, QuantType, create_calibrator, \
+    quantize_static
+
+if args.output_filename is None:
+    args.output_filename = os.path.splitext(args.input_filename)[0] + \
+        "_int8.onnx"
+
+
+def get_patches(start, stop):
+    """
+    Read patches from the memory mapped test set.
+    Only the requested rows are loaded into memory.
+    """
+    imgs = np.load(args.imgs, mmap_mode="r")
+    msks = np.load(args.msks, mmap_mode="r")
+    stop = min(stop, imgs.shape[0])
+
+    img = imgs[start:stop, ..., args.image_channel:args.image_channel+1]
+    if args.mask_channels is None:
+        msk = np.sum(msks[start:stop], axis=-1, keepdims=True)
+    else:
+        msk = np.sum(msks[start:stop, ..., args.mask_channels], axis=-1,
+                     keepdims=True)
+
+    return img.astype(np.float32), (msk > 0).astype(np.float32)
+
+
+class PatchDataReader(CalibrationDataReader):
+    """
+    Feeds the calibration patches to ONNX Runtime one at a time
+    """
+
+    def __init__(self, imgs, input_name):
+        self.imgs = imgs
+        self.input_name = input_name
+        self.idx = 0
+
+    def get_next(self):
+        if self.idx >= self.imgs.shape[0]:
+            return None
+        batch = {self.input_name: self.imgs[self.idx:self.idx+1]}
+        self.idx += 1
+        return batch
+
+    def rewind(self):
+        self.idx = 0
+
+
+def get_session(filename):
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = args.intraop_threads
+    options.inter_op_num_threads = args.interop_threads
+    return ort.InferenceSession(filename, options,
+                                providers=["CPUExecutionProvider"])
+
+
+def collect_ranges(reader):
+    """
+    Run the calibration data through the model and
+    return the (min, max) of every activation tensor
+    """
+    calibrator = create_calibrator(args.input_filename,
+                                   augmented_model_path=os.path.splitext(
+                                       args.output_filename)[0] +
+                                   "_augmented.onnx",
+                                   calibrate_method=CalibrationMethod.MinMax)
+    calibrator.collect_data(reader)
+
+    if hasattr(calibrator, "compute_data"):
+        tensors = calibrator.compute_data()
+        tensors = getattr(tensors, "data", tensors)
+    else:  # Older versions of ONNX Runtime
+        tensors = calibrator.compute_range()
+
+    ranges = {}
+    for name, value in tensors.items():
+        low, high = getattr(value, "range_value", value)
+        ranges[name] = [float(np.min(low)), float(np.max(high))]
+
+    return ranges
+
+
+def dice(pred, truth, smooth=1.0):
+    """
+    Dice of each patch with the prediction thresholded at 0.5
+    """
+    axis = tuple(range(1, pred.ndim))
+    pred = (pred > 0.5).astype(np.float32)
+    numerator = 2. * np.sum(pred * truth, axis=axis) + smooth
+    denominator = np.sum(pred, axis=axis) + np.sum(truth, axis=axis) + smooth
+    return numerator / denominator
+
+
+def predict(session, imgs, batch_size):
+    input_name = session.get_inputs()[0].name
+    preds = []
+    for idx in range(0, imgs.shape[0], batch_size):
+        preds.append(session.run(None,
+                     {input_name: imgs[idx:idx+batch_size]})[0])
+    return np.concatenate(preds)
+
+
+def throughput(session, imgs, batch_size):
+    """
+    Images per second for a single batch size
+    """
+    input_name = session.get_inputs()[0].name
+    batch = {input_name: np.repeat(imgs[:1], batch_size, axis=0)}
+    session.run(None, batch)   # Warm up
+    start_time = time.time()
+    for _ in range(args.num_runs):
+        session.run(None, batch)
+    return (args.num_runs * batch_size) / (time.time() - start_time)
+
+
+fp32_session = get_session(args.input_filename)
+input_name = fp32_session.get_inputs()[0].name
+
+calibration_imgs, _ = get_patches(0, args.num_calibration)
+print("Calibrating on {} patches".format(calibration_imgs.shape[0]))
+
+reader = PatchDataReader(calibration_imgs, input_name)
+ranges = collect_ranges(reader)
+ranges_filename = os.path.splitext(args.output_filename)[0] + \
+    "_calibration.json"
+with open(ranges_filename, "w") as f:
+    json.dump(ranges, f, indent=2, sort_keys=True)
+print("Saved activation ranges for {} tensors to {}".format(
+    len(ranges), ranges_filename))
+
+reader.rewind()
+quantize_static(args.input_filename, args.output_filename, reader,
+                quant_format=QuantFormat.QDQ,
+                per_channel=args.per_channel,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                calibrate_method=CalibrationMethod.MinMax)
+print("Saved INT8 model to {}".format(args.output_filename))
+
+int8_session = get_session(args.output_filename)
+
+if args.num_eval is None:
+    eval_stop = np.load(args.imgs, mmap_mode="r").shape[0]
+else:
+    eval_stop = args.num_calibration + args.num_eval
+eval_imgs, eval_msks = get_patches(args.num_calibration, eval_stop)
+if eval_imgs.shape[0] == 0:  # Small test set so reuse the calibration set
+    eval_imgs, eval_msks = get_patches(0, args.num_calibration)
+
+fp32_dice = np.mean(dice(predict(fp32_session, eval_imgs, args.bz), eval_msks))
+int8_dice = np.mean(dice(predict(int8_session, eval_imgs, args.bz), eval_msks))
+
+report = {"num_eval": int(eval_imgs.shape[0]),
+          "fp32_dice": float(fp32_dice),
+          "int8_dice": float(int8_dice),
+          "dice_delta": float(int8_dice - fp32_dice)}
+
+for batch_size in sorted(set([1, args.bz])):
+    fp32_speed = throughput(fp32_session, eval_imgs, batch_size)
+    int8_speed = throughput(int8_session, eval_imgs, batch_size)
+    report["fp32_images_per_sec_bz{}".format(batch_size)] = fp32_speed
+    report["int8_images_per_sec_bz{}".format(batch_size)] = int8_speed
+    report["int8_speedup_bz{}".format(batch_size)] = int8_speed / fp32_speed
+
+print("\nMean Dice on {} patches: FP32 = {:.4f}, INT8 = {:.4f} "
+      "(delta = {:+.4f})".format(report["num_eval"], fp32_dice, int8_dice,
+                                 int8_dice - fp32_dice))
+for batch_size in sorted(set([1, args.bz])):
+    print("Batch size {}: FP32 = {:.2f} images/sec, INT8 = {:.2f} images/sec "
+          "({:.2f}x)".format(batch_size,
+                             report["fp32_images_per_sec_bz{}".format(batch_size)],
+                             report["int8_images_per_sec_bz{}".format(batch_size)],
+                             report["int8_speedup_bz{}".format(batch_size)]))
+
+report_filename = os.path.splitext(args.output_filename)[0] + "_report.json"
+with open(report_filename, "w") as f:
+    json.dump(report, f, indent=2)
+print("Saved report to {}".format(report_filename))
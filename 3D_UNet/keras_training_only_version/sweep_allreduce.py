@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Sweep the Horovod communication settings (compression, fusion buffer
+threshold and cycle time) with local multi-process runs of
+benchmark_allreduce.py and print allreduce bandwidth and step time
+for each setting.
+
+    python sweep_allreduce.py --num_workers 2 4 \
+        --fusion_threshold_mb 0 16 64 128 --cycle_time_ms 1 5 10
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+
+parser = argparse.ArgumentParser(
+    description="Sweep Horovod communication settings", add_help=True)
+parser.add_argument("--num_workers", type=int, nargs="+", default=[2],
+                    help="Number of local processes")
+parser.add_argument("--compression", nargs="+", default=["none", "fp16"],
+                    choices=["none", "fp16"],
+                    help="Gradient compression settings to try")
+parser.add_argument("--fusion_threshold_mb", type=float, nargs="+",
+                    default=[0, 16, 64, 128],
+                    help="Fusion buffer sizes (MB) to try. 0 disables fusion.")
+parser.add_argument("--cycle_time_ms", type=float, nargs="+",
+                    default=[1, 5, 10],
+                    help="Cycle times (ms) to try")
+parser.add_argument("--mpirun", default="mpirun --allow-run-as-root "
+                    "--bind-to socket --oversubscribe",
+                    help="MPI launcher command")
+parser.add_argument("--output", default="allreduce_sweep.json",
+                    help="Save all of the results to this file")
+args, benchmark_args = parser.parse_known_args()
+
+benchmark_script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "benchmark_allreduce.py")
+
+
+def run_setting(num_workers, compression, fusion_threshold_mb, cycle_time_ms):
+    """
+    Launch one multi-process run and parse the RESULT line from rank 0
+    """
+    cmd = args.mpirun.split() + ["-np", str(num_workers),
+           sys.executable, benchmark_script,
+           "--compression", compression,
+           "--fusion_threshold_mb", str(fusion_threshold_mb),
+           "--cycle_time_ms", str(cycle_time_ms)] + benchmark_args
+
+    print(" ".join(cmd))
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT,
+                          universal_newlines=True)
+
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+
+    print(proc.stdout[-2000:])
+    print("Run failed with return code {}".format(proc.returncode))
+    return None
+
+
+results = []
+for num_workers, compression, fusion, cycle in itertools.product(
+        args.num_workers, args.compression,
+        args.fusion_threshold_mb, args.cycle_time_ms):
+    result = run_setting(num_workers, compression, fusion, cycle)
+    if result is not None:
+        results.append(result)
+
+with open(args.output, "w") as f:
+    json.dump(results, f, indent=2)
+print("Saved results to {}".format(args.output))
+
+print("\n{:>7} {:>11} {:>10} {:>9} {:>12} {:>13}".format(
+    "workers", "compression", "fusion_MB", "cycle_ms",
+    "allreduce_MB/s", "step_time_s"))
+for r in sorted(results, key=lambda r: (r["num_workers"], r["step_time"])):
+    print("{:>7} {:>11} {:>10} {:>9} {:>14.1f} {:>13.4f}".format(
+        r["num_workers"], r["compression"], r["fusion_threshold_mb"],
+        r["cycle_time_ms"], r["allreduce_bytes_per_sec"] / 1e6,
+        r["step_time"]))
+
+for num_workers in args.num_workers:
+    runs = [r for r in results if r["num_workers"] == num_workers]
+    if len(runs) > 0:
+        best = min(runs, key=lambda r: r["step_time"])
+        print("\nBest setting for {} workers: --compression {} "
+              "--fusion_threshold_mb {} --cycle_time_ms {}".format(
+                  num_workers, best["compression"],
+                  best["fusion_threshold_mb"], best["cycle_time_ms"]))
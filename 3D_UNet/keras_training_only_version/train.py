@@ -22,7 +22,13 @@ import random
 import os
 import sys
 import argparse
-import psutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "benchmark_runner"))
+import allocator
+import autotune
+import topology
+
 import time
 import datetime
 import tensorflow as tf
@@ -31,7 +37,6 @@ from model import *
 from dataloader import DataGenerator
 
 import horovod.keras as hvd
-hvd.init()
 
 parser = argparse.ArgumentParser(
     description="Train 3D U-Net model", add_help=True)
@@ -43,6 +48,17 @@ parser.add_argument("--patch_dim",
                     type=int,
                     default=128,
                     help="Size of the 3D patch")
+parser.add_argument("--patch_schedule",
+                    default=None,
+                    help="Patch size curriculum as comma separated "
+                    "dim:epochs stages (e.g. 64:5,96:5,128). "
+                    "The last stage runs for the remaining epochs. "
+                    "Batch size is scaled so that memory stays constant "
+                    "relative to --patch_dim and --bz.")
+parser.add_argument("--target_dice",
+                    type=float,
+                    default=0.8,
+                    help="Report the time taken to reach this validation Dice")
 parser.add_argument("--lr",
                     type=float,
                     default=0.004,
@@ -57,16 +73,19 @@ parser.add_argument("--epochs",
                     help="Number of epochs")
 parser.add_argument("--intraop_threads",
                     type=int,
-                    default=psutil.cpu_count(logical=False)-4,
-                    help="Number of intraop threads")
+                    default=None,
+                    help="Number of intraop threads "
+                    "(default: one per physical core)")
 parser.add_argument("--interop_threads",
                     type=int,
-                    default=1,
-                    help="Number of interop threads")
+                    default=None,
+                    help="Number of interop threads "
+                    "(default: one per socket)")
 parser.add_argument("--blocktime",
                     type=int,
-                    default=1,
-                    help="Block time for CPU threads")
+                    default=None,
+                    help="Block time for CPU threads "
+                    "(default: tuned, or 1)")
 parser.add_argument("--number_input_channels",
                     type=int,
                     default=1,
@@ -79,25 +98,59 @@ parser.add_argument("--use_upsampling",
                     action="store_true",
                     default=False,
                     help="Use upsampling instead of transposed convolution")
+parser.add_argument("--channels_first",
+                    action="store_true",
+                    default=False,
+                    help="Use NCDHW (channels_first) instead of NDHWC tensors")
 datapath = "../../../data/Brats2018/"
 parser.add_argument("--data_path",
                     default=datapath,
                     help="Root directory for BraTS 2018 dataset")
 
-if hvd.rank() == 0:
-    model_filename = "./saved_model_{}workers/3d_unet_brats2018.hdf5".format(hvd.size())
-else:
-    model_filename = "./saved_model_{}workers/3d_unet_brats2018_worker{}.hdf5".format(hvd.size(),hvd.rank())
 parser.add_argument("--saved_model",
-                    default=model_filename,
+                    default=None,
                     help="Save model to this path")
+parser.add_argument("--compression",
+                    default="none",
+                    choices=["none", "fp16"],
+                    help="Compress the gradients for the Horovod allreduce")
+parser.add_argument("--fusion_threshold_mb",
+                    type=float,
+                    default=None,
+                    help="Horovod tensor fusion buffer size in MB "
+                    "(Horovod default is 64)")
+parser.add_argument("--cycle_time_ms",
+                    type=float,
+                    default=None,
+                    help="Horovod cycle time in ms (Horovod default is 5)")
 
+topology.add_arguments(parser)
+autotune.add_arguments(parser)
+allocator.add_arguments(parser)
 args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+# Bind to this process's share of the cores, with the settings found by
+# "run_sweep.py autotune" on this host if any
+topology.setup_threads(args, default_blocktime=1, model="unet3d",
+                       dim_length=args.patch_dim, bz=args.bz)
+
+# Horovod reads the fusion settings when it is initialized
+if args.fusion_threshold_mb is not None:
+    os.environ["HOROVOD_FUSION_THRESHOLD"] = str(
+        int(args.fusion_threshold_mb * 1024 * 1024))
+if args.cycle_time_ms is not None:
+    os.environ["HOROVOD_CYCLE_TIME"] = str(args.cycle_time_ms)
+
+hvd.init()
+
+if args.saved_model is None:
+    if hvd.rank() == 0:
+        args.saved_model = "./saved_model_{}workers/3d_unet_brats2018.hdf5".format(hvd.size())
+    else:
+        args.saved_model = "./saved_model_{}workers/3d_unet_brats2018_worker{}.hdf5".format(hvd.size(),hvd.rank())
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
-os.environ["OMP_NUM_THREADS"] = str(args.intraop_threads)
-os.environ["KMP_BLOCKTIME"] = str(args.blocktime)
-os.environ["KMP_AFFINITY"] = "granularity=thread,compact,1,0"
 
 if hvd.rank() == 0:
     os.system("lscpu")
@@ -141,8 +194,53 @@ def get_file_list(data_path=args.data_path):
     return trainList, testList
 
 
-input_shape = [args.patch_dim, args.patch_dim, args.patch_dim,
-               args.number_input_channels]
+def get_patch_schedule(schedule, total_epochs):
+    """
+    Parse the --patch_schedule string into a list of
+    (patch_dim, batch_size, initial_epoch, last_epoch) stages.
+
+    The batch size for each stage is scaled by the ratio of voxels
+    to the final --patch_dim so that the activation memory is roughly
+    the same as training at --patch_dim with --bz.
+    """
+    stages = []
+    start_epoch = 0
+    entries = schedule.split(",")
+    for idx, entry in enumerate(entries):
+        fields = entry.split(":")
+        dim = int(fields[0])
+        if (dim % 8) != 0:
+            parser.error("Patch dimension {} must be divisible by 8 "
+                         "(3 max pooling layers)".format(dim))
+
+        if (len(fields) > 1) and (idx < len(entries)-1):
+            stop_epoch = min(start_epoch + int(fields[1]), total_epochs)
+        else:  # Last stage runs for the remaining epochs
+            stop_epoch = total_epochs
+
+        bz = max(1, int(args.bz * (float(args.patch_dim) / dim)**3))
+        if stop_epoch > start_epoch:
+            stages.append((dim, bz, start_epoch, stop_epoch))
+        start_epoch = stop_epoch
+
+    return stages
+
+
+set_channels_first(args.channels_first)
+
+if args.patch_schedule is not None:
+    patch_schedule = get_patch_schedule(args.patch_schedule, args.epochs)
+    # The model is fully convolutional so leave the spatial
+    # dimensions undefined and let the patch size change between stages.
+    input_shape = [None, None, None]
+else:
+    patch_schedule = [(args.patch_dim, args.bz, 0, args.epochs)]
+    input_shape = [args.patch_dim, args.patch_dim, args.patch_dim]
+
+if args.channels_first:
+    input_shape = [args.number_input_channels] + input_shape
+else:
+    input_shape = input_shape + [args.number_input_channels]
 
 
 if (hvd.rank() == 0):
@@ -161,7 +259,12 @@ model, opt = unet_3d(input_shape=input_shape,
                 dropout=0.2,
                 print_summary=print_summary)
 
-opt = hvd.DistributedOptimizer(opt)
+if args.compression == "fp16":
+    compression = hvd.Compression.fp16
+else:
+    compression = hvd.Compression.none
+
+opt = hvd.DistributedOptimizer(opt, compression=compression)
 
 model.compile(optimizer=opt,
               #loss=[combined_dice_ce_loss],
@@ -181,6 +284,62 @@ except:
 # if os.path.isfile(args.saved_model):
 #     model.load_weights(args.saved_model)
 
+class TimeToTargetCallback(K.callbacks.Callback):
+    """
+    Record the wall time (since the start of training) when the
+    validation Dice first reaches the target. This lets us compare
+    the patch size curriculum against the fixed patch size baseline.
+    """
+
+    def __init__(self, target, start_time):
+        super(TimeToTargetCallback, self).__init__()
+        self.target = target
+        self.start_time = start_time
+        self.target_epoch = None
+        self.target_time = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        dice = logs.get("val_dice_coef")
+        if (self.target_time is None) and (dice is not None) and \
+                (dice >= self.target):
+            self.target_epoch = epoch + 1
+            self.target_time = time.time() - self.start_time
+
+
+# Each stage of the patch schedule is a new fit_generator call, which
+# starts the callbacks again. These two keep their state across stages.
+
+class StagedReduceLROnPlateau(K.callbacks.ReduceLROnPlateau):
+    """
+    ReduceLROnPlateau that keeps its best loss and wait count from one
+    stage to the next instead of starting over with every stage.
+    """
+
+    def on_train_begin(self, logs=None):
+        if not getattr(self, "started", False):
+            super(StagedReduceLROnPlateau, self).on_train_begin(logs)
+            self.started = True
+
+
+class StagedLearningRateWarmupCallback(
+        hvd.callbacks.LearningRateWarmupCallback):
+    """
+    Learning rate warmup that keeps the learning rate of the first stage
+    as its starting point (a stage can begin in the middle of the warmup)
+    and counts the steps per epoch of each stage (the batch size changes).
+    """
+
+    def on_train_begin(self, logs=None):
+        initial_lr = self.initial_lr
+        self.steps_per_epoch = None
+        super(StagedLearningRateWarmupCallback, self).on_train_begin(logs)
+        if initial_lr is not None:
+            self.initial_lr = initial_lr
+
+
+time_to_target = TimeToTargetCallback(args.target_dice, start_time)
+
 checkpoint = K.callbacks.ModelCheckpoint(args.saved_model,
                                          verbose=verbose,
                                          save_best_only=True)
@@ -216,18 +375,21 @@ callbacks = [
     # TensorBoard or other metrics-based callbacks.
     hvd.callbacks.MetricAverageCallback(),
 
+    # Needs the averaged metrics so it must come after MetricAverageCallback
+    time_to_target,
+
     # Horovod: using `lr = 1.0 * hvd.size()` from the very
     # beginning leads to worse final
     # accuracy. Scale the learning rate
     # `lr = 1.0` ---> `lr = 1.0 * hvd.size()` during
     # the first five epochs. See https://arxiv.org/abs/1706.02677
     # for details.
-    hvd.callbacks.LearningRateWarmupCallback(warmup_epochs=3, verbose=verbose),
+    StagedLearningRateWarmupCallback(warmup_epochs=3, verbose=verbose),
 
     # Reduce the learning rate if training plateaus.
-    K.callbacks.ReduceLROnPlateau(monitor="val_loss", factor=0.6,
-                                  verbose=verbose,
-                                  patience=5, min_lr=0.0001),
+    StagedReduceLROnPlateau(monitor="val_loss", factor=0.6,
+                            verbose=verbose,
+                            patience=5, min_lr=0.0001),
     tb_logs,  # we need this here otherwise tensorboard delays rank 0
     checkpoint
 ]
@@ -259,7 +421,8 @@ training_data_params = {"dim": (args.patch_dim, args.patch_dim, args.patch_dim),
                         "n_out_channels": 1,
                         "augment": True,
                         "shuffle": True,
-                        "seed": seed}
+                        "seed": seed,
+                        "channels_first": args.channels_first}
 
 training_generator = DataGenerator(trainList, **training_data_params)
 
@@ -269,21 +432,41 @@ validation_data_params = {"dim": (args.patch_dim, args.patch_dim, args.patch_dim
                           "n_out_channels": 1,
                           "augment": False,
                           "shuffle": True,
-                          "seed": 816}
+                          "seed": 816,
+                          "channels_first": args.channels_first}
 validation_generator = DataGenerator(testList, **validation_data_params)
 
 # Fit the model
-steps_per_epoch = max(3, len(trainList)//(args.bz*hvd.size()))
-validation_steps = max(3,3*len(trainList)//(args.bz*hvd.size()))
-model.fit_generator(training_generator,
-                    steps_per_epoch=steps_per_epoch,
-                    epochs=args.epochs, verbose=verbose,
-                    validation_data=validation_generator,
-		            #validation_steps=validation_steps,
-                    callbacks=callbacks)
+# Each stage of the patch schedule reuses the same generator.
+# Validation always uses the final patch dimension so that the Dice
+# is comparable to the fixed patch size baseline.
+for patch_dim, bz, initial_epoch, last_epoch in patch_schedule:
+
+    if hvd.rank() == 0:
+        print("Epochs {}-{}: patch dimension = {}, batch size = {}".format(
+            initial_epoch+1, last_epoch, patch_dim, bz))
+
+    training_generator.set_patch((patch_dim, patch_dim, patch_dim), bz)
+
+    steps_per_epoch = max(3, len(trainList)//(bz*hvd.size()))
+    # The validation generator is a Sequence, so every validation
+    # batch is used
+    model.fit_generator(training_generator,
+                        steps_per_epoch=steps_per_epoch,
+                        initial_epoch=initial_epoch,
+                        epochs=last_epoch, verbose=verbose,
+                        validation_data=validation_generator,
+                        callbacks=callbacks)
 
 if hvd.rank() == 0:
     stop_time = time.time()
     print("\n\nTotal time = {:,.3f} seconds".format(
         stop_time - start_time))
+    if time_to_target.target_time is None:
+        print("Validation Dice never reached {}".format(args.target_dice))
+    else:
+        print("Time to validation Dice {} = {:,.3f} seconds "
+              "(epoch {})".format(args.target_dice,
+                                  time_to_target.target_time,
+                                  time_to_target.target_epoch))
     print("Stopped script on {}".format(datetime.datetime.now()))
@@ -22,7 +22,12 @@ import random
 import os
 import sys
 import argparse
-import psutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "benchmark_runner"))
+import allocator
+import topology
+
 import time
 import datetime
 import tensorflow as tf
@@ -54,12 +59,14 @@ parser.add_argument("--epochs",
                     help="Number of epochs")
 parser.add_argument("--intraop_threads",
                     type=int,
-                    default=psutil.cpu_count(logical=False)-2,
-                    help="Number of intraop threads")
+                    default=None,
+                    help="Number of intraop threads "
+                    "(default: one per physical core)")
 parser.add_argument("--interop_threads",
                     type=int,
-                    default=1,
-                    help="Number of interop threads")
+                    default=None,
+                    help="Number of interop threads "
+                    "(default: one per socket)")
 parser.add_argument("--blocktime",
                     type=int,
                     default=1,
@@ -77,6 +84,10 @@ parser.add_argument("--use_upsampling",
                     action="store_true",
                     default=False,
                     help="Use upsampling instead of transposed convolution")
+parser.add_argument("--channels_first",
+                    action="store_true",
+                    default=False,
+                    help="Use NCDHW (channels_first) instead of NDHWC tensors")
 datapath = "../../../data/Brats2018/"
 parser.add_argument("--data_path",
                     default=datapath,
@@ -85,12 +96,14 @@ parser.add_argument("--saved_model",
                     default="./saved_model_no_horovod/3d_unet_brats2018.hdf5",
                     help="Save model to this path")
 
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
 args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args)
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
-os.environ["OMP_NUM_THREADS"] = str(args.intraop_threads)
-os.environ["KMP_BLOCKTIME"] = str(args.blocktime)
-os.environ["KMP_AFFINITY"] = "granularity=thread,compact,1,0"
 
 os.system("lscpu")
 print("Started script on {}".format(datetime.datetime.now()))
@@ -135,7 +148,11 @@ def get_file_list(data_path=args.data_path):
     return trainList, testList
 
 
-input_shape = [args.patch_dim, args.patch_dim, args.patch_dim, args.number_input_channels]
+set_channels_first(args.channels_first)
+if args.channels_first:
+    input_shape = [args.number_input_channels, args.patch_dim, args.patch_dim, args.patch_dim]
+else:
+    input_shape = [args.patch_dim, args.patch_dim, args.patch_dim, args.number_input_channels]
 
 
 print_summary = args.print_model
@@ -201,7 +218,8 @@ training_data_params = {"dim": (args.patch_dim, args.patch_dim, args.patch_dim),
                         "n_out_channels": 1,
                         "augment": True,
                         "shuffle": True,
-                        "seed": seed}
+                        "seed": seed,
+                        "channels_first": args.channels_first}
 
 training_generator = DataGenerator(trainList, **training_data_params)
 
@@ -211,7 +229,8 @@ validation_data_params = {"dim": (args.patch_dim, args.patch_dim, args.patch_dim
                           "n_out_channels": 1,
                           "augment": False,
                           "shuffle": False,
-                          "seed": 816}
+                          "seed": 816,
+                          "channels_first": args.channels_first}
 validation_generator = DataGenerator(testList, **validation_data_params)
 
 # Fit the model
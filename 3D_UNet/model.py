@@ -20,7 +20,9 @@ import numpy as np
 import tensorflow as tf
 import keras as K
 
-def dice_coef(y_true, y_pred, axis=(1,2,3), smooth=1.0):
+def dice_coef(y_true, y_pred, axis=None, smooth=1.0):
+   if axis is None:
+      axis = get_spatial_axis(y_pred)
    intersection = tf.reduce_sum(y_true * y_pred, axis=axis)
    union = tf.reduce_sum(y_true + y_pred, axis=axis)
    numerator = tf.constant(2.) * intersection + smooth
@@ -29,13 +31,15 @@ def dice_coef(y_true, y_pred, axis=(1,2,3), smooth=1.0):
    return tf.reduce_mean(coef)
 
 
-def dice_coef_loss(target, prediction, axis=(1,2,3), smooth=1.):
+def dice_coef_loss(target, prediction, axis=None, smooth=1.):
 	'''
 	Sorenson Dice loss
 	Using -log(Dice) as the loss since it is better behaved.
 	Also, the log allows avoidance of the division which
 	can help prevent underflow when the numbers are very small.
 	'''
+	if axis is None:
+		axis = get_spatial_axis(prediction)
 	intersection = tf.reduce_sum(prediction * target, axis=axis)
 	p = tf.reduce_sum(prediction, axis=axis)
 	t = tf.reduce_sum(target, axis=axis)
@@ -46,13 +50,37 @@ def dice_coef_loss(target, prediction, axis=(1,2,3), smooth=1.):
 	return dice_loss
 
 CHANNEL_LAST = True
-if CHANNEL_LAST:
-	concat_axis = -1
-	data_format = "channels_last"
+concat_axis = -1
+data_format = "channels_last"
 
-else:
-	concat_axis = 1
-	data_format = "channels_first"
+
+def set_channels_first(channels_first=True):
+	'''
+	Build the models with NCDHW (channels_first) instead of NDHWC
+	(channels_last) tensors. Call this before the model is defined.
+	'''
+	global CHANNEL_LAST, concat_axis, data_format
+	CHANNEL_LAST = not channels_first
+	if CHANNEL_LAST:
+		concat_axis = -1
+		data_format = "channels_last"
+	else:
+		concat_axis = 1
+		data_format = "channels_first"
+
+	# The pooling and upsampling layers use the Keras default format
+	K.backend.set_image_data_format(data_format)
+
+
+def get_spatial_axis(tensor):
+	'''
+	Image axes of the tensor (all but the batch and channel axes)
+	'''
+	ndim = len(tensor.get_shape())
+	if CHANNEL_LAST:
+		return tuple(range(1, ndim-1))
+	else:
+		return tuple(range(2, ndim))
 
 def is_power_of_2(num):
 	'''
@@ -67,7 +95,7 @@ def is_power_of_2(num):
 	'''
 	return ((num & (num - 1)) == 0) and num > 0
 
-def define_model(input_img, use_upsampling=False, learning_rate=0.001, n_cl_out=1, dropout=0.2, print_summary = False):
+def define_model(input_img, use_upsampling=False, learning_rate=0.001, n_cl_out=1, dropout=0.2, print_summary = False, return_model=False):
 
 	# [b,h,w,d,c] = input_img.shape
 	# if not is_power_of_2(h) or  \
@@ -90,37 +118,37 @@ def define_model(input_img, use_upsampling=False, learning_rate=0.001, n_cl_out=
 				  kernel_initializer="he_uniform")
 
 	conv1 = K.layers.Conv3D(name="conv1a", filters=32, **params)(inputs)
-	conv1 = K.layers.BatchNormalization()(conv1)
+	conv1 = K.layers.BatchNormalization(axis=concat_axis)(conv1)
 	conv1 = K.layers.Activation("relu")(conv1)
 	conv1 = K.layers.Conv3D(name="conv1b", filters=64, **params)(conv1)
-	conv1 = K.layers.BatchNormalization()(conv1)
+	conv1 = K.layers.BatchNormalization(axis=concat_axis)(conv1)
 	conv1 = K.layers.Activation("relu")(conv1)
 	pool1 = K.layers.MaxPooling3D(name="pool1", pool_size=(2, 2, 2))(conv1)
 
 	conv2 = K.layers.Conv3D(name="conv2a", filters=64, **params)(pool1)
-	conv2 = K.layers.BatchNormalization()(conv2)
+	conv2 = K.layers.BatchNormalization(axis=concat_axis)(conv2)
 	conv2 = K.layers.Activation("relu")(conv2)
 	conv2 = K.layers.Conv3D(name="conv2b", filters=128, **params)(conv2)
-	conv2 = K.layers.BatchNormalization()(conv2)
+	conv2 = K.layers.BatchNormalization(axis=concat_axis)(conv2)
 	conv2 = K.layers.Activation("relu")(conv2)
 	pool2 = K.layers.MaxPooling3D(name="pool2", pool_size=(2, 2, 2))(conv2)
 
 	conv3 = K.layers.Conv3D(name="conv3a", filters=128, **params)(pool2)
-	conv3 = K.layers.BatchNormalization()(conv3)
+	conv3 = K.layers.BatchNormalization(axis=concat_axis)(conv3)
 	conv3 = K.layers.Activation("relu")(conv3)
 	conv3 = K.layers.Dropout(dropout)(conv3) ### Trying dropout layers earlier on, as indicated in the paper
 	conv3 = K.layers.Conv3D(name="conv3b", filters=256, **params)(conv3)
-	conv3 = K.layers.BatchNormalization()(conv3)
+	conv3 = K.layers.BatchNormalization(axis=concat_axis)(conv3)
 	conv3 = K.layers.Activation("relu")(conv3)
 	pool3 = K.layers.MaxPooling3D(name="pool3", pool_size=(2, 2, 2))(conv3)
 
 	conv4 = K.layers.Conv3D(name="conv4a", filters=256, **params)(pool3)
-	conv4 = K.layers.BatchNormalization()(conv4)
+	conv4 = K.layers.BatchNormalization(axis=concat_axis)(conv4)
 	conv4 = K.layers.Activation("relu")(conv4)
 	conv4 = K.layers.Dropout(dropout)(conv4) ### Trying dropout layers earlier on, as indicated in the paper
 
 	conv4 = K.layers.Conv3D(name="conv4b", filters=512, **params)(conv4)
-	conv4 = K.layers.BatchNormalization()(conv4)
+	conv4 = K.layers.BatchNormalization(axis=concat_axis)(conv4)
 	conv4 = K.layers.Activation("relu")(conv4)
 
 	if use_upsampling:
@@ -132,10 +160,10 @@ def define_model(input_img, use_upsampling=False, learning_rate=0.001, n_cl_out=
 	up4 = K.layers.concatenate([up, conv3], axis=concat_axis)
 
 	conv5 = K.layers.Conv3D(name="conv5a", filters=256, **params)(up4)
-	conv5 = K.layers.BatchNormalization()(conv5)
+	conv5 = K.layers.BatchNormalization(axis=concat_axis)(conv5)
 	conv5 = K.layers.Activation("relu")(conv5)
 	conv5 = K.layers.Conv3D(name="conv5b", filters=256, **params)(conv5)
-	conv5 = K.layers.BatchNormalization()(conv5)
+	conv5 = K.layers.BatchNormalization(axis=concat_axis)(conv5)
 	conv5 = K.layers.Activation("relu")(conv5)
 
 	if use_upsampling:
@@ -147,10 +175,10 @@ def define_model(input_img, use_upsampling=False, learning_rate=0.001, n_cl_out=
 	up5 = K.layers.concatenate([up, conv2], axis=concat_axis)
 
 	conv6 = K.layers.Conv3D(name="conv6a", filters=128, **params)(up5)
-	conv6 = K.layers.BatchNormalization()(conv6)
+	conv6 = K.layers.BatchNormalization(axis=concat_axis)(conv6)
 	conv6 = K.layers.Activation("relu")(conv6)
 	conv6 = K.layers.Conv3D(name="conv6b", filters=128, **params)(conv6)
-	conv6 = K.layers.BatchNormalization()(conv6)
+	conv6 = K.layers.BatchNormalization(axis=concat_axis)(conv6)
 	conv6 = K.layers.Activation("relu")(conv6)
 
 	if use_upsampling:
@@ -162,10 +190,10 @@ def define_model(input_img, use_upsampling=False, learning_rate=0.001, n_cl_out=
 	up6 = K.layers.concatenate([up, conv1], axis=concat_axis)
 
 	conv7 = K.layers.Conv3D(name="conv7a", filters=64, **params)(up6)
-	conv7 = K.layers.BatchNormalization()(conv7)
+	conv7 = K.layers.BatchNormalization(axis=concat_axis)(conv7)
 	conv7 = K.layers.Activation("relu")(conv7)
 	conv7 = K.layers.Conv3D(name="conv7b", filters=64, **params)(conv7)
-	conv7 = K.layers.BatchNormalization()(conv7)
+	conv7 = K.layers.BatchNormalization(axis=concat_axis)(conv7)
 	conv7 = K.layers.Activation("relu")(conv7)
 	pred = K.layers.Conv3D(name="Prediction_Mask", filters=n_cl_out, kernel_size=(1, 1, 1),
 					data_format=data_format, activation="sigmoid")(conv7)
@@ -178,17 +206,23 @@ def define_model(input_img, use_upsampling=False, learning_rate=0.001, n_cl_out=
 	# optimizer = tf.train.AdamOptimizer(learning_rate)
 	# model.compile(optimizer=optimizer, loss=dice_coef_loss, metrics=[dice_coef])
 
+	if return_model:
+		return pred, model
 	return pred #model
 
 
-def sensitivity(target, prediction, axis=(1,2,3), smooth = 1e-5 ):
+def sensitivity(target, prediction, axis=None, smooth = 1e-5 ):
 
+	if axis is None:
+		axis = get_spatial_axis(prediction)
 	intersection = tf.reduce_sum(prediction * target, axis=axis)
 	coef = (intersection + smooth) / (tf.reduce_sum(prediction, axis=axis) + smooth)
 	return tf.reduce_mean(coef)
 
-def specificity(target, prediction, axis=(1,2,3), smooth = 1e-5 ):
+def specificity(target, prediction, axis=None, smooth = 1e-5 ):
 
+	if axis is None:
+		axis = get_spatial_axis(prediction)
 	intersection = tf.reduce_sum(prediction * target, axis=axis)
 	coef = (intersection + smooth) / (tf.reduce_sum(prediction, axis=axis) + smooth)
 	return tf.reduce_mean(coef)
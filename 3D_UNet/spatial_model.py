@@ -0,0 +1,351 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Spatially parallel (domain decomposition) 3D U-Net.
+
+A single volume is split into slabs along one spatial axis and each
+Horovod rank owns one slab. The 3x3x3 convolutions need one slice of
+the neighboring slabs (the halo) which is exchanged before every
+convolution. BatchNormalization statistics and the Dice sums are
+reduced across all ranks with allreduce.
+
+Horovod only provides collectives, so the halo exchange is done with an
+allgather of the boundary slices. Each rank then picks out the slices
+from its two neighbors. The allgather (and allreduce) ops have gradients
+registered so the backward pass exchanges the halo gradients too.
+
+Every rank computes the same global loss. If the trainable weight
+gradients are averaged across ranks (hvd.DistributedOptimizer) then the
+result is exactly the gradient of the single node model.
+
+With distributed=False the halo is just zeros and no collectives
+are used. The layers and their weights are in the same order as in
+model.define_model, so benchmark_spatial_model.py --check can copy the
+weights into the single node model and compare the two.
+"""
+
+import numpy as np
+import tensorflow as tf
+import keras as K
+
+import horovod.tensorflow as hvd
+
+# Partitioning is only implemented for channels last (NDHWC)
+channel_axis = -1
+data_format = "channels_last"
+
+
+def get_slab(volume, axis, rank, size):
+	"""
+	Return the slab of a numpy batch of volumes owned by this rank.
+	The length along the partition axis must divide evenly and each
+	slab must be divisible by 8 so that the 3 max pooling layers
+	line up on every rank.
+	"""
+	length = volume.shape[axis]
+	if (length % size) != 0:
+		raise ValueError("Length {} along axis {} is not divisible by "
+						 "{} ranks".format(length, axis, size))
+	slab_length = length // size
+	if (slab_length % 8) != 0:
+		raise ValueError("Slab length {} must be divisible by 8 "
+						 "(3 max pooling layers)".format(slab_length))
+
+	slices = [slice(None)] * volume.ndim
+	slices[axis] = slice(rank*slab_length, (rank+1)*slab_length)
+
+	return volume[tuple(slices)]
+
+
+def _move_axis_to_front(x, axis):
+	perm = [axis] + [i for i in range(5) if i != axis]
+	inv_perm = list(np.argsort(perm))
+	return tf.transpose(x, perm), inv_perm
+
+
+def gather_slabs(x, axis):
+	"""
+	Reassemble the full tensor from the slabs on every rank.
+	Used for checking and saving predictions.
+	"""
+	x_t, inv_perm = _move_axis_to_front(x, axis)
+	return tf.transpose(hvd.allgather(x_t), inv_perm)
+
+
+def halo_exchange(x, axis=1, halo=1, distributed=True):
+	"""
+	Extend the slab by `halo` slices from each neighbor along
+	the partition axis. The global edges of the volume get zeros
+	which is the same as "same" padding.
+	"""
+	begin = [0] * 5
+	size = [-1] * 5
+	size[axis] = halo
+	low = tf.slice(x, begin, size)
+
+	begin[axis] = tf.shape(x)[axis] - halo
+	high = tf.slice(x, begin, size)
+
+	from_prev = tf.zeros_like(low)
+	from_next = tf.zeros_like(high)
+
+	if distributed and (hvd.size() > 1):
+
+		# allgather concatenates along the first dimension
+		low_t, inv_perm = _move_axis_to_front(low, axis)
+		high_t, _ = _move_axis_to_front(high, axis)
+		boundary = tf.concat([low_t, high_t], axis=0)
+		gathered = hvd.allgather(boundary)  # [low0,high0,low1,high1,...]
+
+		rank = hvd.rank()
+		if rank > 0:  # Top slices of the previous slab
+			idx = (2*(rank-1) + 1) * halo
+			from_prev = tf.transpose(gathered[idx:(idx+halo)], inv_perm)
+		if rank < (hvd.size() - 1):  # Bottom slices of the next slab
+			idx = (2*(rank+1)) * halo
+			from_next = tf.transpose(gathered[idx:(idx+halo)], inv_perm)
+
+	return tf.concat([from_prev, x, from_next], axis=axis)
+
+
+class HaloExchange3D(K.layers.Layer):
+	"""
+	Pads a slab for a "valid" 3D convolution. The partition axis is
+	extended with the halo from the neighboring ranks and the other
+	two spatial axes are zero padded.
+	"""
+
+	def __init__(self, axis=1, halo=1, distributed=True, **kwargs):
+		super(HaloExchange3D, self).__init__(**kwargs)
+		self.axis = axis
+		self.halo = halo
+		self.distributed = distributed
+
+	def call(self, inputs):
+		x = halo_exchange(inputs, self.axis, self.halo, self.distributed)
+		paddings = [[0, 0]] * 5
+		for ax in (1, 2, 3):
+			if ax != self.axis:
+				paddings[ax] = [self.halo, self.halo]
+		return tf.pad(x, paddings)
+
+	def compute_output_shape(self, input_shape):
+		output_shape = list(input_shape)
+		for ax in (1, 2, 3):
+			if output_shape[ax] is not None:
+				output_shape[ax] += 2*self.halo
+		return tuple(output_shape)
+
+	def get_config(self):
+		config = {"axis": self.axis, "halo": self.halo,
+				  "distributed": self.distributed}
+		base_config = super(HaloExchange3D, self).get_config()
+		return dict(list(base_config.items()) + list(config.items()))
+
+
+class DistributedBatchNormalization(K.layers.Layer):
+	"""
+	Batch normalization where the batch statistics are computed
+	over the whole volume (all slabs) instead of the local slab.
+	The per channel sum, sum of squares and count are packed
+	into a single allreduce.
+	"""
+
+	def __init__(self, momentum=0.99, epsilon=1e-3, distributed=True,
+				 **kwargs):
+		super(DistributedBatchNormalization, self).__init__(**kwargs)
+		self.momentum = momentum
+		self.epsilon = epsilon
+		self.distributed = distributed
+
+	def build(self, input_shape):
+		dim = input_shape[channel_axis]
+		self.gamma = self.add_weight(shape=(dim,), name="gamma",
+									 initializer="ones")
+		self.beta = self.add_weight(shape=(dim,), name="beta",
+									initializer="zeros")
+		self.moving_mean = self.add_weight(shape=(dim,),
+										   name="moving_mean",
+										   initializer="zeros",
+										   trainable=False)
+		self.moving_variance = self.add_weight(shape=(dim,),
+											   name="moving_variance",
+											   initializer="ones",
+											   trainable=False)
+		super(DistributedBatchNormalization, self).build(input_shape)
+
+	def call(self, inputs, training=None):
+
+		reduction_axes = [0, 1, 2, 3]
+		local_sum = tf.reduce_sum(inputs, axis=reduction_axes)
+		local_sqsum = tf.reduce_sum(tf.square(inputs), axis=reduction_axes)
+		local_count = tf.cast(tf.reduce_prod(tf.shape(inputs)[:-1]),
+							  inputs.dtype)
+
+		stats = tf.concat([local_sum, local_sqsum,
+						   tf.reshape(local_count, [1])], axis=0)
+		if self.distributed and (hvd.size() > 1):
+			stats = hvd.allreduce(stats, average=False)
+
+		dim = tf.shape(local_sum)[0]
+		count = stats[2*dim]
+		mean = stats[:dim] / count
+		variance = tf.maximum(stats[dim:2*dim] / count - tf.square(mean), 0.)
+
+		self.add_update([K.backend.moving_average_update(self.moving_mean,
+														 mean, self.momentum),
+						 K.backend.moving_average_update(self.moving_variance,
+														 variance, self.momentum)],
+						inputs)
+
+		normed_training = tf.nn.batch_normalization(inputs, mean, variance,
+													self.beta, self.gamma,
+													self.epsilon)
+		normed_inference = tf.nn.batch_normalization(inputs,
+													 self.moving_mean,
+													 self.moving_variance,
+													 self.beta, self.gamma,
+													 self.epsilon)
+
+		return K.backend.in_train_phase(normed_training, normed_inference,
+										training=training)
+
+	def compute_output_shape(self, input_shape):
+		return input_shape
+
+	def get_config(self):
+		config = {"momentum": self.momentum, "epsilon": self.epsilon,
+				  "distributed": self.distributed}
+		base_config = super(DistributedBatchNormalization, self).get_config()
+		return dict(list(base_config.items()) + list(config.items()))
+
+
+def spatial_dice_coef(target, prediction, axis=(1,2,3), smooth=1.0,
+					  distributed=True):
+	"""
+	Sorenson Dice over the whole volume.
+	The per sample sums are reduced across ranks before the division.
+	"""
+	intersection = tf.reduce_sum(target * prediction, axis=axis)
+	union = tf.reduce_sum(target + prediction, axis=axis)
+	sums = tf.stack([intersection, union])
+	if distributed and (hvd.size() > 1):
+		sums = hvd.allreduce(sums, average=False)
+
+	coef = (tf.constant(2.) * sums[0] + smooth) / (sums[1] + smooth)
+	return tf.reduce_mean(coef)
+
+
+def spatial_dice_coef_loss(target, prediction, axis=(1,2,3), smooth=1.,
+						   distributed=True):
+	"""
+	Same -log(Dice) loss as model.dice_coef_loss but with the
+	sums reduced across ranks.
+	"""
+	intersection = tf.reduce_sum(prediction * target, axis=axis)
+	p = tf.reduce_sum(prediction, axis=axis)
+	t = tf.reduce_sum(target, axis=axis)
+	sums = tf.stack([intersection, p, t])
+	if distributed and (hvd.size() > 1):
+		sums = hvd.allreduce(sums, average=False)
+
+	numerator = tf.reduce_mean(2. * sums[0] + smooth)
+	denominator = tf.reduce_mean(sums[2] + sums[1] + smooth)
+	dice_loss = -tf.log(numerator) + tf.log(denominator)
+
+	return dice_loss
+
+
+def define_spatial_model(input_img, partition_axis=1, use_upsampling=False,
+						 n_cl_out=1, dropout=0.2, distributed=True,
+						 print_summary=False, return_model=False):
+	"""
+	3D U-Net with the same layers (and layer names) as
+	model.define_model, but where input_img is this rank's slab.
+	"""
+
+	inputs = K.layers.Input(tensor=input_img, name="Input_Image")
+
+	params = dict(kernel_size=(3, 3, 3), activation=None,
+				  padding="valid", data_format=data_format,
+				  kernel_initializer="he_uniform")
+
+	def conv_bn_relu(x, name, filters):
+		x = HaloExchange3D(name=name+"_halo", axis=partition_axis,
+						   distributed=distributed)(x)
+		x = K.layers.Conv3D(name=name, filters=filters, **params)(x)
+		x = DistributedBatchNormalization(distributed=distributed)(x)
+		return K.layers.Activation("relu")(x)
+
+	def up_conv(x, name, filters):
+		# 2x2x2 with stride 2 never crosses a slab boundary
+		if use_upsampling:
+			return K.layers.UpSampling3D(name=name.replace("transConv", "up"),
+										 size=(2, 2, 2))(x)
+		else:
+			return K.layers.Conv3DTranspose(name=name, filters=filters,
+											data_format=data_format,
+											kernel_size=(2, 2, 2),
+											strides=(2, 2, 2),
+											padding="same")(x)
+
+	conv1 = conv_bn_relu(inputs, "conv1a", 32)
+	conv1 = conv_bn_relu(conv1, "conv1b", 64)
+	pool1 = K.layers.MaxPooling3D(name="pool1", pool_size=(2, 2, 2))(conv1)
+
+	conv2 = conv_bn_relu(pool1, "conv2a", 64)
+	conv2 = conv_bn_relu(conv2, "conv2b", 128)
+	pool2 = K.layers.MaxPooling3D(name="pool2", pool_size=(2, 2, 2))(conv2)
+
+	conv3 = conv_bn_relu(pool2, "conv3a", 128)
+	conv3 = K.layers.Dropout(dropout)(conv3)
+	conv3 = conv_bn_relu(conv3, "conv3b", 256)
+	pool3 = K.layers.MaxPooling3D(name="pool3", pool_size=(2, 2, 2))(conv3)
+
+	conv4 = conv_bn_relu(pool3, "conv4a", 256)
+	conv4 = K.layers.Dropout(dropout)(conv4)
+	conv4 = conv_bn_relu(conv4, "conv4b", 512)
+
+	up4 = K.layers.concatenate([up_conv(conv4, "transConv4", 512), conv3],
+							   axis=channel_axis)
+	conv5 = conv_bn_relu(up4, "conv5a", 256)
+	conv5 = conv_bn_relu(conv5, "conv5b", 256)
+
+	up5 = K.layers.concatenate([up_conv(conv5, "transConv5", 256), conv2],
+							   axis=channel_axis)
+	conv6 = conv_bn_relu(up5, "conv6a", 128)
+	conv6 = conv_bn_relu(conv6, "conv6b", 128)
+
+	up6 = K.layers.concatenate([up_conv(conv6, "transConv6", 128), conv1],
+							   axis=channel_axis)
+	conv7 = conv_bn_relu(up6, "conv7a", 64)
+	conv7 = conv_bn_relu(conv7, "conv7b", 64)
+
+	pred = K.layers.Conv3D(name="Prediction_Mask", filters=n_cl_out,
+						   kernel_size=(1, 1, 1), data_format=data_format,
+						   activation="sigmoid")(conv7)
+
+	if return_model:
+		model = K.models.Model(inputs=[inputs], outputs=[pred])
+
+		if print_summary:
+			model.summary()
+
+		return pred, model
+	else:
+		return pred
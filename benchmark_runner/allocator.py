@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Run a benchmark with jemalloc, tcmalloc or the glibc malloc.
+
+The allocator has to be loaded before the process starts, so the
+script restarts itself with LD_PRELOAD set:
+
+    sys.path.append(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "..", "benchmark_runner"))
+    import allocator
+
+    allocator.add_arguments(parser)
+    args = parser.parse_args()
+    allocator.use_allocator(args.allocator)
+
+The restarted process prints "Memory allocator: <name>", which
+run_sweep.py records with the results. If the library is not found the
+benchmark keeps the glibc malloc. MALLOC_CONF (jemalloc) and the
+TCMALLOC_* variables already in the environment are kept, otherwise
+the defaults below are used. Subprocesses inherit the allocator.
+"""
+
+import ctypes.util
+import os
+import sys
+
+ALLOCATORS = ["glibc", "jemalloc", "tcmalloc"]
+
+# Set in the restarted process so that it doesn't restart again
+ENV_MARKER = "BENCHMARK_ALLOCATOR"
+
+LIBRARIES = {"jemalloc": ["libjemalloc.so.2", "libjemalloc.so.1",
+                          "libjemalloc.so"],
+             "tcmalloc": ["libtcmalloc.so.4", "libtcmalloc_minimal.so.4",
+                          "libtcmalloc.so", "libtcmalloc_minimal.so"]}
+
+SETTINGS = {
+    # Return unused pages in the background instead of on the
+    # allocating threads
+    "jemalloc": {"MALLOC_CONF": "background_thread:true,metadata_thp:auto,"
+                                "dirty_decay_ms:10000,muzzy_decay_ms:10000"},
+    # TensorFlow allocates large buffers, don't log every one of them
+    "tcmalloc": {"TCMALLOC_LARGE_ALLOC_REPORT_THRESHOLD": str(64 * 1024**3)},
+}
+
+
+def add_arguments(parser):
+    """
+    Add --allocator to a benchmark's argparse parser
+    """
+    parser.add_argument("--allocator",
+                        default=None,
+                        choices=ALLOCATORS,
+                        help="Memory allocator (default: leave LD_PRELOAD "
+                             "as it is)")
+
+
+def get_search_dirs():
+    dirs = []
+    for prefix in [os.environ.get("CONDA_PREFIX"), sys.prefix]:
+        if prefix:
+            dirs.append(os.path.join(prefix, "lib"))
+    return dirs + ["/usr/lib/x86_64-linux-gnu", "/usr/lib64", "/usr/lib",
+                   "/usr/local/lib", "/lib/x86_64-linux-gnu"]
+
+
+def find_library(name):
+    """
+    Path of the jemalloc or tcmalloc shared library, or None
+    """
+    path = os.environ.get("{}_PATH".format(name.upper()))
+    if path and os.path.isfile(path):
+        return path
+    for directory in get_search_dirs():
+        for library in LIBRARIES[name]:
+            path = os.path.join(directory, library)
+            if os.path.isfile(path):
+                return path
+    return ctypes.util.find_library(name)
+
+
+def is_allocator(library):
+    name = os.path.basename(library)
+    return any(name.startswith(lib.split(".")[0])
+               for libs in LIBRARIES.values() for lib in libs)
+
+
+def use_allocator(name):
+    """
+    Restart this script with the allocator preloaded. Returns (in the
+    restarted process, or right away if nothing has to change) the name
+    of the allocator in use.
+    """
+    if name is None:
+        return None
+    if os.environ.get(ENV_MARKER) == name:
+        print("Memory allocator: {}".format(name))
+        return name
+
+    env = dict(os.environ)
+    preload = [lib for lib in env.get("LD_PRELOAD", "").split(":")
+               if lib and not is_allocator(lib)]
+
+    if name != "glibc":
+        library = find_library(name)
+        if library is None:
+            print("{} was not found (set {}_PATH to the library). "
+                  "Using the glibc malloc.".format(name, name.upper()))
+            name = "glibc"
+        else:
+            preload.insert(0, library)
+            for var, value in SETTINGS[name].items():
+                env.setdefault(var, value)
+
+    if preload:
+        env["LD_PRELOAD"] = ":".join(preload)
+    else:
+        env.pop("LD_PRELOAD", None)
+    env[ENV_MARKER] = name
+
+    if env.get("LD_PRELOAD") == os.environ.get("LD_PRELOAD"):
+        # Nothing to preload or unload
+        os.environ[ENV_MARKER] = name
+        print("Memory allocator: {}".format(name))
+        return name
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execve(sys.executable, [sys.executable] + sys.argv, env)
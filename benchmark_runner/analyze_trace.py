@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Summarize and compare the TensorFlow timeline traces (chrome://tracing
+JSON) written by the benchmarks.
+
+The op time is aggregated by op type and by Keras layer (conv1a,
+transConv4, ...) with the forward and backward (gradient) ops of a layer
+kept apart. Given the model JSON that the benchmarks save next to a
+trace, the analytical FLOPs of each layer give the achieved GFLOP/s and
+the percent of the peak of this CPU.
+
+    python analyze_trace.py summary timeline_trace.json \
+        --model_json timeline_model.json
+    python analyze_trace.py diff before.json after.json
+
+Wall time is the union of the op intervals (ops run in parallel on
+several threads), CPU time is the sum of the op durations.
+"""
+
+import argparse
+import csv
+import json
+import re
+
+FORWARD = "forward"
+BACKWARD = "backward"
+
+# Backward FLOPs relative to forward: gradients for the input and weights
+BACKWARD_FLOPS_FACTOR = {"Conv2D": 2, "Conv3D": 2, "Conv2DTranspose": 2,
+                         "Conv3DTranspose": 2, "Dense": 2}
+
+
+def load_ops(filename):
+    """
+    Op events of the trace as (node name, op type, start, duration) in us.
+    Only the "Compute" streams are used; the "Tensors" and allocator
+    rows describe memory, not time.
+    """
+    with open(filename) as f:
+        trace = json.load(f)
+    events = trace["traceEvents"] if isinstance(trace, dict) else trace
+
+    compute_pids = set()
+    for e in events:
+        if e.get("ph") == "M" and e.get("name") == "process_name" and \
+                e.get("args", {}).get("name", "").endswith("Compute"):
+            compute_pids.add(e["pid"])
+
+    ops = []
+    for e in events:
+        if e.get("ph") != "X":
+            continue
+        if compute_pids and e.get("pid") not in compute_pids:
+            continue
+        args = e.get("args", {})
+        ops.append((args.get("name", e["name"]), args.get("op", e["name"]),
+                    float(e["ts"]), float(e.get("dur", 0))))
+    return ops
+
+
+def get_layer(node_name, layer_names=None):
+    """
+    Keras layer and phase of a node. Keras scopes the ops of a layer as
+    "<layer>/..." and the gradients as ".../gradients/<layer>/...".
+    Without the model the first name scope is used as the layer.
+    """
+    parts = node_name.split("/")
+    phase = FORWARD
+    if "gradients" in parts:
+        phase = BACKWARD
+        parts = parts[parts.index("gradients")+1:]
+    elif parts[0] == "training":   # Keras optimizer updates
+        return "optimizer", phase
+
+    if layer_names is not None:
+        for part in parts:
+            if part in layer_names:
+                return part, phase
+        return "other", phase
+
+    if len(parts) > 1:
+        return parts[0], phase
+    return "other", phase
+
+
+def union_time(intervals):
+    """
+    Total length of the union of (start, duration) intervals
+    """
+    total = 0.0
+    end = None
+    for start, dur in sorted(intervals):
+        if end is None or start > end:
+            total += dur
+            end = start + dur
+        elif start + dur > end:
+            total += start + dur - end
+            end = start + dur
+    return total
+
+
+def aggregate(ops, layer_names=None):
+    """
+    CPU and wall time (ms) by op type and by (layer, phase)
+    """
+    by_op = {}
+    by_layer = {}
+    for node_name, op, start, dur in ops:
+        by_op.setdefault(op, []).append((start, dur))
+        by_layer.setdefault(get_layer(node_name, layer_names), []).append(
+            (start, dur))
+
+    def times(groups):
+        return {k: {"count": len(v),
+                    "cpu_ms": sum(d for _, d in v) / 1000.0,
+                    "wall_ms": union_time(v) / 1000.0}
+                for k, v in groups.items()}
+
+    step_ms = 0.0
+    if ops:
+        step_ms = (max(s + d for _, _, s, d in ops) -
+                   min(s for _, _, s, _ in ops)) / 1000.0
+
+    return times(by_op), times(by_layer), step_ms
+
+
+def get_output_shapes(layers):
+    """
+    Output shape of each layer of a Keras model JSON (batch dimension
+    included). Only the layer types used by the models in this repo are
+    handled; unknown layers keep the shape of their first input.
+    """
+    shapes = {}
+    for layer in layers:
+        cls = layer["class_name"]
+        config = layer["config"]
+        inbound = layer.get("inbound_nodes", [])
+        inputs = [shapes[node[0]] for node in inbound[0]] if inbound else []
+
+        if cls == "InputLayer":
+            shapes[layer["name"]] = list(config["batch_input_shape"])
+            continue
+
+        shape = list(inputs[0])
+        channels_first = config.get("data_format") == "channels_first"
+        spatial = list(range(2, len(shape))) if channels_first \
+            else list(range(1, len(shape)-1))
+        channel_axis = 1 if channels_first else len(shape)-1
+
+        if cls in ("Conv2D", "Conv3D", "MaxPooling2D", "MaxPooling3D",
+                   "AveragePooling2D", "AveragePooling3D"):
+            kernel = config.get("kernel_size", config.get("pool_size"))
+            strides = config.get("strides") or kernel
+            for axis, k, s in zip(spatial, kernel, strides):
+                if shape[axis] is None:
+                    continue
+                if config.get("padding", "valid") == "same":
+                    shape[axis] = -(-shape[axis] // s)
+                else:
+                    shape[axis] = (shape[axis] - k) // s + 1
+            if "filters" in config:
+                shape[channel_axis] = config["filters"]
+
+        elif cls in ("Conv2DTranspose", "Conv3DTranspose"):
+            for axis, k, s in zip(spatial, config["kernel_size"],
+                                  config["strides"]):
+                if shape[axis] is None:
+                    continue
+                if config.get("padding", "valid") == "same":
+                    shape[axis] = shape[axis] * s
+                else:
+                    shape[axis] = shape[axis] * s + max(k - s, 0)
+            shape[channel_axis] = config["filters"]
+
+        elif cls in ("UpSampling2D", "UpSampling3D"):
+            for axis, s in zip(spatial, config["size"]):
+                if shape[axis] is not None:
+                    shape[axis] *= s
+
+        elif cls == "Concatenate":
+            axis = config.get("axis", -1) % len(shape)
+            shape[axis] = sum(s[axis] for s in inputs)
+
+        elif cls == "Flatten":
+            size = 1
+            for s in shape[1:]:
+                size *= s
+            shape = [shape[0], size]
+
+        elif cls == "Dense":
+            shape[-1] = config["units"]
+
+        shapes[layer["name"]] = shape
+    return shapes
+
+
+def get_layer_flops(model_json, batch_size=None):
+    """
+    Forward FLOPs of each layer (a multiply-add counts as 2)
+    """
+    with open(model_json) as f:
+        model = json.load(f)
+    layers = model["config"]["layers"]
+    shapes = get_output_shapes(layers)
+
+    def size(shape):
+        n = 1
+        for s in shape:
+            n *= (batch_size or 1) if s is None else s
+        return n
+
+    flops = {}
+    types = {}
+    for layer in layers:
+        cls = layer["class_name"]
+        config = layer["config"]
+        name = layer["name"]
+        types[name] = cls
+        inbound = layer.get("inbound_nodes", [])
+        if not inbound:
+            continue
+        in_shape = shapes[inbound[0][0][0]]
+        out_shape = shapes[name]
+        channels_first = config.get("data_format") == "channels_first"
+        in_channels = in_shape[1] if channels_first else in_shape[-1]
+
+        kernel = 1
+        for k in config.get("kernel_size", config.get("pool_size", [])) or []:
+            kernel *= k
+
+        if cls in ("Conv2D", "Conv3D"):
+            flops[name] = 2 * size(out_shape) * kernel * in_channels
+        elif cls in ("Conv2DTranspose", "Conv3DTranspose"):
+            flops[name] = 2 * size(in_shape) * kernel * config["filters"]
+        elif cls == "Dense":
+            flops[name] = 2 * size(in_shape) * config["units"]
+        elif cls.startswith("MaxPooling") or cls.startswith("AveragePooling"):
+            flops[name] = size(out_shape) * kernel
+        elif cls == "BatchNormalization":
+            flops[name] = 2 * size(out_shape)   # Scale and shift
+        elif cls == "Activation":
+            flops[name] = size(out_shape)
+        else:
+            flops[name] = 0
+
+    return flops, types
+
+
+def get_peak_gflops(flops_per_cycle=None):
+    """
+    Peak single precision GFLOP/s of this CPU from /proc/cpuinfo:
+    physical cores x clock x FLOPs per cycle per core
+    (2 FMA units: 64 with AVX-512, 32 with AVX2).
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpuinfo = f.read()
+    except IOError:
+        return None
+
+    cores = set(re.findall(r"^physical id\s*:\s*(\d+)$\n(?:.*\n)*?"
+                           r"^core id\s*:\s*(\d+)$", cpuinfo, re.MULTILINE))
+    mhz = [float(m) for m in re.findall(r"^cpu MHz\s*:\s*([\d.]+)$",
+                                        cpuinfo, re.MULTILINE)]
+    flags = re.search(r"^flags\s*:\s*(.*)$", cpuinfo, re.MULTILINE)
+    flags = flags.group(1).split() if flags else []
+
+    if flops_per_cycle is None:
+        if "avx512f" in flags:
+            flops_per_cycle = 64
+        elif "avx2" in flags and "fma" in flags:
+            flops_per_cycle = 32
+        else:
+            flops_per_cycle = 16
+
+    num_cores = len(cores) or len(mhz)
+    if num_cores == 0 or not mhz:
+        return None
+    return num_cores * max(mhz) / 1000.0 * flops_per_cycle
+
+
+def layer_rows(by_layer, step_ms, flops=None, types=None, peak_gflops=None):
+    """
+    One row per layer with forward and backward time and,
+    given the FLOPs, the achieved GFLOP/s
+    """
+    names = sorted(set(layer for layer, _ in by_layer),
+                   key=lambda n: -sum(by_layer.get((n, p), {}).get(
+                       "wall_ms", 0) for p in (FORWARD, BACKWARD)))
+    rows = []
+    for name in names:
+        fwd = by_layer.get((name, FORWARD), {"wall_ms": 0.0, "cpu_ms": 0.0})
+        bwd = by_layer.get((name, BACKWARD), {"wall_ms": 0.0, "cpu_ms": 0.0})
+        row = {"layer": name,
+               "type": (types or {}).get(name, ""),
+               "forward_ms": fwd["wall_ms"],
+               "backward_ms": bwd["wall_ms"],
+               "wall_ms": fwd["wall_ms"] + bwd["wall_ms"],
+               "cpu_ms": fwd["cpu_ms"] + bwd["cpu_ms"],
+               "percent_of_step": 100.0 * (fwd["wall_ms"] + bwd["wall_ms"]) /
+               step_ms if step_ms > 0 else 0.0,
+               "gflop": None, "gflops_per_sec": None, "percent_of_peak": None}
+
+        if flops is not None and flops.get(name):
+            factor = BACKWARD_FLOPS_FACTOR.get(row["type"], 1)
+            total = flops[name] * (1 + (factor if bwd["wall_ms"] > 0 else 0))
+            row["gflop"] = total / 1e9
+            if row["wall_ms"] > 0:
+                row["gflops_per_sec"] = row["gflop"] / (row["wall_ms"] / 1000.0)
+                if peak_gflops:
+                    row["percent_of_peak"] = 100.0 * row["gflops_per_sec"] / \
+                        peak_gflops
+        rows.append(row)
+    return rows
+
+
+def fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def summary(args):
+
+    ops = load_ops(args.trace)
+
+    flops = types = None
+    layer_names = None
+    if args.model_json is not None:
+        flops, types = get_layer_flops(args.model_json, args.batch_size)
+        layer_names = set(types.keys())
+
+    by_op, by_layer, step_ms = aggregate(ops, layer_names)
+
+    peak_gflops = args.peak_gflops or get_peak_gflops(args.flops_per_cycle)
+
+    print("{} ops, step wall time = {:.2f} ms".format(len(ops), step_ms))
+    if peak_gflops:
+        print("Peak = {:.0f} GFLOP/s".format(peak_gflops))
+
+    print("\nTime by op type")
+    print("{:>32} {:>7} {:>12} {:>12} {:>8}".format(
+        "op", "count", "cpu_ms", "wall_ms", "%step"))
+    for op, t in sorted(by_op.items(), key=lambda kv: -kv[1]["cpu_ms"])[
+            :args.top]:
+        print("{:>32} {:>7} {:>12.2f} {:>12.2f} {:>8.1f}".format(
+            op, t["count"], t["cpu_ms"], t["wall_ms"],
+            100.0 * t["wall_ms"] / step_ms if step_ms > 0 else 0.0))
+
+    rows = layer_rows(by_layer, step_ms, flops, types, peak_gflops)
+
+    print("\nTime by layer")
+    print("{:>24} {:>12} {:>12} {:>12} {:>8} {:>10} {:>10} {:>7}".format(
+        "layer", "forward_ms", "backward_ms", "wall_ms", "%step", "GFLOP",
+        "GFLOP/s", "%peak"))
+    for row in rows[:args.top]:
+        print("{:>24} {:>12.2f} {:>12.2f} {:>12.2f} {:>8.1f} {:>10} {:>10} "
+              "{:>7}".format(row["layer"], row["forward_ms"],
+                             row["backward_ms"], row["wall_ms"],
+                             row["percent_of_step"],
+                             fmt(row["gflop"], ".2f"),
+                             fmt(row["gflops_per_sec"], ".1f"),
+                             fmt(row["percent_of_peak"], ".1f")))
+
+    if flops is not None:
+        total_gflop = sum(r["gflop"] or 0 for r in rows)
+        print("\nModel: {:.2f} GFLOP in {:.2f} ms = {:.1f} GFLOP/s".format(
+            total_gflop, step_ms, total_gflop / (step_ms / 1000.0)
+            if step_ms > 0 else 0.0))
+
+    if args.csv is not None:
+        with open(args.csv, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print("Saved layer table to {}".format(args.csv))
+
+
+def diff_table(title, before, after, threshold, min_ms, top):
+    """
+    Print the groups sorted by the change in wall time and
+    return the ones that got slower by more than the threshold
+    """
+    keys = set(before) | set(after)
+    rows = []
+    for k in keys:
+        b = before.get(k, 0.0)
+        a = after.get(k, 0.0)
+        ratio = a / b if b > 0 else float("inf")
+        rows.append((k, b, a, a - b, ratio))
+    rows.sort(key=lambda r: -r[3])
+
+    print("\n{}".format(title))
+    print("{:>32} {:>12} {:>12} {:>12} {:>8}".format(
+        "name", "before_ms", "after_ms", "delta_ms", "ratio"))
+    regressions = []
+    for k, b, a, delta, ratio in rows[:top]:
+        flag = ""
+        if delta > min_ms and ratio > 1.0 + threshold:
+            flag = "  <-- slower"
+            regressions.append(k)
+        print("{:>32} {:>12.2f} {:>12.2f} {:>+12.2f} {:>8.2f}{}".format(
+            k, b, a, delta, ratio, flag))
+    return regressions
+
+
+def diff(args):
+
+    before_ops = load_ops(args.before)
+    after_ops = load_ops(args.after)
+    before_op, before_layer, before_step = aggregate(before_ops)
+    after_op, after_layer, after_step = aggregate(after_ops)
+
+    print("Step wall time: {:.2f} ms -> {:.2f} ms ({:+.1f}%)".format(
+        before_step, after_step,
+        100.0 * (after_step - before_step) / before_step
+        if before_step > 0 else 0.0))
+
+    def layer_wall(by_layer):
+        totals = {}
+        for (layer, phase), t in by_layer.items():
+            name = layer if phase == FORWARD else layer + " (grad)"
+            totals[name] = t["wall_ms"]
+        return totals
+
+    regressions = diff_table("Wall time by layer", layer_wall(before_layer),
+                             layer_wall(after_layer), args.threshold,
+                             args.min_ms, args.top)
+    diff_table("CPU time by op type",
+               {k: v["cpu_ms"] for k, v in before_op.items()},
+               {k: v["cpu_ms"] for k, v in after_op.items()},
+               args.threshold, args.min_ms, args.top)
+
+    if regressions:
+        print("\nLayers slower by more than {:.0f}%: {}".format(
+            100 * args.threshold, ", ".join(regressions)))
+
+
+def get_parser():
+
+    parser = argparse.ArgumentParser(
+        description="Analyze TensorFlow timeline traces", add_help=True)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    summary_parser = subparsers.add_parser("summary",
+                                           help="Time and GFLOP/s per layer")
+    summary_parser.add_argument("trace", help="Chrome trace JSON")
+    summary_parser.add_argument("--model_json", default=None,
+                                help="Keras model JSON for the FLOP counts")
+    summary_parser.add_argument("--batch_size", type=int, default=None,
+                                help="Batch size if the model JSON has "
+                                "an unknown batch dimension")
+    summary_parser.add_argument("--peak_gflops", type=float, default=None,
+                                help="Peak GFLOP/s (default from "
+                                "/proc/cpuinfo)")
+    summary_parser.add_argument("--flops_per_cycle", type=int, default=None,
+                                help="FLOPs per cycle per core for the peak")
+    summary_parser.add_argument("--top", type=int, default=30,
+                                help="Number of rows to print")
+    summary_parser.add_argument("--csv", default=None,
+                                help="Save the layer table to this file")
+    summary_parser.set_defaults(func=summary)
+
+    diff_parser = subparsers.add_parser("diff", help="Compare two traces")
+    diff_parser.add_argument("before", help="Baseline chrome trace JSON")
+    diff_parser.add_argument("after", help="New chrome trace JSON")
+    diff_parser.add_argument("--threshold", type=float, default=0.05,
+                             help="Flag layers slower by this fraction")
+    diff_parser.add_argument("--min_ms", type=float, default=0.1,
+                             help="Ignore changes smaller than this")
+    diff_parser.add_argument("--top", type=int, default=30,
+                             help="Number of rows to print")
+    diff_parser.set_defaults(func=diff)
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = get_parser().parse_args()
+    args.func(args)
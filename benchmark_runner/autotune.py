@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Thread settings found by "run_sweep.py autotune", one cache file per host.
+
+The tuner searches intra-op threads x inter-op threads x KMP_BLOCKTIME x
+KMP_AFFINITY with coordinate descent and saves the winner for the model
+and its shape (patch size, batch size, processes per node). A trainer
+looks its settings up at startup and uses them for the thread flags that
+were not given on the command line:
+
+    sys.path.append(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "..", "benchmark_runner"))
+    import autotune
+
+    autotune.add_arguments(parser)
+    args = parser.parse_args()
+    tuned = autotune.load_settings(args.tuned_settings, "unet3d",
+                                   dim_length=128, bz=8,
+                                   processes_per_node=1)
+    # -> {"intra_threads": 28, "inter_threads": 2, "blocktime": 1,
+    #     "affinity": "granularity=fine,compact,1,0"} or {}
+
+An empty "affinity" means the explicit proclist of topology.py.
+"""
+
+import datetime
+import json
+import os
+import socket
+
+CACHE_DIR = os.path.join("~", ".cache", "topologies")
+
+
+def add_arguments(parser):
+    """
+    Add --tuned_settings to a trainer's argparse parser
+    """
+    parser.add_argument("--tuned_settings",
+                        default=None,
+                        help="Autotune cache file (default: the file of "
+                             "this host, \"none\" to ignore it)")
+
+
+def get_cache_file():
+    """
+    Per-host cache file. AUTOTUNE_CACHE overrides it.
+    """
+    if "AUTOTUNE_CACHE" in os.environ:
+        return os.environ["AUTOTUNE_CACHE"]
+    return os.path.join(os.path.expanduser(CACHE_DIR), "autotune-{}.json"
+                        .format(socket.gethostname()))
+
+
+def settings_key(model, shape):
+    return json.dumps(dict(shape, model=model), sort_keys=True)
+
+
+def read_cache(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def load_settings(filename, model, **shape):
+    """
+    Tuned settings of the model and shape, or {} if it wasn't tuned
+    on this host (or filename is "none")
+    """
+    if filename == "none":
+        return {}
+    if filename is None:
+        filename = get_cache_file()
+    entry = read_cache(filename).get(settings_key(model, shape))
+    if entry is None:
+        return {}
+    print("Tuned settings from {} ({}): {}".format(filename, entry["tuned"],
+                                                   entry["settings"]))
+    return entry["settings"]
+
+
+def save_settings(filename, model, shape, config, settings, objective,
+                  value):
+    """
+    Add the winner to the cache, replacing an earlier one for the
+    same model and shape
+    """
+    if filename is None:
+        filename = get_cache_file()
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    cache = read_cache(filename)
+    cache[settings_key(model, shape)] = {
+        "model": model,
+        "shape": shape,
+        "config": config,        # Values as named in the spec
+        "settings": settings,    # Values as passed to the benchmark
+        "objective": objective,
+        "value": value,
+        "tuned": datetime.datetime.now().isoformat()}
+    with open(filename, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    return filename
+
+
+def coordinate_descent(space, start, evaluate, rounds=2, min_gain=0.02):
+    """
+    Maximize evaluate(point) over the grid one dimension at a time.
+
+    space maps each dimension to its values (in the order to search) and
+    start is the first point. Each round tries every value of each
+    dimension with the other dimensions at their best so far. A new
+    point has to beat the best by min_gain (relative) to replace it, so
+    noise in short trials doesn't move the search. Stops after a round
+    without a change. evaluate returns None for failed points.
+
+    Returns (best point, its value).
+    """
+    best = dict(start)
+    best_value = evaluate(best)
+    for _ in range(rounds):
+        changed = False
+        for name, values in space.items():
+            for value in values:
+                if value == best[name]:
+                    continue
+                point = dict(best, **{name: value})
+                result = evaluate(point)
+                if result is None:
+                    continue
+                if best_value is None or \
+                        result - best_value > abs(best_value) * min_gain:
+                    best, best_value, changed = point, result, True
+        if not changed:
+            break
+    return best, best_value
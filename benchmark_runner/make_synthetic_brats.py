@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Write a synthetic brain tumor dataset with the same file layout,
+shapes and dtypes as the real ones, so the converters, loaders and
+trainers can be benchmarked end to end (input I/O included) without
+the licensed data.
+
+BraTS 2018 layout (--layout brats):
+    <output_dir>/brats/{HGG,LGG}/<id>/<id>_{flair,t1,t1ce,t2,seg}.nii.gz
+    240x240x155, int16 images, uint8 labels 0 (background),
+    1 (necrotic core), 2 (edema) and 4 (enhancing tumor)
+
+Medical Decathlon layout (--layout decathlon), as read by
+tiling_experiments/convert_decathlon_into_hdf5.py:
+    <output_dir>/decathlon/Task01_BrainTumour/
+        dataset.json
+        imagesTr/BRATS_001.nii.gz   240x240x155x4 float32 (FLAIR, T1w, t1gd, T2w)
+        labelsTr/BRATS_001.nii.gz   uint8 labels 0-3
+        imagesTs/BRATS_...nii.gz
+
+The brain is an ellipsoid and the tumor is a set of nested blobs with
+irregular boundaries. Each tissue has its own intensity in each
+modality, plus a smooth bias field and noise.
+
+    python make_synthetic_brats.py --output_dir /tmp/synthetic --patients 20
+    python 3D_UNet/keras_training_only_version/train.py --data_path /tmp/synthetic/brats
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import nibabel as nib
+
+BACKGROUND, NECROTIC, EDEMA, ENHANCING = 0, 1, 2, 4
+BRAIN = -1   # Healthy brain tissue (only used for the intensities)
+
+BRATS_MODALITIES = ["flair", "t1", "t1ce", "t2"]
+DECATHLON_MODALITIES = {"0": "FLAIR", "1": "T1w", "2": "t1gd", "3": "T2w"}
+DECATHLON_LABELS = {"0": "background", "1": "edema",
+                    "2": "non-enhancing tumor", "3": "enhancing tumour"}
+# BraTS label -> Decathlon label
+DECATHLON_LABEL_MAP = {BACKGROUND: 0, EDEMA: 1, NECROTIC: 2, ENHANCING: 3}
+
+# Mean intensity of each tissue in each modality
+INTENSITY = {
+    "flair": {BRAIN: 350, EDEMA: 700, NECROTIC: 450, ENHANCING: 550},
+    "t1": {BRAIN: 500, EDEMA: 420, NECROTIC: 250, ENHANCING: 480},
+    "t1ce": {BRAIN: 520, EDEMA: 450, NECROTIC: 200, ENHANCING: 1100},
+    "t2": {BRAIN: 400, EDEMA: 900, NECROTIC: 1000, ENHANCING: 700},
+}
+
+
+def get_grid(shape):
+    """
+    Voxel coordinates scaled to [-1, 1] along each axis
+    """
+    axes = [np.linspace(-1, 1, n, dtype=np.float32) for n in shape]
+    return np.meshgrid(*axes, indexing="ij")
+
+
+def blob(grid, center, radii, rng, roughness=0.25):
+    """
+    Boolean mask of an ellipsoid whose radius varies with the direction,
+    which gives the irregular outline of a tumor region
+    """
+    x, y, z = [(g - c) / r for g, c, r in zip(grid, center, radii)]
+    distance = np.sqrt(x**2 + y**2 + z**2) + 1e-6
+    theta = np.arccos(np.clip(z / distance, -1, 1))
+    phi = np.arctan2(y, x)
+
+    scale = np.ones_like(distance)
+    for _ in range(3):
+        k, l = rng.randint(1, 5, size=2)
+        scale += roughness / 3 * np.sin(k * theta + rng.uniform(0, 2*np.pi)) \
+            * np.cos(l * phi + rng.uniform(0, 2*np.pi))
+    return distance < scale
+
+
+def make_patient(shape, rng):
+    """
+    BraTS labels and the four int16 modalities of one patient
+    """
+    grid = get_grid(shape)
+
+    brain_radii = rng.uniform(0.75, 0.9, size=3)
+    brain = blob(grid, (0, 0, 0), brain_radii, rng, roughness=0.05)
+
+    # Tumor inside one hemisphere, away from the edge of the brain
+    center = rng.uniform(-0.35, 0.35, size=3) * brain_radii
+    size = rng.uniform(0.25, 0.4)
+    radii = size * rng.uniform(0.8, 1.2, size=3)
+
+    labels = np.zeros(shape, dtype=np.uint8)
+    labels[blob(grid, center, radii, rng) & brain] = EDEMA
+    labels[blob(grid, center, 0.6 * radii, rng) & brain] = ENHANCING
+    labels[blob(grid, center, 0.35 * radii, rng) & brain] = NECROTIC
+
+    # Slowly varying scanner bias field
+    x, y, z = grid
+    bias = 1 + 0.1 * np.cos(np.pi * (x * rng.uniform(0.5, 1.5) +
+                                     y * rng.uniform(0.5, 1.5) +
+                                     z * rng.uniform(0.5, 1.5)))
+
+    images = {}
+    for modality in BRATS_MODALITIES:
+        tissue = np.where(labels == BACKGROUND, BRAIN, labels)
+        img = np.zeros(shape, dtype=np.float32)
+        for label, mean in INTENSITY[modality].items():
+            img[tissue == label] = mean * rng.uniform(0.9, 1.1)
+        img *= bias
+        img += rng.normal(0, 0.04, size=shape).astype(np.float32) * img
+        img[~brain] = 0   # BraTS images are skull stripped
+        images[modality] = np.clip(img, 0, np.iinfo(np.int16).max) \
+            .astype(np.int16)
+
+    return labels, images
+
+
+def save_nifti(data, filename):
+    img = nib.Nifti1Image(data, AFFINE)
+    img.set_data_dtype(data.dtype)
+    nib.save(img, filename)
+
+
+def write_brats(patient_id, grade, labels, images):
+    subject = "Brats18_SYN_{}_{:03d}_1".format(grade, patient_id)
+    subject_dir = os.path.join(args.output_dir, "brats", grade, subject)
+    os.makedirs(subject_dir, exist_ok=True)
+    for modality in BRATS_MODALITIES:
+        save_nifti(images[modality], os.path.join(
+            subject_dir, "{}_{}.nii.gz".format(subject, modality)))
+    save_nifti(labels, os.path.join(subject_dir, "{}_seg.nii.gz".format(subject)))
+
+
+def write_decathlon(patient_id, test, labels, images, dataset):
+    task_dir = os.path.join(args.output_dir, "decathlon", "Task01_BrainTumour")
+    filename = "BRATS_{:03d}.nii.gz".format(patient_id)
+
+    image = np.stack([images[m].astype(np.float32)
+                      for m in BRATS_MODALITIES], axis=-1)
+    images_dir = os.path.join(task_dir, "imagesTs" if test else "imagesTr")
+    os.makedirs(images_dir, exist_ok=True)
+    save_nifti(image, os.path.join(images_dir, filename))
+
+    if test:
+        dataset["test"].append("./imagesTs/{}".format(filename))
+        return
+
+    decathlon_labels = np.zeros_like(labels)
+    for brats_label, label in DECATHLON_LABEL_MAP.items():
+        decathlon_labels[labels == brats_label] = label
+    labels_dir = os.path.join(task_dir, "labelsTr")
+    os.makedirs(labels_dir, exist_ok=True)
+    save_nifti(decathlon_labels, os.path.join(labels_dir, filename))
+    dataset["training"].append({"image": "./imagesTr/{}".format(filename),
+                                "label": "./labelsTr/{}".format(filename)})
+
+
+parser = argparse.ArgumentParser(
+    description="Write a synthetic BraTS / Decathlon brain tumor dataset",
+    add_help=True)
+parser.add_argument("--output_dir",
+                    default="synthetic_data",
+                    help="Root directory for the dataset")
+parser.add_argument("--patients",
+                    type=int,
+                    default=10,
+                    help="Number of patients")
+parser.add_argument("--layout",
+                    default="both",
+                    choices=["brats", "decathlon", "both"],
+                    help="Directory layout to write")
+parser.add_argument("--shape",
+                    type=int,
+                    nargs=3,
+                    default=[240, 240, 155],
+                    help="Volume shape")
+parser.add_argument("--lgg_fraction",
+                    type=float,
+                    default=0.25,
+                    help="Fraction of BraTS patients put in LGG instead of HGG")
+parser.add_argument("--test_fraction",
+                    type=float,
+                    default=0.2,
+                    help="Fraction of Decathlon patients put in imagesTs")
+parser.add_argument("--seed",
+                    type=int,
+                    default=816,
+                    help="Random seed")
+
+args = parser.parse_args()
+
+# BraTS volumes are stored with the x and y axes flipped
+AFFINE = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+rng = np.random.RandomState(args.seed)
+dataset = {"name": "BRATS", "description": "Synthetic brain tumor dataset",
+           "tensorImageSize": "4D", "modality": DECATHLON_MODALITIES,
+           "labels": DECATHLON_LABELS, "training": [], "test": []}
+
+for patient_id in range(1, args.patients + 1):
+    labels, images = make_patient(tuple(args.shape), rng)
+
+    if args.layout in ["brats", "both"]:
+        grade = "LGG" if rng.rand() < args.lgg_fraction else "HGG"
+        write_brats(patient_id, grade, labels, images)
+    if args.layout in ["decathlon", "both"]:
+        write_decathlon(patient_id, rng.rand() < args.test_fraction,
+                        labels, images, dataset)
+
+    print("Patient {}/{}: tumor is {:.1f}% of the volume".format(
+        patient_id, args.patients, 100.0 * np.mean(labels > 0)))
+
+if args.layout in ["decathlon", "both"]:
+    dataset["numTraining"] = len(dataset["training"])
+    dataset["numTest"] = len(dataset["test"])
+    task_dir = os.path.join(args.output_dir, "decathlon", "Task01_BrainTumour")
+    with open(os.path.join(task_dir, "dataset.json"), "w") as f:
+        json.dump(dataset, f, indent=4)
+
+print("Saved {} synthetic patients to {}".format(args.patients,
+                                                 args.output_dir))
@@ -0,0 +1,675 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Run a benchmark sweep described by a JSON spec.
+
+Each configuration runs in a fresh subprocess with its own environment
+(OMP/KMP settings). The results are parsed and stored in a SQLite
+database along with the hardware and software metadata. Configurations
+already in the database are skipped, so an interrupted sweep can simply
+be restarted.
+
+    python run_sweep.py run sweeps/memory_3d_cpu.json
+    python run_sweep.py pivot --sweep memory_3d_cpu \
+        --rows dim_length --cols mode bz --value images_per_sec
+    python run_sweep.py export --sweep memory_3d_cpu --csv results.csv
+    python run_sweep.py autotune sweeps/autotune_unet3d.json
+
+See README.md for the format of the spec.
+"""
+
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import platform
+import re
+import shlex
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import autotune
+import topology
+
+DEFAULT_DB = "benchmark_results.db"
+DEFAULT_RESULTS_DIR = "benchmark_runs"
+
+
+def load_spec(filename):
+    """
+    Read the sweep spec. Relative working directories are relative
+    to the spec file.
+    """
+    with open(filename) as f:
+        spec = json.load(f)
+
+    spec.setdefault("name", os.path.splitext(os.path.basename(filename))[0])
+    spec.setdefault("env", {})
+    spec.setdefault("parse", {})
+    spec.setdefault("exclude", [])
+    spec.setdefault("timeout", None)
+    spec.setdefault("before_each", None)
+
+    for name, pattern in spec["parse"].items():
+        if re.compile(pattern).groups != 1:
+            sys.exit("{}: the parse pattern of {} must have exactly one "
+                     "group: {}".format(filename, name, pattern))
+
+    workdir = spec.get("workdir", ".")
+    if not os.path.isabs(workdir):
+        workdir = os.path.join(os.path.dirname(os.path.abspath(filename)),
+                               workdir)
+    spec["workdir"] = os.path.normpath(workdir)
+
+    return spec
+
+
+def expand_sweep(spec):
+    """
+    Cartesian product of the sweep dimensions.
+
+    A dimension is either a list of values or an object mapping each
+    value to the text substituted into the command (e.g. the mode
+    "inference" becomes "--inference"). Returns a list of
+    (config, substitutions) tuples.
+    """
+    names = sorted(spec["sweep"].keys())
+    choices = []
+    for name in names:
+        values = spec["sweep"][name]
+        if isinstance(values, dict):
+            choices.append([(value, text) for value, text in
+                            sorted(values.items())])
+        else:
+            choices.append([(value, value) for value in values])
+
+    configs = []
+    for combo in itertools.product(*choices):
+        config = {name: value for name, (value, _) in zip(names, combo)}
+        substitutions = {name: text for name, (_, text) in zip(names, combo)}
+
+        excluded = any(all(config.get(k) == v for k, v in exclude.items())
+                       for exclude in spec["exclude"])
+        if not excluded:
+            configs.append((config, substitutions))
+
+    return configs
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def config_slug(config):
+    return "_".join("{}{}".format(k, config[k]) for k in sorted(config))
+
+
+def read_file(filename):
+    try:
+        with open(filename) as f:
+            return f.read()
+    except IOError:
+        return ""
+
+
+def get_hardware_metadata():
+    """
+    CPU, memory and OS details for the results database
+    """
+    cpuinfo = read_file("/proc/cpuinfo")
+    meminfo = read_file("/proc/meminfo")
+
+    model = re.search(r"^model name\s*:\s*(.*)$", cpuinfo, re.MULTILINE)
+    sockets = set(re.findall(r"^physical id\s*:\s*(\d+)$", cpuinfo,
+                             re.MULTILINE))
+    cores = set(re.findall(r"^physical id\s*:\s*(\d+)$\n(?:.*\n)*?"
+                           r"^core id\s*:\s*(\d+)$", cpuinfo, re.MULTILINE))
+    memory = re.search(r"^MemTotal:\s*(\d+) kB", meminfo, re.MULTILINE)
+
+    return {"hostname": platform.node(),
+            "cpu_model": model.group(1) if model else platform.processor(),
+            "sockets": len(sockets) if sockets else None,
+            "physical_cores": len(cores) if cores else None,
+            "logical_cores": os.cpu_count(),
+            "memory_gb": round(int(memory.group(1)) / 1024.0**2, 1)
+                         if memory else None,
+            "kernel": platform.release(),
+            "platform": platform.platform()}
+
+
+def get_software_metadata(python):
+    """
+    Versions of the frameworks used by the benchmarks. This runs in a
+    subprocess so that the runner itself doesn't import TensorFlow.
+    """
+    script = ("import json, sys\n"
+              "versions = {'python': sys.version.split()[0]}\n"
+              "for name in ['numpy', 'tensorflow', 'keras', 'horovod']:\n"
+              "    try:\n"
+              "        versions[name] = __import__(name).__version__\n"
+              "    except Exception:\n"
+              "        versions[name] = None\n"
+              "print(json.dumps(versions))\n")
+    try:
+        output = subprocess.check_output([python, "-c", script],
+                                         stderr=subprocess.DEVNULL,
+                                         universal_newlines=True)
+        return json.loads(output.strip().splitlines()[-1])
+    except (subprocess.CalledProcessError, OSError, ValueError, IndexError):
+        return {"python": platform.python_version()}
+
+
+def open_db(filename):
+    db = sqlite3.connect(filename)
+    db.execute("""CREATE TABLE IF NOT EXISTS results (
+                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  sweep TEXT,
+                  config_key TEXT,
+                  config TEXT,
+                  metrics TEXT,
+                  status TEXT,
+                  returncode INTEGER,
+                  wall_time REAL,
+                  max_rss_mb REAL,
+                  command TEXT,
+                  env TEXT,
+                  log_file TEXT,
+                  hardware TEXT,
+                  software TEXT,
+                  started TEXT)""")
+    db.execute("""CREATE INDEX IF NOT EXISTS results_config
+                  ON results (sweep, config_key)""")
+    return db
+
+
+def get_measured(db, sweep, retry_failed):
+    """
+    Configurations that don't need to be run again
+    """
+    if retry_failed:
+        query = "SELECT config_key FROM results WHERE sweep=? AND status='ok'"
+    else:
+        query = "SELECT config_key FROM results WHERE sweep=?"
+    return set(row[0] for row in db.execute(query, (sweep,)))
+
+
+def parse_metrics(spec, log_text, substitutions):
+    """
+    Pull the metrics out of the log with the regular expressions in
+    the spec and merge in the JSON results file if there is one.
+    """
+    metrics = {}
+    # Printed by benchmarks started with --allocator (allocator.py).
+    # Differs from the requested allocator if the library was not found.
+    matches = re.findall(r"^Memory allocator: (\S+)", log_text, re.MULTILINE)
+    if matches:
+        metrics["allocator_used"] = matches[-1]
+
+    for name, pattern in spec["parse"].items():
+        matches = list(re.finditer(pattern, log_text, re.MULTILINE))
+        if matches:
+            value = matches[-1].group(1)   # Last match is the final summary
+            try:
+                metrics[name] = float(value.replace(",", ""))
+            except ValueError:
+                metrics[name] = value
+
+    if "results_json" in spec:
+        filename = spec["results_json"].format(**substitutions)
+        if not os.path.isabs(filename):
+            filename = os.path.join(spec["workdir"], filename)
+        try:
+            with open(filename) as f:
+                results = json.load(f)
+            for name, value in flatten(results).items():
+                metrics.setdefault(name, value)
+        except (IOError, ValueError):
+            pass
+
+    return metrics
+
+
+def flatten(d, prefix=""):
+    """
+    {"latency_ms": {"p50": 1}} -> {"latency_ms_p50": 1}
+    Lists are dropped since they don't fit in a table.
+    """
+    flat = {}
+    for k, v in d.items():
+        name = prefix + k
+        if isinstance(v, dict):
+            flat.update(flatten(v, name + "_"))
+        elif not isinstance(v, list):
+            flat[name] = v
+    return flat
+
+
+def run_process(command, env, cwd, log_file, timeout):
+    """
+    Run one configuration. os.wait4 gives the peak RSS of this child
+    only (getrusage(RUSAGE_CHILDREN) would give the max over all runs).
+    """
+    with open(log_file, "w") as log:
+        proc = subprocess.Popen(command, cwd=cwd, env=env, stdout=log,
+                                stderr=subprocess.STDOUT,
+                                start_new_session=True)
+
+        timed_out = []
+
+        def kill():
+            timed_out.append(True)
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+
+        start_time = time.time()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall_time = time.time() - start_time
+        if timer is not None:
+            timer.cancel()
+
+    if os.WIFEXITED(status):
+        returncode = os.WEXITSTATUS(status)
+    else:
+        returncode = -os.WTERMSIG(status)
+    proc.returncode = returncode
+
+    if timed_out:
+        state = "timeout"
+    elif returncode == 0:
+        state = "ok"
+    elif returncode == -signal.SIGKILL:
+        state = "killed"   # Usually the OOM killer
+    else:
+        state = "failed"
+
+    max_rss_mb = rusage.ru_maxrss / 1024.0   # Linux reports KB
+
+    return state, returncode, wall_time, max_rss_mb
+
+
+def run_sweep(args):
+
+    spec = load_spec(args.spec)
+    if "tune" in spec:
+        sys.exit("{} is an autotune spec, run it with "
+                 "\"run_sweep.py autotune\"".format(args.spec))
+    db = open_db(args.db)
+
+    configs = expand_sweep(spec)
+    measured = set() if args.force else \
+        get_measured(db, spec["name"], args.retry_failed)
+
+    todo = [(c, s) for c, s in configs if config_key(c) not in measured]
+    print("Sweep '{}': {} configurations, {} already measured, {} to run".
+          format(spec["name"], len(configs), len(configs) - len(todo),
+                 len(todo)))
+
+    results_dir = os.path.abspath(os.path.join(args.results_dir,
+                                               spec["name"]))
+    todo = [(c, dict(s, python=args.python,
+                     run_dir=os.path.join(results_dir, config_slug(c))))
+            for c, s in todo]
+
+    if args.dry_run or len(todo) == 0:
+        for config, substitutions in todo:
+            print(spec["command"].format(**substitutions))
+        if not args.dry_run:
+            print_pivot(db, spec["name"], spec.get("pivot"))
+        return
+
+    hardware = get_hardware_metadata()
+    software = get_software_metadata(args.python)
+    print("Hardware: {}".format(hardware))
+    print("Software: {}".format(software))
+
+    for idx, (config, substitutions) in enumerate(todo):
+        print("\n[{}/{}] {}".format(idx+1, len(todo), config))
+        run_config(spec, db, config, substitutions, hardware, software)
+
+    print_pivot(db, spec["name"], spec.get("pivot"))
+
+
+def run_config(spec, db, config, substitutions, hardware, software):
+    """
+    Run one configuration, store it in the database and return
+    its status and metrics
+    """
+    run_dir = substitutions["run_dir"]
+    if not os.path.isdir(run_dir):
+        os.makedirs(run_dir)
+
+    command = shlex.split(spec["command"].format(**substitutions))
+    env = dict(os.environ)
+    run_env = {k: str(v).format(**substitutions)
+               for k, v in spec["env"].items()}
+    env.update(run_env)
+
+    log_file = os.path.join(run_dir, "output.log")
+    started = datetime.datetime.now().isoformat()
+
+    if spec["before_each"] is not None:   # e.g. drop the page cache
+        subprocess.call(spec["before_each"], shell=True,
+                        cwd=spec["workdir"])
+    status, returncode, wall_time, max_rss_mb = run_process(
+        command, env, spec["workdir"], log_file, spec["timeout"])
+
+    metrics = parse_metrics(spec, read_file(log_file), substitutions)
+    print("    status={}, wall_time={:.1f}s, max_rss={:.0f}MB, {}".format(
+        status, wall_time, max_rss_mb, metrics))
+
+    # Drop any earlier failed attempt so the table has one row per config
+    db.execute("DELETE FROM results WHERE sweep=? AND config_key=?",
+               (spec["name"], config_key(config)))
+    db.execute("""INSERT INTO results (sweep, config_key, config,
+                  metrics, status, returncode, wall_time, max_rss_mb,
+                  command, env, log_file, hardware, software, started)
+                  VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+               (spec["name"], config_key(config), json.dumps(config),
+                json.dumps(metrics), status, returncode, wall_time,
+                max_rss_mb, " ".join(command), json.dumps(run_env),
+                log_file, json.dumps(hardware), json.dumps(software),
+                started))
+    db.commit()
+
+    return status, metrics
+
+
+def get_tune_space(spec, config):
+    """
+    (value, text) pairs of each tuned dimension and the starting point.
+    "cores" stands for 1/4, 1/2, 3/4 and all of the physical cores that
+    one of config["processes_per_node"] processes gets (see topology.py),
+    plus their hyperthread siblings if there are any.
+    """
+    plan = topology.plan_threads(config.get("processes_per_node", 1))
+    start = dict(spec.get("start", {}))
+    space = {}
+    for name, values in spec["tune"].items():
+        if values == "cores":
+            cores = plan["intra_threads"]
+            values = sorted(set(max(1, cores * i // 4) for i in range(1, 5)))
+            if len(plan["cpus"]) > cores:
+                values.append(len(plan["cpus"]))
+            start.setdefault(name, cores)
+        if isinstance(values, dict):
+            space[name] = sorted(values.items())
+        else:
+            space[name] = [(value, value) for value in values]
+        start.setdefault(name, space[name][0][0])
+    return space, start
+
+
+def get_ok_metrics(db, sweep, config):
+    query = """SELECT metrics FROM results WHERE sweep=? AND config_key=?
+               AND status='ok'"""
+    for (metrics,) in db.execute(query, (sweep, config_key(config))):
+        return json.loads(metrics)
+    return None
+
+
+def memoize(evaluate):
+    """
+    Coordinate descent comes back to the same points, run each once
+    """
+    values = {}
+
+    def cached(point):
+        key = config_key(point)
+        if key not in values:
+            values[key] = evaluate(point)
+        return values[key]
+    return cached
+
+
+def run_autotune(args):
+    """
+    Tune the dimensions in spec["tune"] for every configuration of
+    spec["sweep"] and save the best to the autotune cache of this host
+    """
+    spec = load_spec(args.spec)
+    db = open_db(args.db)
+    objective = spec["objective"]
+    sign = -1 if spec.get("minimize", False) else 1
+
+    hardware = get_hardware_metadata()
+    software = get_software_metadata(args.python)
+    results_dir = os.path.abspath(os.path.join(args.results_dir,
+                                               spec["name"]))
+
+    for shape, shape_substitutions in expand_sweep(spec):
+        space, start = get_tune_space(spec, shape)
+        print("\nTuning {} {} over {}".format(
+            spec["model"], shape,
+            {name: [v for v, _ in values] for name, values in space.items()}))
+
+        trials = []
+
+        def evaluate(point):
+            config = dict(shape, **point)
+            metrics = None if args.force else \
+                get_ok_metrics(db, spec["name"], config)
+            if metrics is None:
+                substitutions = dict(shape_substitutions, python=args.python,
+                                     run_dir=os.path.join(results_dir,
+                                                          config_slug(config)))
+                for name, value in point.items():
+                    substitutions[name] = dict(space[name])[value]
+                print("\n[trial {}] {}".format(len(trials)+1, config))
+                _, metrics = run_config(spec, db, config, substitutions,
+                                        hardware, software)
+            value = metrics.get(objective)
+            trials.append((point, value))
+            return None if value is None else sign * value
+
+        evaluate = memoize(evaluate)
+        best, best_value = autotune.coordinate_descent(
+            {name: [v for v, _ in values] for name, values in space.items()},
+            start, evaluate, args.rounds, args.min_gain)
+
+        if best_value is None:
+            print("No trial of {} {} gave {}".format(spec["model"], shape,
+                                                     objective))
+            continue
+
+        settings = {name: dict(space[name])[value]
+                    for name, value in best.items()}
+        filename = autotune.save_settings(args.cache, spec["model"], shape,
+                                          best, settings, objective,
+                                          sign * best_value)
+        print("\n{} {}: best {} = {:.3f} with {} after {} trials "
+              "(saved to {})".format(spec["model"], shape, objective,
+                                     sign * best_value, best, len(trials),
+                                     filename))
+
+
+def load_rows(db, sweep):
+    """
+    One flat dictionary per configuration with the config,
+    the metrics and the run details.
+    """
+    rows = []
+    query = """SELECT config, metrics, status, returncode, wall_time,
+               max_rss_mb, hardware, software, started
+               FROM results WHERE sweep=? ORDER BY id"""
+    for (config, metrics, status, returncode, wall_time, max_rss_mb,
+         hardware, software, started) in db.execute(query, (sweep,)):
+        row = json.loads(config)
+        row.update(json.loads(metrics))
+        row.update({"status": status, "returncode": returncode,
+                    "wall_time": wall_time, "max_rss_mb": max_rss_mb,
+                    "started": started})
+        row.update(flatten(json.loads(hardware), "hw_"))
+        row.update(flatten(json.loads(software), "sw_"))
+        rows.append(row)
+    return rows
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{:.3f}".format(value)
+    return str(value)
+
+
+def print_pivot(db, sweep, pivot):
+    """
+    Print a table of one value with the row dimensions down the side
+    and the column dimensions across the top.
+    """
+    if not pivot:
+        return
+
+    rows = load_rows(db, sweep)
+    row_keys = sorted(set(tuple(r.get(k) for k in pivot["rows"])
+                          for r in rows), key=str)
+    col_keys = sorted(set(tuple(r.get(k) for k in pivot["cols"])
+                          for r in rows), key=str)
+
+    table = {}
+    for r in rows:
+        value = r.get(pivot["value"])
+        if r["status"] != "ok" and value is None:
+            value = r["status"]
+        table[(tuple(r.get(k) for k in pivot["rows"]),
+               tuple(r.get(k) for k in pivot["cols"]))] = value
+
+    width = max([12] + [len(format_value(v)) + 2 for v in table.values()])
+    row_label = ",".join(pivot["rows"])
+    print("\n{} ({} by {})".format(pivot["value"], row_label,
+                                   ",".join(pivot["cols"])))
+    print(row_label.rjust(width) + "".join(
+        ",".join(str(c) for c in col).rjust(width) for col in col_keys))
+    for row in row_keys:
+        print(",".join(str(r) for r in row).rjust(width) + "".join(
+            format_value(table.get((row, col))).rjust(width)
+            for col in col_keys))
+
+
+def pivot(args):
+    db = open_db(args.db)
+    print_pivot(db, args.sweep, {"rows": args.rows, "cols": args.cols,
+                                 "value": args.value})
+
+
+def export(args):
+    """
+    Write every configuration of the sweep as a row of a CSV file
+    """
+    db = open_db(args.db)
+    rows = load_rows(db, args.sweep)
+    columns = []
+    for r in rows:
+        for k in r:
+            if k not in columns:
+                columns.append(k)
+
+    with open(args.csv, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print("Saved {} rows to {}".format(len(rows), args.csv))
+
+
+def get_parser():
+
+    parser = argparse.ArgumentParser(
+        description="Run and report benchmark sweeps", add_help=True)
+    parser.add_argument("--db", default=DEFAULT_DB,
+                        help="SQLite results database")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="Run a sweep spec")
+    run_parser.add_argument("spec", help="JSON sweep spec")
+    run_parser.add_argument("--results_dir", default=DEFAULT_RESULTS_DIR,
+                            help="Directory for the logs of each run")
+    run_parser.add_argument("--python", default=sys.executable,
+                            help="Python interpreter for {python} "
+                            "in the command")
+    run_parser.add_argument("--force", action="store_true", default=False,
+                            help="Run configurations that were already "
+                            "measured")
+    run_parser.add_argument("--retry_failed", action="store_true",
+                            default=False,
+                            help="Run configurations that failed or "
+                            "timed out before")
+    run_parser.add_argument("--dry_run", action="store_true", default=False,
+                            help="Print the commands that would be run")
+    run_parser.set_defaults(func=run_sweep)
+
+    pivot_parser = subparsers.add_parser("pivot",
+                                         help="Print a pivot table")
+    pivot_parser.add_argument("--sweep", required=True, help="Sweep name")
+    pivot_parser.add_argument("--rows", nargs="+", required=True,
+                              help="Dimensions for the rows")
+    pivot_parser.add_argument("--cols", nargs="+", required=True,
+                              help="Dimensions for the columns")
+    pivot_parser.add_argument("--value", required=True,
+                              help="Metric to show")
+    pivot_parser.set_defaults(func=pivot)
+
+    export_parser = subparsers.add_parser("export",
+                                          help="Export a sweep to CSV")
+    export_parser.add_argument("--sweep", required=True, help="Sweep name")
+    export_parser.add_argument("--csv", required=True, help="Output file")
+    export_parser.set_defaults(func=export)
+
+    tune_parser = subparsers.add_parser(
+        "autotune", help="Find the best thread settings of a model")
+    tune_parser.add_argument("spec", help="JSON autotune spec")
+    tune_parser.add_argument("--results_dir", default=DEFAULT_RESULTS_DIR,
+                             help="Directory for the logs of each trial")
+    tune_parser.add_argument("--python", default=sys.executable,
+                             help="Python interpreter for {python} "
+                             "in the command")
+    tune_parser.add_argument("--rounds", type=int, default=2,
+                             help="Coordinate descent rounds")
+    tune_parser.add_argument("--min_gain", type=float, default=0.02,
+                             help="Relative improvement needed to move "
+                             "to a new point")
+    tune_parser.add_argument("--cache", default=None,
+                             help="Autotune cache file (default: "
+                             "~/.cache/topologies/autotune-<host>.json)")
+    tune_parser.add_argument("--force", action="store_true", default=False,
+                             help="Run trials that were already measured")
+    tune_parser.set_defaults(func=run_autotune)
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = get_parser().parse_args()
+    args.func(args)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Horovod scaling efficiency of the MNIST and U-Net trainers.
+
+Runs a trainer under mpirun at each worker count in two modes:
+    strong - the global batch (--global_batch_size) is split between
+             the workers
+    weak   - every worker gets --worker_batch_size, so the global batch
+             grows with the workers
+
+Each rank is bound to a socket (--binding socket) or to its own set of
+physical cores (--binding core) and gets as many intra-op threads as it
+has cores. Without --hosts everything runs on localhost; with --hosts
+(a comma separated list, like distributed_unet/Horovod/hosts.txt) the
+workers are split evenly between the nodes, which are assumed to have
+the same topology as this one.
+
+    python scaling_efficiency.py --trainer unet --workers 1 2 4 8
+    python scaling_efficiency.py --trainer mnist --workers 2 4 8 16 \
+        --hosts ../distributed_unet/Horovod/hosts.txt --modes weak
+
+The trainers print the samples/sec of rank 0 on a "RESULT " line
+(see print_result). Speedup and efficiency are relative to the smallest
+worker count of the same mode. The allreduce share is the time rank 0
+spends in ALLREDUCE activities of the Horovod timeline over the time of
+its training steps (overlap with the computation is counted as
+allreduce time). The timeline can't be cut at the end of the warmup, so
+both include the warmup steps, while the samples/sec leave them out.
+Any other arguments are passed to the trainer.
+"""
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+
+import topology
+from analyze_trace import union_time
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+TRAINERS = {
+    "mnist": {"script": os.path.join(BASEDIR, "..", "cnn_benchmarking",
+                                     "MNIST", "benchmark_horovod_mnist.py"),
+              "args": []},
+    "unet": {"script": os.path.join(BASEDIR, "..", "distributed_unet",
+                                    "Horovod", "main.py"),
+             "args": ["--data_path", "synthetic"]},
+}
+
+COLUMNS = ["mode", "workers", "nodes", "binding", "threads", "batch_size",
+           "global_batch_size", "status", "step_time", "samples_per_sec",
+           "speedup", "efficiency", "allreduce_time", "allreduce_share"]
+
+
+def read_hosts(filename):
+    with open(filename) as f:
+        return [h.strip() for h in f.read().replace("\n", ",").split(",")
+                if h.strip()]
+
+
+def get_threads(workers_per_node, binding, sockets, cores_per_socket):
+    """
+    Intra-op threads of each rank (the cores it is bound to)
+    """
+    if binding == "core":
+        return (sockets * cores_per_socket) // workers_per_node
+    ranks_per_socket = -(-workers_per_node // sockets)
+    return cores_per_socket // ranks_per_socket
+
+
+def get_mpirun(num_workers, hosts, workers_per_node, binding, threads):
+    """
+    mpirun command line that places workers_per_node ranks on each host
+    """
+    cmd = args.mpirun.split() + ["-np", str(num_workers),
+                                 "-H", ",".join("{}:{}".format(
+                                     host, workers_per_node)
+                                     for host in hosts),
+                                 "--report-bindings"]
+    if binding == "core":
+        cmd += ["--map-by", "socket:PE={}".format(threads),
+                "--bind-to", "core"]
+    else:
+        cmd += ["--map-by", "socket", "--bind-to", "socket"]
+    return cmd
+
+
+def load_timeline(filename):
+    """
+    (start, duration) in us of every ALLREDUCE activity in a Horovod
+    timeline. The file is not closed if the job was killed, so it
+    is read one event per line.
+    """
+    intervals = []
+    open_events = {}
+    with open(filename) as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if not line.startswith("{"):
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            stack = open_events.setdefault(event.get("pid"), [])
+            if event.get("ph") == "B":
+                stack.append((event.get("name"), float(event["ts"])))
+            elif event.get("ph") == "E" and len(stack) > 0:
+                name, start = stack.pop()
+                if name == "ALLREDUCE":
+                    intervals.append((start, float(event["ts"]) - start))
+    return intervals
+
+
+def print_result(step_times, batch_size, warmup_steps, num_workers=1,
+                 rank=0, **extra):
+    """
+    Rank 0 prints a single line starting with "RESULT " followed by JSON,
+    read back by parse_result. step_time is the mean time of the steps
+    after the warmup. train_time is the time of all of the steps, warmup
+    included, the same steps as the ALLREDUCE activities of the timeline.
+    Any extra keyword arguments are added to the result.
+    """
+    if rank != 0:
+        return
+    timed = step_times[warmup_steps:]
+    if len(timed) == 0:
+        print("No steps after the {} warmup steps".format(warmup_steps))
+        return
+    step_time = sum(timed) / len(timed)
+    result = {"workers": num_workers,
+              "batch_size": batch_size,
+              "steps": len(step_times),
+              "step_time": step_time,
+              "train_time": sum(step_times),
+              "samples_per_sec": batch_size * num_workers / step_time}
+    result.update(extra)
+    print("RESULT {}".format(json.dumps(result)))
+
+
+def parse_result(log_text):
+    for line in log_text.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    return None
+
+
+def run_config(mode, num_workers, hosts, sockets, cores_per_socket):
+    workers_per_node = num_workers // len(hosts)
+    threads = get_threads(workers_per_node, args.binding, sockets,
+                          cores_per_socket)
+    if mode == "strong":
+        batch_size = args.global_batch_size // num_workers
+    else:
+        batch_size = args.worker_batch_size
+
+    result = {"mode": mode, "workers": num_workers, "nodes": len(hosts),
+              "binding": args.binding, "threads": threads,
+              "batch_size": batch_size,
+              "global_batch_size": batch_size * num_workers}
+
+    name = "{}_{}workers".format(mode, num_workers)
+    run_dir = os.path.abspath(os.path.join(args.log_dir, name))
+    if not os.path.isdir(run_dir):
+        os.makedirs(run_dir)
+    timeline = os.path.join(run_dir, "horovod_timeline.json")
+    if os.path.isfile(timeline):
+        os.remove(timeline)
+
+    trainer = TRAINERS[args.trainer]
+    cmd = get_mpirun(num_workers, hosts, workers_per_node, args.binding,
+                     threads)
+    # Open MPI passes these environment variables on to every rank
+    for var in ["OMP_NUM_THREADS", "HOROVOD_TIMELINE"]:
+        cmd += ["-x", var]
+    cmd += [args.python, trainer["script"]] + trainer["args"] + [
+        "--batch_size", str(batch_size),
+        "--max_steps", str(args.steps),
+        "--warmup_steps", str(args.warmup_steps),
+        "--num_threads", str(threads),
+        "--num_inter_threads", str(args.inter_threads),
+        "--output_path", os.path.join(run_dir, "checkpoints")] + trainer_args
+
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads),
+               HOROVOD_TIMELINE=timeline)
+
+    print("{} scaling, {} worker(s) x {} thread(s), batch size {} per "
+          "worker".format(mode, num_workers, threads, batch_size),
+          end="", flush=True)
+    with open(os.path.join(run_dir, "output.log"), "w") as log:
+        log.write(" ".join(cmd) + "\n")
+        log.flush()
+        try:
+            returncode = subprocess.call(cmd, env=env, stdout=log,
+                                         stderr=subprocess.STDOUT,
+                                         timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            returncode = None
+    with open(os.path.join(run_dir, "output.log")) as f:
+        run = parse_result(f.read())
+
+    if returncode is None:
+        result["status"] = "timeout"
+    elif returncode != 0 or run is None:
+        result["status"] = "failed"
+    else:
+        result["status"] = "ok"
+        result["step_time"] = run["step_time"]
+        result["samples_per_sec"] = run["samples_per_sec"]
+        if os.path.isfile(timeline) and run.get("train_time", 0) > 0:
+            allreduce_time = union_time(load_timeline(timeline)) / 1e6
+            result["allreduce_time"] = allreduce_time
+            result["allreduce_share"] = min(1.0,
+                                            allreduce_time / run["train_time"])
+
+    if result["status"] == "ok":
+        print(": {:,.1f} samples/sec".format(result["samples_per_sec"]))
+    else:
+        print(": {} (see {})".format(result["status"], run_dir))
+    return result
+
+
+def add_efficiency(results):
+    """
+    Speedup and efficiency relative to the smallest worker count of each mode
+    """
+    for mode in args.modes:
+        runs = [r for r in results if r["mode"] == mode and r["status"] == "ok"]
+        if len(runs) == 0:
+            continue
+        base = min(runs, key=lambda r: r["workers"])
+        for r in runs:
+            r["speedup"] = r["samples_per_sec"] / base["samples_per_sec"]
+            r["efficiency"] = r["speedup"] * base["workers"] / r["workers"]
+
+
+def fmt(value, spec):
+    return "" if value is None else spec.format(value)
+
+
+parser = argparse.ArgumentParser(
+    description="Horovod strong and weak scaling efficiency", add_help=True)
+parser.add_argument("--trainer", default="unet", choices=sorted(TRAINERS),
+                    help="Trainer to run")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                    help="Total numbers of workers")
+parser.add_argument("--modes", nargs="+", default=["strong", "weak"],
+                    choices=["strong", "weak"],
+                    help="Scaling modes")
+parser.add_argument("--global_batch_size", type=int, default=256,
+                    help="Global batch size for strong scaling")
+parser.add_argument("--worker_batch_size", type=int, default=64,
+                    help="Batch size per worker for weak scaling")
+parser.add_argument("--binding", default="socket", choices=["socket", "core"],
+                    help="Bind each rank to a socket or to its own cores")
+parser.add_argument("--hosts", default=None,
+                    help="File with the comma separated node addresses. "
+                    "Default is localhost.")
+parser.add_argument("--steps", type=int, default=50,
+                    help="Training steps per worker")
+parser.add_argument("--warmup_steps", type=int, default=5,
+                    help="Steps left out of the throughput")
+parser.add_argument("--inter_threads", type=int, default=2,
+                    help="Inter-op threads per rank")
+parser.add_argument("--mpirun", default="mpirun --allow-run-as-root "
+                    "--oversubscribe",
+                    help="MPI launcher command")
+parser.add_argument("--python", default=sys.executable,
+                    help="Python interpreter for the trainer")
+parser.add_argument("--timeout", type=int, default=1800,
+                    help="Seconds before a run is killed")
+parser.add_argument("--log_dir", default="scaling_runs",
+                    help="Directory for the output of every run")
+parser.add_argument("--output", default="scaling_efficiency.csv",
+                    help="Save every configuration to this CSV file")
+
+
+if __name__ == "__main__":
+
+    args, trainer_args = parser.parse_known_args()
+
+    hosts = read_hosts(args.hosts) if args.hosts else ["localhost"]
+    node = topology.get_topology()
+    sockets, cores_per_socket = node["sockets"], node["cores_per_socket"]
+    print("{} node(s), {} socket(s) x {} physical cores per node".format(
+        len(hosts), sockets, cores_per_socket))
+
+    results = []
+    for mode in args.modes:
+        for num_workers in sorted(args.workers):
+            if num_workers % len(hosts) != 0:
+                print("Skipping {} workers: not a multiple of the {} nodes"
+                      .format(num_workers, len(hosts)))
+                continue
+            if mode == "strong" and args.global_batch_size < num_workers:
+                print("Skipping {} workers: global batch size {} is too "
+                      "small".format(num_workers, args.global_batch_size))
+                continue
+            if get_threads(num_workers // len(hosts), args.binding, sockets,
+                           cores_per_socket) < 1:
+                print("Skipping {} workers: more workers than cores"
+                      .format(num_workers))
+                continue
+            results.append(run_config(mode, num_workers, hosts, sockets,
+                                      cores_per_socket))
+
+    add_efficiency(results)
+
+    with open(args.output, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    print("\nSaved {} configurations to {}".format(len(results), args.output))
+
+    print("\n{:>6} {:>7} {:>7} {:>6} {:>12} {:>14} {:>8} {:>10} {:>10}"
+          .format("mode", "workers", "threads", "batch", "step_time_s",
+                  "samples/sec", "speedup", "efficiency", "allreduce"))
+    for r in results:
+        print("{:>6} {:>7} {:>7} {:>6} {:>12} {:>14} {:>8} {:>10} {:>10}"
+              .format(r["mode"], r["workers"], r["threads"], r["batch_size"],
+                      fmt(r.get("step_time"), "{:.4f}"),
+                      fmt(r.get("samples_per_sec"), "{:,.1f}"),
+                      fmt(r.get("speedup"), "{:.2f}x"),
+                      fmt(r.get("efficiency"), "{:.1%}"),
+                      fmt(r.get("allreduce_share"), "{:.1%}")
+                      if r["status"] == "ok" else r["status"]))
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+CPU topology of this node and the threads of each process running on it.
+
+The sockets, physical cores, hyperthread siblings and NUMA nodes are read
+from sysfs. plan_threads() splits the physical cores between the processes
+on the node (whole NUMA nodes first) so that no two processes share a core,
+and gives each process its intra-op threads (one per core), inter-op
+threads (one per socket) and an OpenMP proclist. A benchmark applies the
+plan before TensorFlow creates its thread pools:
+
+    sys.path.append(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "..", "benchmark_runner"))
+    import topology
+
+    topology.add_arguments(parser)
+    args = parser.parse_args()
+    topology.setup_threads(args)   # Fills in args.intraop_threads etc.
+
+A KMP_AFFINITY already in the environment is kept.
+
+Under mpirun the rank on the node and the number of ranks on the node come
+from the MPI environment. If mpirun already bound the rank to some of the
+CPUs (--bind-to core or socket) the threads are planned within those CPUs,
+split between the ranks bound to the same CPUs.
+
+    python topology.py                          # topology of this node
+    python topology.py --processes_per_node 4   # plan of every process
+    eval $(python topology.py --shell)          # shell variables
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+
+import autotune
+
+SYSFS = "/sys/devices/system"
+
+# Cgroup cpusets (v2, then v1) limit the CPUs of a container
+CPUSET_FILES = ["/sys/fs/cgroup/cpuset.cpus.effective",
+                "/sys/fs/cgroup/cpuset/cpuset.effective_cpus",
+                "/sys/fs/cgroup/cpuset/cpuset.cpus"]
+
+# OpenMP settings that worker_env doesn't pass on to a worker
+OPENMP_VARS = ["OMP_NUM_THREADS", "OMP_PROC_BIND", "KMP_AFFINITY",
+               "KMP_BLOCKTIME", "KMP_SETTINGS"]
+
+# Open MPI, Intel MPI / MPICH, MVAPICH2, Slurm
+LOCAL_RANK_VARS = ["OMPI_COMM_WORLD_LOCAL_RANK", "MPI_LOCALRANKID",
+                   "MV2_COMM_WORLD_LOCAL_RANK", "SLURM_LOCALID"]
+LOCAL_SIZE_VARS = ["OMPI_COMM_WORLD_LOCAL_SIZE", "MPI_LOCALNRANKS",
+                   "MV2_COMM_WORLD_LOCAL_SIZE"]
+
+
+def add_arguments(parser):
+    """
+    Add --processes_per_node and --use_smt to a benchmark's argparse parser
+    """
+    parser.add_argument("--processes_per_node",
+                        type=int,
+                        default=None,
+                        help="Processes sharing this node's cores "
+                             "(default: MPI ranks on the node, or 1)")
+    parser.add_argument("--use_smt",
+                        action="store_true",
+                        default=False,
+                        help="Also run intra-op threads on the "
+                             "hyperthread siblings")
+
+
+def read_int(filename, default):
+    try:
+        with open(filename) as f:
+            return int(f.read().strip())
+    except (IOError, ValueError):
+        return default
+
+
+def parse_cpu_list(text):
+    """
+    "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus += range(int(first), int(last) + 1)
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    """
+    [0, 1, 2, 3, 8, 10, 11] -> "0-3,8,10-11"
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else "{}-{}".format(a, b)
+                    for a, b in ranges)
+
+
+def read_cpu_list(filename):
+    try:
+        with open(filename) as f:
+            return parse_cpu_list(f.read())
+    except (IOError, ValueError):
+        return None
+
+
+def get_node_cpus():
+    """
+    CPUs that the processes on this node may share: the online CPUs,
+    limited to the cpuset of the container if there is one
+    """
+    cpus = read_cpu_list(os.path.join(SYSFS, "cpu", "online"))
+    if cpus is None:
+        cpus = list(range(os.cpu_count()))
+    for filename in CPUSET_FILES:
+        cpuset = read_cpu_list(filename)
+        if cpuset:
+            return sorted(set(cpus) & set(cpuset))
+    return cpus
+
+
+def get_numa_nodes():
+    """
+    {cpu: NUMA node}. Empty if the kernel doesn't show NUMA nodes.
+    """
+    nodes = {}
+    for path in glob.glob(os.path.join(SYSFS, "node", "node*", "cpulist")):
+        node = int(re.search(r"node(\d+)", path).group(1))
+        for cpu in read_cpu_list(path) or []:
+            nodes[cpu] = node
+    return nodes
+
+
+def get_cores(cpus=None):
+    """
+    Physical cores of the given CPUs (default: the CPUs this process may
+    run on), ordered by NUMA node, socket and core. Each core is a dict
+    with its "node", "socket" and "cpus" (the first logical CPU, then its
+    hyperthread siblings).
+    """
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+    numa_nodes = get_numa_nodes()
+    cores = {}
+    for cpu in sorted(cpus):
+        topology = os.path.join(SYSFS, "cpu", "cpu{}".format(cpu), "topology")
+        socket = read_int(os.path.join(topology, "physical_package_id"), 0)
+        core = read_int(os.path.join(topology, "core_id"), cpu)
+        node = numa_nodes.get(cpu, socket)
+        cores.setdefault((node, socket, core), []).append(cpu)
+    return [{"node": node, "socket": socket, "cpus": cores[node, socket, core]}
+            for node, socket, core in sorted(cores)]
+
+
+def get_topology(cpus=None):
+    """
+    Summary of the cores returned by get_cores()
+    """
+    cores = get_cores(cpus)
+    sockets = len(set(core["socket"] for core in cores))
+    logical_cores = sum(len(core["cpus"]) for core in cores)
+    return {"sockets": sockets,
+            "numa_nodes": len(set(core["node"] for core in cores)),
+            "physical_cores": len(cores),
+            "cores_per_socket": len(cores) // max(sockets, 1),
+            "logical_cores": logical_cores,
+            "threads_per_core": logical_cores // max(len(cores), 1)}
+
+
+def get_local_rank():
+    """
+    (rank on this node, ranks on this node) from the MPI environment,
+    (0, 1) outside of MPI
+    """
+    rank = next((int(os.environ[v]) for v in LOCAL_RANK_VARS
+                 if v in os.environ), 0)
+    size = next((int(os.environ[v]) for v in LOCAL_SIZE_VARS
+                 if v in os.environ), 1)
+    return rank, size
+
+
+def split_cores(cores, processes):
+    """
+    Split the cores into equal contiguous groups, one per process. With
+    as many or more processes than NUMA nodes every NUMA node is split
+    on its own, so no process spans two NUMA nodes. Cores that don't
+    divide evenly are left free for the system and the MPI threads.
+    With more processes than cores the processes share the cores
+    round-robin, one core each.
+    """
+    if processes > len(cores):
+        sys.stderr.write("WARNING: {} processes but only {} physical cores, "
+                         "the processes share cores\n".format(processes,
+                                                              len(cores)))
+        return [[cores[i % len(cores)]] for i in range(processes)]
+
+    groups = []
+    for core in cores:
+        if groups and groups[-1][0]["node"] == core["node"]:
+            groups[-1].append(core)
+        else:
+            groups.append([core])
+
+    per_group = processes // len(groups)
+    if processes % len(groups) == 0 and \
+            min(len(group) for group in groups) >= per_group:
+        size = min(len(group) for group in groups) // per_group
+        return [group[i*size:(i+1)*size]
+                for group in groups for i in range(per_group)]
+
+    size = len(cores) // processes
+    return [cores[i*size:(i+1)*size] for i in range(processes)]
+
+
+def get_shared_index(cores, node_cores, local_rank, processes_per_node):
+    """
+    (index, count) of this rank among the ranks that mpirun bound to
+    the same cores (e.g. --bind-to socket with several ranks per
+    socket). Assumes every rank got an equal share of the node. The
+    index follows from the mapping: ranks dealt out round-robin
+    (--map-by socket) or in blocks (--map-by core).
+    """
+    sharers = int(round(processes_per_node * len(cores) /
+                        float(len(node_cores))))
+    if sharers <= 1:
+        return 0, 1
+    sets = max(processes_per_node // sharers, 1)
+    first = [core["cpus"] for core in node_cores].index(cores[0]["cpus"])
+    position = first // len(cores)   # Which socket or NUMA node
+    if local_rank % sets == position:
+        return (local_rank // sets) % sharers, sharers
+    if local_rank // sharers != position:
+        sys.stderr.write("WARNING: can't tell the mapping of rank {}, the "
+                         "thread pools of the ranks bound to CPUs {} may "
+                         "overlap\n".format(local_rank, format_cpu_list(
+                             cpu for core in cores for cpu in core["cpus"])))
+    return local_rank % sharers, sharers
+
+
+def plan_threads(processes_per_node=None, use_smt=False, local_rank=None):
+    """
+    Cores, intra-op and inter-op threads of one process on this node.
+    processes_per_node and local_rank default to the MPI ranks on the node.
+
+    Returns a dict with "cpus" (the OpenMP proclist: one CPU per core,
+    then the hyperthread siblings), "affinity" (all of the CPUs of the
+    cores), "intra_threads" and "inter_threads".
+    """
+    mpi_rank, mpi_size = get_local_rank()
+    if processes_per_node is None:
+        processes_per_node = mpi_size
+    if local_rank is None:
+        local_rank = mpi_rank
+
+    cpus = sorted(os.sched_getaffinity(0))
+    cores = get_cores(cpus)
+    if processes_per_node > 1 and cpus == get_node_cpus():
+        cores = split_cores(cores, processes_per_node)[
+            local_rank % processes_per_node]
+    elif processes_per_node > 1:
+        # mpirun already bound the rank. The threads stay within its
+        # CPUs, split with the other ranks bound to the same CPUs.
+        index, sharers = get_shared_index(cores, get_cores(get_node_cpus()),
+                                          local_rank, processes_per_node)
+        cores = split_cores(cores, sharers)[index]
+
+    primary = [core["cpus"][0] for core in cores]
+    siblings = [cpu for core in cores for cpu in core["cpus"][1:]]
+    return {"local_rank": local_rank,
+            "processes_per_node": processes_per_node,
+            "cpus": primary + siblings,
+            "affinity": sorted(primary + siblings),
+            "intra_threads": len(primary + siblings) if use_smt
+            else len(primary),
+            "inter_threads": len(set(core["socket"] for core in cores))}
+
+
+def apply_plan(processes_per_node=None, use_smt=False):
+    """
+    Plan the threads of this process and bind it to its cores.
+    Call it before TensorFlow (or any OpenMP code) starts its threads.
+    """
+    plan = plan_threads(processes_per_node, use_smt)
+    os.sched_setaffinity(0, plan["affinity"])
+    print("Thread plan: process {} of {} on CPUs {} ({} intra-op, "
+          "{} inter-op threads)".format(
+              plan["local_rank"], plan["processes_per_node"],
+              format_cpu_list(plan["affinity"]), plan["intra_threads"],
+              plan["inter_threads"]))
+    return plan
+
+
+def thread_env(plan, intra_threads=None):
+    """
+    OpenMP environment for the plan. Each OpenMP thread is pinned to its
+    own core (then to the siblings if there are more threads than cores),
+    unless KMP_AFFINITY is already set (e.g. by a sweep spec or the
+    autotune settings).
+    """
+    if intra_threads is None:
+        intra_threads = plan["intra_threads"]
+    env = {"OMP_NUM_THREADS": str(intra_threads)}
+    if not os.environ.get("KMP_AFFINITY"):
+        env["KMP_AFFINITY"] = "granularity=fine,proclist=[{}],explicit" \
+            .format(",".join(str(cpu) for cpu in plan["cpus"]))
+    return env
+
+
+def worker_env(settings, intra_threads=None, plan=None):
+    """
+    Environment of a worker process for the "optimized" settings (the
+    OpenMP threads of thread_env and KMP_BLOCKTIME=1) or the
+    "unoptimized" OpenMP defaults. The OpenMP settings of this process
+    are not passed on, except for a KMP_AFFINITY kept by thread_env.
+    """
+    env = {name: value for name, value in os.environ.items()
+           if name not in OPENMP_VARS}
+    if settings == "optimized":
+        if plan is None:
+            plan = plan_threads()
+        env.update(thread_env(plan, intra_threads))
+        if os.environ.get("KMP_AFFINITY"):
+            env["KMP_AFFINITY"] = os.environ["KMP_AFFINITY"]
+        env["KMP_BLOCKTIME"] = "1"
+    env["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
+    return env
+
+
+def setup_threads(args, intra="intraop_threads", inter="interop_threads",
+                  blocktime="blocktime", default_blocktime=0, model=None,
+                  **shape):
+    """
+    Bind this process to its cores and set up OpenMP for its threads.
+    Call it before TensorFlow (or any OpenMP code) starts its threads.
+
+    args has processes_per_node and use_smt (see add_arguments) and the
+    thread settings named by intra, inter and blocktime, which can be
+    None. Those are filled in from the autotune settings of the model
+    and shape if a model is given (see autotune.py), then from the plan
+    and default_blocktime. Pass inter=None to skip the inter-op threads
+    and blocktime=None to leave KMP_BLOCKTIME alone. Returns the plan.
+    """
+    plan = apply_plan(args.processes_per_node, args.use_smt)
+    tuned = {}
+    if model is not None:
+        tuned = autotune.load_settings(
+            args.tuned_settings, model,
+            processes_per_node=plan["processes_per_node"], **shape)
+
+    if getattr(args, intra) is None:
+        setattr(args, intra, tuned.get("intra_threads", plan["intra_threads"]))
+    if inter is not None and getattr(args, inter) is None:
+        setattr(args, inter, tuned.get("inter_threads", plan["inter_threads"]))
+    if blocktime is not None:
+        if getattr(args, blocktime) is None:
+            setattr(args, blocktime, tuned.get("blocktime", default_blocktime))
+        os.environ["KMP_BLOCKTIME"] = str(getattr(args, blocktime))
+    if tuned.get("affinity"):
+        os.environ.setdefault("KMP_AFFINITY", tuned["affinity"])
+
+    os.environ.update(thread_env(plan, getattr(args, intra)))
+    return plan
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Print the CPU topology and the thread plan",
+        add_help=True)
+    add_arguments(parser)
+    parser.add_argument("--shell",
+                        action="store_true",
+                        default=False,
+                        help="Print shell variable assignments")
+    args = parser.parse_args()
+
+    topology = get_topology()
+    processes = args.processes_per_node or get_local_rank()[1]
+    plans = [plan_threads(processes, args.use_smt, rank)
+             for rank in range(processes)]
+
+    if args.shell:
+        topology.update({"intra_threads": plans[0]["intra_threads"],
+                         "inter_threads": plans[0]["inter_threads"]})
+        for name in sorted(topology):
+            print("{}={}".format(name, topology[name]))
+    else:
+        print("{sockets} socket(s), {numa_nodes} NUMA node(s), "
+              "{physical_cores} physical cores ({cores_per_socket} per "
+              "socket), {logical_cores} logical CPUs".format(**topology))
+        for plan in plans:
+            print("process {}: CPUs {} intra_threads={} inter_threads={} "
+                  "KMP_AFFINITY={}".format(
+                      plan["local_rank"], format_cpu_list(plan["affinity"]),
+                      plan["intra_threads"], plan["inter_threads"],
+                      thread_env(plan)["KMP_AFFINITY"]))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Run each configuration of a benchmark in its own process.
+
+The OpenMP thread pool is sized when a process starts, so a benchmark
+that compares thread settings runs the script again for every setting,
+with a hidden worker argument (e.g. --worker_threads) added to its own
+command line. Options given again after the command line override it.
+
+    rows = workers.run_workers(
+        args.python, args.output, COLUMNS,
+        [("{} thread(s)".format(t), ["--worker_threads", str(t)], None)
+         for t in args.threads])
+
+Each worker appends its rows to the CSV file, and run_workers returns
+all of them for the summary.
+"""
+
+import csv
+import subprocess
+import sys
+
+
+def run_worker(python, worker_args, env=None, log=None, timeout=None):
+    """
+    Run this script again with worker_args after its command line.
+    Returns the exit code, or None if it took more than timeout seconds.
+    """
+    cmd = [python] + sys.argv + worker_args
+    try:
+        return subprocess.call(cmd, env=env, stdout=log,
+                               stderr=None if log is None
+                               else subprocess.STDOUT,
+                               timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+def run_workers(python, output, columns, workers):
+    """
+    Start output as a CSV file with the columns, then run the workers,
+    a list of (description, worker arguments, environment or None),
+    one at a time. Returns the rows the workers appended.
+    """
+    with open(output, "w") as f:
+        csv.DictWriter(f, fieldnames=columns).writeheader()
+
+    for name, worker_args, env in workers:
+        print("Running {}".format(name))
+        if run_worker(python, worker_args, env=env) != 0:
+            print("Worker with {} failed".format(name))
+
+    with open(output) as f:
+        return list(csv.DictReader(f))
@@ -22,24 +22,48 @@
 
 Runs simple convolutional model to train MNIST
 
+The training set is read from a local mnist.npz (the file that
+keras.datasets.mnist.load_data() saves in ~/.keras/datasets) through a
+tf.data pipeline, with each Horovod worker reading its own shard.
+--synthetic trains on one random batch kept in memory instead, to
+separate the input cost from the computation and allreduce cost.
+
 """
 import tensorflow as tf
 from tensorflow import layers
-from tensorflow.examples.tutorials.mnist import input_data
 
+import numpy as np
 import os
+import sys
+import time
 from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "benchmark_runner"))
+import allocator
+import scaling_efficiency
+import topology
+
 
 FLAGS = tf.app.flags.FLAGS
-tf.app.flags.DEFINE_integer("num_inter_threads", 2,
-							"# inter op threads")
-tf.app.flags.DEFINE_integer("num_threads", os.cpu_count(),
-							"# intra op threads")
+tf.app.flags.DEFINE_integer("num_inter_threads", None,
+							"# inter op threads (default: one per socket)")
+tf.app.flags.DEFINE_integer("num_threads", None,
+							"# intra op threads (default: one per physical core)")
+tf.app.flags.DEFINE_integer("processes_per_node", None,
+							"Workers sharing this node's cores "
+							"(default: MPI ranks on the node)")
+tf.app.flags.DEFINE_boolean("use_smt", False,
+							"Also run intra op threads on the hyperthread siblings")
 
 tf.app.flags.DEFINE_integer("total_steps", 4000,
 							"Number of training steps")
 
+tf.app.flags.DEFINE_integer("max_steps", 0,
+							"Training steps per worker. "
+							"0 = total_steps split between the workers")
+tf.app.flags.DEFINE_integer("warmup_steps", 5,
+							"Steps left out of the throughput")
+
 tf.app.flags.DEFINE_integer("log_steps", 20,
 							"Number of steps between logs")
 tf.app.flags.DEFINE_integer("batch_size", 128,
@@ -52,10 +76,31 @@ tf.app.flags.DEFINE_string("data_path",
                             "/home/nfsshare/unet",
                             "Data directory")
 
+tf.app.flags.DEFINE_string("data_file", "mnist.npz",
+							"MNIST .npz file (x_train, y_train) in data_path, "
+							"as saved by keras.datasets.mnist")
+tf.app.flags.DEFINE_boolean("synthetic", False,
+							"Train on one random batch kept in memory "
+							"instead of reading data_file")
+tf.app.flags.DEFINE_integer("shuffle_buffer", 10000,
+							"Number of images in the shuffle buffer")
+tf.app.flags.DEFINE_integer("prefetch_batches", 2,
+							"Number of batches prepared ahead of the step")
+
 tf.app.flags.DEFINE_boolean("no_horovod", False,
 							"Don't use Horovod. Single node training only.")
 tf.app.flags.DEFINE_float("learningrate", 0.001,
 							"Learning rate")
+tf.app.flags.DEFINE_enum("allocator", None, allocator.ALLOCATORS,
+							"Memory allocator (default: leave LD_PRELOAD as it is)")
+
+# Restarts the worker with the allocator preloaded (before MPI starts)
+allocator.use_allocator(FLAGS.allocator)
+
+# Each worker gets its own cores so the thread pools of the workers
+# on a node don't overlap
+topology.setup_threads(FLAGS, intra="num_threads", inter="num_inter_threads",
+					   blocktime=None)
 
 config = tf.ConfigProto(intra_op_parallelism_threads=FLAGS.num_threads,
 						inter_op_parallelism_threads=FLAGS.num_inter_threads)
@@ -65,6 +110,53 @@ tf.logging.set_verbosity(tf.logging.INFO)
 if not FLAGS.no_horovod:
 	import horovod.tensorflow as hvd
 
+def get_dataset_input(num_workers, rank):
+	"""
+	Batches of this worker's shard of the training set from a
+	shuffled, repeated and prefetched tf.data pipeline
+	"""
+	filename = os.path.join(FLAGS.data_path, FLAGS.data_file)
+	with np.load(filename) as data:
+		# Shard before building the dataset so that each worker only
+		# keeps its own part of the images in the graph
+		x_train = data["x_train"][rank::num_workers].reshape(-1, 784)
+		y_train = data["y_train"][rank::num_workers]
+	tf.logging.info("Worker {} reads {} images from {}".format(
+		rank, len(x_train), filename))
+
+	def preprocess(image, label):
+		return tf.cast(image, tf.float32) / 255.0, tf.cast(label, tf.float32)
+
+	dataset = tf.data.Dataset.from_tensor_slices((x_train, y_train))
+	dataset = dataset.shuffle(FLAGS.shuffle_buffer).repeat()
+	dataset = dataset.map(preprocess,
+						  num_parallel_calls=FLAGS.num_inter_threads)
+	dataset = dataset.batch(FLAGS.batch_size)
+	dataset = dataset.prefetch(FLAGS.prefetch_batches)
+
+	image, label = dataset.make_one_shot_iterator().get_next()
+	image.set_shape([None, 784])
+	label.set_shape([None])
+	return image, label
+
+
+def get_synthetic_input():
+	"""
+	One random batch stored in local variables, so the steps
+	measure the computation and allreduce without any input cost
+	"""
+	image = tf.Variable(tf.random_uniform([FLAGS.batch_size, 784]),
+						trainable=False, name="synthetic_image",
+						collections=[tf.GraphKeys.LOCAL_VARIABLES])
+	label = tf.Variable(tf.cast(tf.random_uniform([FLAGS.batch_size],
+												  maxval=10,
+												  dtype=tf.int32),
+								tf.float32),
+						trainable=False, name="synthetic_label",
+						collections=[tf.GraphKeys.LOCAL_VARIABLES])
+	return image.read_value(), label.read_value()
+
+
 def get_model(feature, label):
 
 	# Reshape the input vector into a 28x28 image
@@ -150,13 +242,14 @@ def main(_):
 		# Initialize Horovod.
 		hvd.init()
 
-	# Download MNIST dataset.
-	mnist = input_data.read_data_sets(FLAGS.data_path, one_hot=False)
-
 	# Input tensors
 	with tf.name_scope("input"):
-		image = tf.placeholder(tf.float32, [None, 784], name="image")
-		label = tf.placeholder(tf.float32, [None], name="label")
+		if FLAGS.synthetic:
+			image, label = get_synthetic_input()
+		elif FLAGS.no_horovod:
+			image, label = get_dataset_input(1, 0)
+		else:
+			image, label = get_dataset_input(hvd.size(), hvd.rank())
 
 	# Define model
 	predict, loss, accuracy = get_model(image, label)
@@ -168,13 +261,15 @@ def main(_):
 		opt = tf.train.RMSPropOptimizer(FLAGS.learningrate)
 
 	# Wrap optimizer with Horovod Distributed Optimizer.
-	if FLAGS.no_horovod is None:
+	if not FLAGS.no_horovod:
 		opt = hvd.DistributedOptimizer(opt)
 
 	global_step = tf.train.get_or_create_global_step()
 	train_op = opt.minimize(loss, global_step=global_step)
 
-	if not FLAGS.no_horovod:
+	if FLAGS.max_steps > 0:
+		last_step = FLAGS.max_steps
+	elif not FLAGS.no_horovod:
 		last_step = FLAGS.total_steps // hvd.size()
 	else:
 		last_step = FLAGS.total_steps
@@ -234,6 +329,7 @@ def main(_):
 	# The MonitoredTrainingSession takes care of session initialization,
 	# restoring from a checkpoint, saving to a checkpoint,
 	# and closing when done or an error occurs.
+	step_times = []
 	with tf.train.MonitoredTrainingSession(checkpoint_dir=checkpoint_dir,
 										   hooks=hooks,
 										   save_summaries_steps=FLAGS.log_steps,
@@ -242,9 +338,15 @@ def main(_):
 		while not mon_sess.should_stop():
 
 			# Run a training step synchronously.
-			image_, label_ = mnist.train.next_batch(FLAGS.batch_size)
-			mon_sess.run(train_op, feed_dict={image: image_, label: label_})
-
+			step_start = time.time()
+			mon_sess.run(train_op)
+			step_times.append(time.time() - step_start)
+
+	scaling_efficiency.print_result(
+		step_times, FLAGS.batch_size, FLAGS.warmup_steps,
+		num_workers=1 if FLAGS.no_horovod else hvd.size(),
+		rank=0 if FLAGS.no_horovod else hvd.rank(),
+		input="synthetic" if FLAGS.synthetic else "tf.data")
 
 	stop_time = datetime.now()
 	tf.logging.info("Stopping at: {}".format(stop_time))
@@ -16,14 +16,16 @@ node_ips=${1:-hosts.txt}      # Default is the hosts.txt file
 export num_workers_per_node=${2:-1}  # Default 1 workers per node
 export num_inter_threads=${3:-2} # Default to 2 inter_op threads
 
-export physical_cores=`lscpu | grep "Core(s) per socket" | cut -d':' -f2 | sed "s/ //g"` # Total number of physical cores per socket
+# Sets sockets, cores_per_socket, physical_cores, ... for this node
+eval `python ../../benchmark_runner/topology.py --shell`
+export physical_cores=$cores_per_socket # Total number of physical cores per socket
 export num_nodes=`awk -F, '{print NF}' ${node_ips} | head -1 ` # Hosts.txt should contain IP addresses separated by commas
-export num_sockets=`lscpu | grep "Socket(s)" | cut -d':' -f2 | sed "s/ //g"`   # Number of sockets per node
+export num_sockets=$sockets   # Number of sockets per node
 export logical_cores=`nproc`
 
 export num_processes=$(( $num_nodes * $num_workers_per_node )) # Total number of workers across all nodes
-export ppr=$(( $num_workers_per_node / $num_sockets ))
-export pe=$(( $physical_cores / $ppr ))
+export ppr=$(( ($num_workers_per_node + $num_sockets - 1) / $num_sockets )) # Workers per socket
+export pe=$(( $physical_cores / $ppr )) # Physical cores per worker
 
 echo "Running $num_workers_per_node worker(s)/node on $num_nodes nodes..."
 
@@ -38,7 +40,7 @@ mpirun  --mca btl_tcp_if_include eth0 \
 -np $num_processes \
 -H `cat $node_ips` \
 --map-by socket \
--cpus-per-proc $physical_cores \
+-cpus-per-proc $pe \
 --report-bindings \
---oversubscribe bash exec_multiworker_mnist.sh $ppr $num_inter_threads $data_path $output_path
-#mpirun -np $num_processes -H `cat $node_ips` --map-by socket -cpus-per-proc $physical_cores --report-bindings --oversubscribe bash exec_multiworker_mnist.sh $ppr $num_inter_threads $data_path $output_path
+--oversubscribe bash exec_multiworker_mnist.sh $num_inter_threads $data_path $output_path
+#mpirun -np $num_processes -H `cat $node_ips` --map-by socket -cpus-per-proc $pe --report-bindings --oversubscribe bash exec_multiworker_mnist.sh $num_inter_threads $data_path $output_path
@@ -1,28 +1,17 @@
 #!/bin/bash
 
+# Runs the CNN benchmarks with the default OpenMP and TensorFlow settings.
+# The networks are built locally from keras.applications, so no
+# network access is needed. See benchmark_keras_cnn.py for the options.
+
 sudo sh -c 'echo 3 > /proc/sys/vm/drop_caches'
 
 set -x
 
-git clone https://github.com/tensorflow/benchmarks.git
-   
-cd benchmarks/scripts/tf_cnn_benchmarks
-
-date > start_benchmark.txt
-
-for network in googlenet inception3 resnet50 resnet152 vgg16 ; do
-    for bz in 1 32 64 96 128; do
-        echo -e "\n\n #### Starting $network and BZ=$bz ####\n\n"
-        time python tf_cnn_benchmarks.py --forward_only \
-        --data_format NHWC --model $network --batch_size $bz \
-        --optimizer rmsprop --num_batches 100 2>&1 | \
-        tee net_${network}_bz_${bz}.log
-       echo -e "#### Finished $network and BZ=$bz ####"
- 
-  done
-done
-
-date > stop_benchmark.txt
+python benchmark_keras_cnn.py --settings unoptimized \
+    --modes inference --data_formats NCHW NHWC \
+    --networks inception3 resnet50 resnet152 vgg16 \
+    --bz 1 32 64 96 128 --num_batches 100 "$@"
 
 echo "No Intel optimizations"
-bash ../../../print_bench.sh
+bash print_bench.sh
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+
+Offline CNN throughput benchmark.
+
+Builds the keras.applications networks locally with random weights
+(nothing is downloaded) and times training or inference steps on
+synthetic images. Every combination of network, mode, data format,
+batch size and thread settings runs in its own process:
+
+	optimized   - one OpenMP thread pinned to each physical core (the
+				  KMP_AFFINITY proclist of topology.py), KMP_BLOCKTIME=1,
+				  OMP_NUM_THREADS and intra-op threads set to the cores
+				  (--bz1_cores for batch size 1) and 2 inter-op threads
+				  (1 for vgg16)
+	unoptimized - the OpenMP and TensorFlow defaults
+
+	python benchmark_keras_cnn.py
+	python benchmark_keras_cnn.py --networks resnet50 --modes train \
+		--data_formats NHWC NCHW --bz 1 32 --settings optimized
+	python benchmark_keras_cnn.py --report
+
+Results are merged into --results_dir/results.json (one entry per
+configuration) and results.csv, so runs with different settings can be
+compared later with --report. googlenet (Inception v1) is not part of
+keras.applications and is not available.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_runner"))
+import allocator
+import topology
+import workers
+
+import numpy as np
+
+# Network name -> (keras.applications class, image size)
+NETWORKS = {"inception3": ("InceptionV3", 299),
+			"resnet50": ("ResNet50", 224),
+			"resnet152": ("ResNet152", 224),
+			"vgg16": ("VGG16", 224),
+			"vgg19": ("VGG19", 224),
+			"mobilenet": ("MobileNet", 224),
+			"densenet121": ("DenseNet121", 224),
+			"xception": ("Xception", 299)}
+
+CONFIG_KEYS = ["network", "mode", "data_format", "bz", "settings"]
+COLUMNS = CONFIG_KEYS + ["status", "intra_threads", "inter_threads",
+						 "images_per_sec", "step_ms_mean", "step_ms_p50",
+						 "step_ms_p99", "num_batches", "keras_version",
+						 "tf_version", "timestamp"]
+
+parser = argparse.ArgumentParser(
+	description="Offline keras.applications CNN throughput benchmark",
+	add_help=True)
+parser.add_argument("--networks",
+					nargs="+",
+					default=["inception3", "resnet50", "resnet152", "vgg16"],
+					choices=sorted(NETWORKS),
+					help="Networks to benchmark")
+parser.add_argument("--modes",
+					nargs="+",
+					default=["inference", "train"],
+					choices=["inference", "train"],
+					help="Forward only or forward, backward and update")
+parser.add_argument("--data_formats",
+					nargs="+",
+					default=["NCHW", "NHWC"],
+					choices=["NCHW", "NHWC"],
+					help="Data formats")
+parser.add_argument("--bz",
+					type = int,
+					nargs="+",
+					default=[1, 32, 64, 96, 128],
+					help="Batch sizes")
+parser.add_argument("--settings",
+					nargs="+",
+					default=["optimized", "unoptimized"],
+					choices=["optimized", "unoptimized"],
+					help="Thread settings")
+parser.add_argument("--num_cores",
+					type = int,
+					default=None,
+					help="Cores used by the optimized settings "
+						 "(default: all of the physical cores)")
+parser.add_argument("--bz1_cores",
+					type = int,
+					default=8,
+					help="Cores used by the optimized settings at batch size 1")
+parser.add_argument("--num_batches",
+					type = int,
+					default=100,
+					help="Timed batches")
+parser.add_argument("--warmup",
+					type = int,
+					default=10,
+					help="Untimed batches before the timed ones")
+parser.add_argument("--num_classes",
+					type = int,
+					default=1000,
+					help="Number of output classes")
+parser.add_argument("--timeout",
+					type = int,
+					default=3600,
+					help="Seconds before a configuration is killed")
+parser.add_argument("--python",
+					default=sys.executable,
+					help="Python interpreter for the workers")
+parser.add_argument("--results_dir",
+					default="keras_cnn_results",
+					help="Directory for the logs and the results")
+parser.add_argument("--report",
+					action="store_true",
+					default=False,
+					help="Only print the saved results")
+# Used by the driver to run one configuration
+parser.add_argument("--worker",
+					action="store_true",
+					default=False,
+					help=argparse.SUPPRESS)
+allocator.add_arguments(parser)
+args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+if args.num_cores is None:
+	args.num_cores = topology.plan_threads()["intra_threads"]
+
+
+def get_name(config):
+	return "{network}_{mode}_{data_format}_bz{bz}_{settings}".format(**config)
+
+
+def get_threads(config):
+	"""
+	Intra-op and inter-op threads of a configuration (0 = TensorFlow default)
+	"""
+	if config["settings"] == "unoptimized":
+		return 0, 0
+	cores = args.num_cores
+	if config["bz"] == 1:
+		cores = min(args.bz1_cores, args.num_cores)
+	inter = 1 if config["network"].startswith("vgg") else 2
+	return cores, inter
+
+
+def get_env(config):
+	env = topology.worker_env(config["settings"], get_threads(config)[0])
+	if config["settings"] == "optimized":
+		env["KMP_SETTINGS"] = "1"  # Show the OpenMP settings in the log
+	return env
+
+
+def run_worker(config):
+	"""
+	Time one configuration and save the result as JSON
+	"""
+	import tensorflow as tf
+	import keras as K
+
+	intra, inter = get_threads(config)
+	sess = tf.Session(config=tf.ConfigProto(
+		intra_op_parallelism_threads=intra,
+		inter_op_parallelism_threads=inter))
+	K.backend.set_session(sess)
+
+	channels_first = config["data_format"] == "NCHW"
+	K.backend.set_image_data_format("channels_first" if channels_first
+									else "channels_last")
+
+	class_name, size = NETWORKS[config["network"]]
+	if not hasattr(K.applications, class_name):
+		raise SystemExit("keras {} has no applications.{}".format(
+			K.__version__, class_name))
+	shape = (3, size, size) if channels_first else (size, size, 3)
+
+	# weights=None builds the network with random weights, no download
+	model = getattr(K.applications, class_name)(weights=None,
+												input_shape=shape,
+												classes=args.num_classes)
+	bz = config["bz"]
+	imgs = np.random.rand(bz, *shape).astype(np.float32)
+	labels = np.eye(args.num_classes, dtype=np.float32)[
+		np.random.randint(args.num_classes, size=bz)]
+
+	if config["mode"] == "train":
+		model.compile(optimizer=K.optimizers.RMSprop(lr=0.001),
+					  loss="categorical_crossentropy")
+		step = lambda: model.train_on_batch(imgs, labels)
+	else:
+		K.backend.set_learning_phase(False)
+		step = lambda: model.predict_on_batch(imgs)
+
+	print("{}: {} {} parameters, intra={} inter={}".format(
+		get_name(config), class_name, model.count_params(), intra, inter))
+
+	for _ in range(args.warmup):
+		step()
+
+	step_times = []
+	for i in range(args.num_batches):
+		start_time = time.time()
+		step()
+		step_times.append(time.time() - start_time)
+		if (i + 1) % 10 == 0:
+			print("{}\timages/sec: {:.1f}".format(
+				i + 1, bz / np.mean(step_times[-10:])))
+
+	step_ms = 1000.0 * np.array(step_times)
+	result = dict(config)
+	result.update({"status": "ok",
+				   "intra_threads": intra,
+				   "inter_threads": inter,
+				   "images_per_sec": bz * len(step_times) / np.sum(step_times),
+				   "step_ms_mean": float(np.mean(step_ms)),
+				   "step_ms_p50": float(np.percentile(step_ms, 50)),
+				   "step_ms_p99": float(np.percentile(step_ms, 99)),
+				   "num_batches": args.num_batches,
+				   "keras_version": K.__version__,
+				   "tf_version": tf.__version__})
+	# Same summary line as tf_cnn_benchmarks
+	print("total images/sec: {:.2f}".format(result["images_per_sec"]))
+
+	with open(os.path.join(args.results_dir,
+						   get_name(config) + ".json"), "w") as f:
+		json.dump(result, f, indent=4)
+
+
+def run_config(config):
+	"""
+	Run one configuration in a fresh process
+	"""
+	name = get_name(config)
+	print("Running {}".format(name), end="", flush=True)
+
+	result_file = os.path.join(args.results_dir, name + ".json")
+	if os.path.isfile(result_file):
+		os.remove(result_file)
+
+	# The options of the configuration override the lists of the
+	# command line
+	worker_args = ["--worker",
+				   "--networks", config["network"],
+				   "--modes", config["mode"],
+				   "--data_formats", config["data_format"],
+				   "--bz", str(config["bz"]),
+				   "--settings", config["settings"],
+				   "--num_cores", str(args.num_cores)]
+
+	with open(os.path.join(args.results_dir, name + ".log"), "w") as log:
+		returncode = workers.run_worker(args.python, worker_args,
+										env=get_env(config), log=log,
+										timeout=args.timeout)
+
+	if returncode is None:
+		result = dict(config, status="timeout")
+	elif returncode != 0 or not os.path.isfile(result_file):
+		result = dict(config, status="failed")
+	else:
+		with open(result_file) as f:
+			result = json.load(f)
+	result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+	if result["status"] == "ok":
+		print(": {:,.2f} images/sec".format(result["images_per_sec"]))
+	else:
+		print(": {} (see {}.log)".format(result["status"],
+										 os.path.join(args.results_dir, name)))
+	return result
+
+
+def load_results(filename):
+	if not os.path.isfile(filename):
+		return {}
+	with open(filename) as f:
+		return {tuple(r[k] for k in CONFIG_KEYS): r for r in json.load(f)}
+
+
+def save_results(results):
+	rows = [results[key] for key in sorted(results)]
+	with open(os.path.join(args.results_dir, "results.json"), "w") as f:
+		json.dump(rows, f, indent=4)
+	with open(os.path.join(args.results_dir, "results.csv"), "w") as f:
+		writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+		writer.writeheader()
+		writer.writerows(rows)
+
+
+def print_report(results):
+	"""
+	images/sec of every configuration with the optimized vs unoptimized speedup
+	"""
+	def speed(key):
+		result = results.get(key)
+		if result is None:
+			return "", None
+		if result["status"] != "ok":
+			return result["status"], None
+		return "{:,.2f}".format(result["images_per_sec"]), \
+			result["images_per_sec"]
+
+	print("\n{:>12} {:>10} {:>6} {:>5} {:>14} {:>14} {:>8}".format(
+		"network", "mode", "format", "bz", "optimized", "unoptimized",
+		"speedup"))
+	configs = sorted(set(key[:4] for key in results))
+	for network, mode, data_format, bz in configs:
+		opt_text, opt = speed((network, mode, data_format, bz, "optimized"))
+		unopt_text, unopt = speed((network, mode, data_format, bz,
+								   "unoptimized"))
+		speedup = "{:.2f}x".format(opt / unopt) if opt and unopt else ""
+		print("{:>12} {:>10} {:>6} {:>5} {:>14} {:>14} {:>8}".format(
+			network, mode, data_format, bz, opt_text, unopt_text, speedup))
+
+
+if not os.path.isdir(args.results_dir):
+	os.makedirs(args.results_dir)
+
+if args.worker:
+	run_worker({"network": args.networks[0], "mode": args.modes[0],
+				"data_format": args.data_formats[0], "bz": args.bz[0],
+				"settings": args.settings[0]})
+	sys.exit(0)
+
+results_file = os.path.join(args.results_dir, "results.json")
+results = load_results(results_file)
+
+if not args.report:
+	for network in args.networks:
+		for mode in args.modes:
+			for data_format in args.data_formats:
+				for bz in args.bz:
+					for settings in args.settings:
+						config = {"network": network, "mode": mode,
+								  "data_format": data_format, "bz": bz,
+								  "settings": settings}
+						result = run_config(config)
+						results[tuple(config[k] for k in CONFIG_KEYS)] = result
+						save_results(results)
+	print("\nSaved the results to {} and {}".format(
+		results_file, os.path.join(args.results_dir, "results.csv")))
+
+if len(results) == 0:
+	print("No results in {}".format(results_file))
+	sys.exit(1)
+
+print_report(results)
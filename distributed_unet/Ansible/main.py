@@ -51,6 +51,10 @@ import numpy as np
 import tensorflow as tf
 import os
 import socket
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "benchmark_runner"))
+import allocator
 
 # Fancy progress bar
 from tqdm import tqdm
@@ -95,6 +99,11 @@ tf.app.flags.DEFINE_integer("LOG_SUMMARY_STEPS", settings.LOG_SUMMARY_STEPS,
 							"How many steps per writing summary log")
 
 tf.app.flags.DEFINE_integer("KMP_BLOCKTIME", settings.BLOCKTIME,"KMP_BLOCKTIME")
+tf.app.flags.DEFINE_enum("allocator", None, allocator.ALLOCATORS,
+						 "Memory allocator (default: leave LD_PRELOAD as it is)")
+
+# Restarts the process with the allocator preloaded
+allocator.use_allocator(FLAGS.allocator)
 
 if (FLAGS.ip in ps_hosts):
 	job_name = "ps"
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Export the 2D U-Net checkpoint written by main.py to ONNX.
+
+The inference graph is rebuilt with model.define_model, the weights
+are restored from the latest checkpoint in --checkpoint_dir and frozen
+into constants, and tf2onnx converts the frozen graph. The result can
+be quantized with 3D_UNet/keras_training_only_version/quantize_onnx_model.py:
+
+    python convert_checkpoint_to_onnx.py \
+        --checkpoint_dir output/no_hvd/20181114-113617
+"""
+
+import os
+import argparse
+
+import tensorflow as tf
+import tensorflow.keras as K
+# pip install tf2onnx
+import tf2onnx
+
+import settings
+from model import define_model
+
+parser = argparse.ArgumentParser(
+    description="Export the 2D U-Net checkpoint to ONNX", add_help=True)
+parser.add_argument("--checkpoint_dir",
+                    required=True,
+                    help="Checkpoint directory of main.py "
+                    "(e.g. output/no_hvd/<date>)")
+parser.add_argument("--output_directory",
+                    default="saved_2dunet_model_onnx",
+                    help="Directory where to save the ONNX model")
+parser.add_argument("--use_upsampling",
+                    action="store_true",
+                    default=settings.USE_UPSAMPLING,
+                    help="The model was trained with --use_upsampling")
+parser.add_argument("--opset",
+                    type=int,
+                    default=13,
+                    help="ONNX opset")
+
+args = parser.parse_args()
+
+checkpoint = tf.train.latest_checkpoint(args.checkpoint_dir)
+if checkpoint is None:
+    raise SystemExit("No checkpoint in {}".format(args.checkpoint_dir))
+
+# Inference graph: no dropout
+K.backend.set_learning_phase(0)
+shape = (1, settings.IMG_HEIGHT, settings.IMG_WIDTH, settings.NUM_IN_CHANNELS)
+model = define_model(shape, shape[:-1] + (settings.NUM_OUT_CHANNELS,), args)
+
+input_name = model["input"].name
+output_name = model["output"].name
+
+# Only the model weights, not the optimizer slots or the global step
+saver = tf.train.Saver(var_list=tf.global_variables())
+with tf.Session() as sess:
+    print("Restoring {}".format(checkpoint))
+    saver.restore(sess, checkpoint)
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        sess, sess.graph.as_graph_def(), [model["output"].op.name])
+
+if not os.path.isdir(args.output_directory):
+    os.makedirs(args.output_directory)
+output_filename = os.path.join(args.output_directory, "onnx_model.onnx")
+
+tf2onnx.convert.from_graph_def(graph_def,
+                               input_names=[input_name],
+                               output_names=[output_name],
+                               opset=args.opset,
+                               output_path=output_filename)
+
+print("Exported {} -> {} to ONNX model {}".format(input_name, output_name,
+                                                   output_filename))
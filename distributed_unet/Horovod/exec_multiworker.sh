@@ -5,12 +5,12 @@ echo "Executing training.."
 source ~/.bashrc
 
 conda activate tf
-export physical_cores=`lscpu | grep "Core(s) per socket" | cut -d':' -f2 | sed "s/ //g"` # Total number of physical cores per socket
-export num_threads=$(( ${1} * $physical_cores )) # Total number of physical cores on this machine
 
 # Get the directory of this script
 BASEDIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 
-python ${BASEDIR}/main.py --num_inter_threads=${2} --num_threads=$num_threads
+# Each rank takes one intra op thread per core that mpirun bound it to
+# (benchmark_runner/topology.py)
+python ${BASEDIR}/main.py --num_inter_threads=${1}
 
 conda deactivate
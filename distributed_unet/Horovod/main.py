@@ -30,22 +30,47 @@ from model import define_model, validate_model
 from data import load_datasets, synth_datasets, get_batch
 
 import os
-import psutil
+import sys
+import time
 from datetime import datetime
 
 import settings
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "benchmark_runner"))
+import allocator
+import scaling_efficiency
+import topology
 
-FLAGS = tf.app.flags.FLAGS
-tf.app.flags.DEFINE_integer("num_inter_threads", 2,
-                            "# inter op threads")
 
-tf.app.flags.DEFINE_integer("num_threads", psutil.cpu_count(logical=True),
-                            "# intra op threads")
+FLAGS = tf.app.flags.FLAGS
+tf.app.flags.DEFINE_integer("num_inter_threads", None,
+                            "# inter op threads (default: one per socket)")
+
+tf.app.flags.DEFINE_integer("num_threads", None,
+                            "# intra op threads (default: one per physical core)")
+tf.app.flags.DEFINE_integer("processes_per_node", None,
+                            "Workers sharing this node's cores "
+                            "(default: MPI ranks on the node)")
+tf.app.flags.DEFINE_boolean("use_smt", False,
+                            "Also run intra op threads on the hyperthread "
+                            "siblings")
+tf.app.flags.DEFINE_integer("blocktime", None,
+                            "KMP_BLOCKTIME (default: tuned, or 0)")
+tf.app.flags.DEFINE_string("tuned_settings", None,
+                           "Autotune cache file (default: the file of this "
+                           "host, \"none\" to ignore it)")
 
 tf.app.flags.DEFINE_integer("epochs", settings.EPOCHS,
                             "Number of epochs to train")
 
+tf.app.flags.DEFINE_integer("max_steps", 0,
+                            "Training steps per worker. "
+                            "0 = epochs of the training set split between the workers")
+
+tf.app.flags.DEFINE_integer("warmup_steps", 5,
+                            "Steps left out of the throughput")
+
 tf.app.flags.DEFINE_integer("log_steps", 5,
                             "Number of steps between logs")
 
@@ -66,10 +91,24 @@ tf.app.flags.DEFINE_float("learningrate", settings.LEARNING_RATE,
                             "Learning rate")
 tf.app.flags.DEFINE_boolean("use_upsampling", settings.USE_UPSAMPLING,
                         "True = Use upsampling; False = Use transposed convolution")
-
-os.environ["KMP_BLOCKTIME"] = "0"
-os.environ["KMP_AFFINITY"] = "granularity=thread,compact,1,0"
-os.environ["OMP_NUM_THREADS"] = str(FLAGS.num_threads)
+tf.app.flags.DEFINE_enum("compression", "none", ["none", "fp16"],
+                         "Horovod gradient compression")
+tf.app.flags.DEFINE_float("fusion_threshold_mb", None,
+                          "Horovod tensor fusion buffer size in MB "
+                          "(Horovod default is 64)")
+tf.app.flags.DEFINE_float("cycle_time_ms", None,
+                          "Horovod cycle time in ms (Horovod default is 5)")
+tf.app.flags.DEFINE_enum("allocator", None, allocator.ALLOCATORS,
+                         "Memory allocator (default: leave LD_PRELOAD as it is)")
+
+# Restarts the worker with the allocator preloaded (before MPI starts)
+allocator.use_allocator(FLAGS.allocator)
+
+# Each worker gets its own cores so the thread pools of the workers
+# on a node don't overlap. Settings found by "run_sweep.py autotune" on
+# this host, if any, come first.
+topology.setup_threads(FLAGS, intra="num_threads", inter="num_inter_threads",
+                       model="horovod_unet", bz=FLAGS.batch_size)
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
 
 config = tf.ConfigProto(intra_op_parallelism_threads=FLAGS.num_threads,
@@ -91,11 +130,18 @@ def main(_):
 
     # Load or generate datasets
     if FLAGS.data_path == 'synthetic':
-	imgs_train, msks_train, imgs_test, msks_test = synth_datasets(FLAGS)
+        imgs_train, msks_train, imgs_test, msks_test = synth_datasets(FLAGS)
     else:
         imgs_train, msks_train, imgs_test, msks_test = load_datasets(FLAGS)
 
     if not FLAGS.no_horovod:
+        # Horovod reads the fusion settings when it is initialized
+        if FLAGS.fusion_threshold_mb is not None:
+            os.environ["HOROVOD_FUSION_THRESHOLD"] = str(
+                int(FLAGS.fusion_threshold_mb * 1024 * 1024))
+        if FLAGS.cycle_time_ms is not None:
+            os.environ["HOROVOD_CYCLE_TIME"] = str(FLAGS.cycle_time_ms)
+
         # Initialize Horovod.
         hvd.init()
 
@@ -117,7 +163,11 @@ def main(_):
     # Wrap optimizer with Horovod Distributed Optimizer.
     if not FLAGS.no_horovod:
         tf.logging.info("HOROVOD: Wrapped optimizer")
-        opt = hvd.DistributedOptimizer(opt)
+        if FLAGS.compression == "fp16":
+            compression = hvd.Compression.fp16
+        else:
+            compression = hvd.Compression.none
+        opt = hvd.DistributedOptimizer(opt, compression=compression)
 
     global_step = tf.train.get_or_create_global_step()
     train_op = opt.minimize(model["loss"], global_step=global_step)
@@ -130,6 +180,8 @@ def main(_):
     else:
         last_step = total_steps
         validation_steps = train_length // FLAGS.batch_size
+    if FLAGS.max_steps > 0:
+        last_step = FLAGS.max_steps
 
     def formatter_log(tensors):
         """
@@ -192,6 +244,7 @@ def main(_):
     current_step = 0
     startidx = 0
     epoch_idx = 0
+    step_times = []
 
     with tf.train.MonitoredTrainingSession(checkpoint_dir=checkpoint_dir,
                                            hooks=hooks,
@@ -214,8 +267,10 @@ def main(_):
             # image_ = imgs_train[startidx:stopidx]
             # mask_  = msks_train[startidx:stopidx]
 
+            step_start = time.time()
             mon_sess.run(train_op, feed_dict={model["input"]: image_,
                                               model["label"]: mask_})
+            step_times.append(time.time() - step_start)
 
             current_step += 1
             # # Get next batch (loop around if at end)
@@ -223,6 +278,11 @@ def main(_):
             # if (startidx > train_length):
             #     startidx = 0
 
+    scaling_efficiency.print_result(
+        step_times, FLAGS.batch_size, FLAGS.warmup_steps,
+        num_workers=1 if FLAGS.no_horovod else hvd.size(),
+        rank=0 if FLAGS.no_horovod else hvd.rank())
+
     stop_time = datetime.now()
     tf.logging.info("Stopping at: {}".format(stop_time))
     tf.logging.info("Elapsed time was: {}".format(stop_time-start_time))
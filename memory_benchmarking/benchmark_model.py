@@ -18,8 +18,14 @@
 import numpy as np
 import os
 import argparse
-import psutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_runner"))
+import allocator
+import topology
+
 import time
+import steady_state
 
 parser = argparse.ArgumentParser(
 	description="Benchmark 3D and 2D Convolution Models",add_help=True)
@@ -64,12 +70,12 @@ parser.add_argument("--epochs",
 					help="Number of epochs")
 parser.add_argument("--intraop_threads",
 					type = int,
-					default=psutil.cpu_count(logical=False),
-					help="Number of intraop threads")
+					default=None,
+					help="Number of intraop threads (default: one per physical core)")
 parser.add_argument("--interop_threads",
 					type = int,
-					default=2,
-					help="Number of interop threads")
+					default=None,
+					help="Number of interop threads (default: one per socket)")
 parser.add_argument("--blocktime",
 					type = int,
 					default=0,
@@ -82,6 +88,10 @@ parser.add_argument("--use_upsampling",
 					action="store_true",
 					default=False,
 					help="Use upsampling instead of transposed convolution")
+parser.add_argument("--channels_first",
+					action="store_true",
+					default=False,
+					help="Use NCDHW (channels_first) instead of NDHWC tensors")
 parser.add_argument("--D2",
 					action="store_true",
 					default=False,
@@ -93,7 +103,8 @@ parser.add_argument("--single_class_output",
 parser.add_argument("--mkl_verbose",
 					action="store_true",
 					default=False,
-					help="Print MKL debug statements.")
+					help="Print MKL debug statements. "
+					"Summarize them with parse_mkldnn_verbose.py")
 parser.add_argument("--trace",
 					action="store_true",
 					default=False,
@@ -102,17 +113,50 @@ parser.add_argument("--inference",
 					action="store_true",
 					default=False,
 					help="Test inference speed. Default=Test training speed")
-
+parser.add_argument("--warmup_steps",
+					type = int,
+					default=3,
+					help="Number of steps recorded as the warmup phase")
+parser.add_argument("--memory_interval",
+					type = float,
+					default=0.1,
+					help="Seconds between memory samples")
+parser.add_argument("--memory_file",
+					default="memory_profile.csv",
+					help="Append the memory samples to this CSV file")
+steady_state.add_arguments(parser)
+topology.add_arguments(parser)
+
+allocator.add_arguments(parser)
 args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+# multi_instance.py pins each instance to its own cores, so the plan
+# stays within them
+topology.setup_threads(args)
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
 if args.mkl_verbose:
 	os.environ["MKL_VERBOSE"] = "1"  # Print out messages from MKL operations
 	os.environ["MKLDNN_VERBOSE"] = "1"  # Print out messages from MKL-DNN operations
-os.environ["OMP_NUM_THREADS"] = str(args.intraop_threads)
-os.environ["KMP_BLOCKTIME"] = str(args.blocktime)
-os.environ["KMP_AFFINITY"] = "granularity=thread,compact,1,0"
 
+from memory_monitor import MemoryMonitor
+
+monitor = MemoryMonitor(interval=args.memory_interval)
+monitor.start()
+if args.D2:
+	tensor_size = "{}x{}".format(args.dim_lengthx, args.dim_lengthy)
+else:
+	tensor_size = "{}x{}x{}".format(args.dim_lengthx, args.dim_lengthy,
+									args.dim_lengthz)
+monitor.save_at_exit(args.memory_file,
+					 {"tensor_size": tensor_size, "bz": args.bz,
+					  "mode": "inference" if args.inference else "train",
+					  "model": ("conv" if args.single_class_output else "unet") +
+							   ("2D" if args.D2 else "3D"),
+					  "data_format": "channels_first" if args.channels_first
+									 else "channels_last"})
+monitor.set_phase("import")
 
 import tensorflow as tf
 from model import *
@@ -153,6 +197,12 @@ else:        # Define shape of the tensors (3D)
 					args.dim_lengthz,
 					args.num_outputs]
 
+set_channels_first(args.channels_first)
+if args.channels_first:
+	# Move the channels next to the batch axis (NCHW or NCDHW)
+	tensor_shape = tensor_shape[:1] + tensor_shape[-1:] + tensor_shape[1:-1]
+	dims = tuple(d+1 for d in dims)
+
 # Optimize CPU threads for TensorFlow
 config = tf.ConfigProto(
 		inter_op_parallelism_threads=args.interop_threads,
@@ -161,6 +211,7 @@ config = tf.ConfigProto(
 sess = tf.Session(config=config)
 K.backend.set_session(sess)
 
+monitor.set_phase("graph_build")
 
 global_step = tf.Variable(0, name="global_step", trainable=False)
 
@@ -219,6 +270,7 @@ else:
 	truths = np.random.rand(*tensor_shape)
 
 # Initialize all variables
+monitor.set_phase("init")
 init_op = tf.global_variables_initializer()
 init_l = tf.local_variables_initializer() # For TensorFlow metrics
 
@@ -248,16 +300,23 @@ else:
 	print("Testing training speed.")
 
 
-start_time = time.time()
+detector = steady_state.SteadyStateDetector.from_args(args)
+
+monitor.set_phase("warmup")
+detector.start()
 for epoch in tqdm(range(args.epochs), desc="Epoch #"):
 
 	for i in tqdm(range(total_steps), desc="Step #"):
 
+		if (epoch*total_steps + i) == args.warmup_steps:
+			monitor.set_phase("steady_state")
+
 		if args.inference:
 			feed_dict = {img: imgs}
 		else:
 			feed_dict = {img: imgs, truth:truths}
 
+		step_start = time.time()
 		if args.inference:
 			if args.trace:
 				history = sess.run([predictions], feed_dict=feed_dict,
@@ -275,12 +334,14 @@ for epoch in tqdm(range(args.epochs), desc="Epoch #"):
 						sess.run([train_op, loss, metric_score, global_step],
 						feed_dict=feed_dict)
 
-stop_time = time.time()
+		if detector.add_step(time.time() - step_start):
+			break
 
-print("\n\nTotal time = {:,.3f} seconds".format(stop_time - start_time))
-print("Total images = {:,}".format(args.epochs*args.num_datapoints))
-print("Speed = {:,.3f} images per second".format( \
-			(args.epochs*args.num_datapoints)/(stop_time - start_time)))
+	if detector.stop_reason is not None:
+		break
+
+monitor.stop()
+detector.print_summary(args.bz)
 
 if args.trace:
 	"""
@@ -299,4 +360,10 @@ if args.trace:
 		"(4) Load the file {}.".format(timeline_filename))
 		f.write(chrome_trace)
 
+	# Layer shapes for the FLOP counts in benchmark_runner/analyze_trace.py
+	model_filename = "./timeline_model.json"
+	with open(model_filename, "w") as f:
+		f.write(K.models.Model(inputs=img, outputs=predictions).to_json())
+	print("Saved Keras model JSON to: {}".format(model_filename))
+
 print("Stopped script on {}".format(datetime.datetime.now()))
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Find the largest tensor size (dim_length) and batch size that fit
+in a RAM budget for training and for inference.
+
+Each probe runs a few steps of benchmark_model.py in its own subprocess
+with a memory cap. A probe that goes over the cap is killed straight
+away, so failed probes are cheap. Memory is assumed to grow with the
+tensor size and the batch size, so the search gallops (1, 2, 4, ...
+candidates) until a probe fails and then bisects.
+
+	python capacity_search.py --budget_gb 64 --bz_dims 64 128 192
+
+The cap is either:
+	rss - a watchdog kills the probe when the RSS of the process tree
+		  goes over the budget (default, behaves like a cgroup limit)
+	as  - RLIMIT_AS on the address space. TensorFlow reserves far more
+		  virtual memory than it touches, so this is much stricter.
+
+Prints a capacity table and saves every probe to --output (CSV).
+"""
+
+import argparse
+import csv
+import os
+import re
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import psutil
+
+parser = argparse.ArgumentParser(
+	description="Search for the largest feasible tensor and batch size",
+	add_help=True)
+parser.add_argument("--budget_gb",
+					type = float,
+					required=True,
+					help="RAM budget in GB")
+parser.add_argument("--limit",
+					default="rss",
+					choices=["rss", "as"],
+					help="How the budget is enforced")
+parser.add_argument("--modes",
+					nargs="+",
+					default=["train", "inference"],
+					choices=["train", "inference"],
+					help="Modes to search")
+parser.add_argument("--min_dim",
+					type = int,
+					default=16,
+					help="Smallest dim_length to try")
+parser.add_argument("--max_dim",
+					type = int,
+					default=600,
+					help="Largest dim_length to try")
+parser.add_argument("--dim_step",
+					type = int,
+					default=8,
+					help="dim_length must be a multiple of this "
+						 "(the 3D U-Net pools 3 times)")
+parser.add_argument("--max_bz",
+					type = int,
+					default=512,
+					help="Largest batch size to try")
+parser.add_argument("--bz_dims",
+					type = int,
+					nargs="*",
+					default=[64, 128],
+					help="dim_lengths at which to search for the largest "
+						 "batch size")
+parser.add_argument("--steps",
+					type = int,
+					default=3,
+					help="Steps per probe. Memory peaks in the first steps.")
+parser.add_argument("--timeout",
+					type = int,
+					default=600,
+					help="Seconds before a probe is stopped")
+parser.add_argument("--python",
+					default=sys.executable,
+					help="Python interpreter for the probes")
+parser.add_argument("--output",
+					default="capacity_search.csv",
+					help="Save every probe to this CSV file")
+args, benchmark_args = parser.parse_known_args()
+
+budget_bytes = int(args.budget_gb * 1024**3)
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+
+probes = {}   # (mode, dim_length, bz) -> result
+
+
+def tree_rss(proc):
+	"""
+	RSS in bytes of a process and all of its children
+	"""
+	total = 0
+	for p in [proc] + proc.children(recursive=True):
+		try:
+			total += p.memory_info().rss
+		except (psutil.NoSuchProcess, psutil.AccessDenied):
+			pass
+	return total
+
+
+def limit_address_space():
+	resource.setrlimit(resource.RLIMIT_AS, (budget_bytes, budget_bytes))
+
+
+def probe(mode, dim_length, bz):
+	"""
+	Run a few steps of the benchmark and return True if it
+	finished within the memory budget.
+	"""
+	key = (mode, dim_length, bz)
+	if key in probes:
+		return probes[key]["feasible"]
+
+	cmd = [args.python, "benchmark_model.py",
+		   "--dim_lengthx", str(dim_length),
+		   "--dim_lengthy", str(dim_length),
+		   "--dim_lengthz", str(dim_length),
+		   "--bz", str(bz),
+		   "--num_datapoints", str(bz*args.steps),
+		   "--epochs", "1",
+		   "--memory_file", "capacity_search_memory.csv"]
+	if mode == "inference":
+		cmd.append("--inference")
+	cmd += benchmark_args
+
+	print("Probe {:>9} dim_length={:<4} bz={:<4}".format(mode, dim_length, bz),
+		  end="", flush=True)
+
+	proc = subprocess.Popen(cmd, cwd=benchmark_dir,
+							stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+							universal_newlines=True,
+							preexec_fn=limit_address_space
+							if args.limit == "as" else None)
+	watched = psutil.Process(proc.pid)
+
+	status = None
+	peak = 0
+	start_time = time.time()
+	output = []
+
+	# Read the output in the background so the pipe never fills up
+	reader = threading.Thread(target=lambda: output.extend(proc.stdout))
+	reader.daemon = True
+	reader.start()
+
+	while proc.poll() is None:
+		try:
+			rss = tree_rss(watched)
+		except psutil.NoSuchProcess:
+			break
+		peak = max(peak, rss)
+		if args.limit == "rss" and rss > budget_bytes:
+			status = "over_budget"
+		elif time.time() - start_time > args.timeout:
+			status = "timeout"
+		if status is not None:
+			for p in watched.children(recursive=True) + [watched]:
+				try:
+					p.send_signal(signal.SIGKILL)
+				except psutil.NoSuchProcess:
+					pass
+			break
+		time.sleep(0.05)
+
+	proc.wait()
+	reader.join()
+	log = "".join(output)
+
+	if status is None:
+		if proc.returncode == 0:
+			status = "ok"
+		elif re.search(r"MemoryError|ResourceExhausted|std::bad_alloc|"
+					   r"Cannot allocate memory|OOM", log):
+			status = "out_of_memory"
+		elif proc.returncode == -signal.SIGKILL:
+			status = "killed"   # Usually the OOM killer
+		else:
+			status = "failed"
+
+	feasible = status == "ok"
+	probes[key] = {"mode": mode, "dim_length": dim_length, "bz": bz,
+				   "feasible": feasible, "status": status,
+				   "peak_rss_gb": peak / 1024.0**3,
+				   "seconds": time.time() - start_time}
+	print(" {:<13} peak RSS = {:.2f} GB".format(status, peak / 1024.0**3))
+
+	if status == "failed":
+		print("\n".join(log.splitlines()[-20:]))
+
+	return feasible
+
+
+def largest_feasible(candidates, feasible):
+	"""
+	Largest candidate that passes, assuming that once a candidate fails
+	every larger one fails too. Gallop then bisect so that most probes
+	are small. Returns None if even the smallest candidate fails.
+	"""
+	lo, hi = -1, len(candidates)   # Known feasible / infeasible index
+	step = 1
+	while lo + step < hi:
+		if feasible(candidates[lo + step]):
+			lo += step
+			step *= 2
+		else:
+			hi = lo + step
+			break
+
+	while hi - lo > 1:
+		mid = (lo + hi) // 2
+		if feasible(candidates[mid]):
+			lo = mid
+		else:
+			hi = mid
+
+	return candidates[lo] if lo >= 0 else None
+
+
+first_dim = max(args.dim_step,
+				((args.min_dim + args.dim_step - 1) // args.dim_step) * args.dim_step)
+dims = list(range(first_dim, args.max_dim + 1, args.dim_step))
+batch_sizes = list(range(1, args.max_bz + 1))
+
+capacity = []
+for mode in args.modes:
+
+	max_dim = largest_feasible(dims, lambda d: probe(mode, d, 1))
+	capacity.append((mode, "bz=1", "max dim_length", max_dim))
+
+	for dim_length in args.bz_dims:
+		max_bz = largest_feasible(batch_sizes,
+								  lambda bz: probe(mode, dim_length, bz))
+		capacity.append((mode, "dim_length={}".format(dim_length),
+						 "max bz", max_bz))
+
+with open(args.output, "w") as f:
+	writer = csv.DictWriter(f, fieldnames=["mode", "dim_length", "bz",
+										   "feasible", "status",
+										   "peak_rss_gb", "seconds"])
+	writer.writeheader()
+	for key in sorted(probes):
+		writer.writerow(probes[key])
+print("\nSaved {} probes to {}".format(len(probes), args.output))
+
+print("\nCapacity with a {} GB budget ({} limit)".format(args.budget_gb,
+														 args.limit))
+print("{:>10} {:>16} {:>15} {:>8} {:>12}".format(
+	"mode", "fixed", "searched", "value", "peak_RSS_GB"))
+for mode, fixed, searched, value in capacity:
+	if value is None:
+		peak = "-"
+	elif searched == "max bz":
+		peak = "{:.2f}".format(probes[(mode, int(fixed.split("=")[1]),
+									   value)]["peak_rss_gb"])
+	else:
+		peak = "{:.2f}".format(probes[(mode, value, 1)]["peak_rss_gb"])
+	print("{:>10} {:>16} {:>15} {:>8} {:>12}".format(
+		mode, fixed, searched, "none" if value is None else value, peak))
@@ -18,11 +18,21 @@
 import numpy as np
 import os
 import argparse
-import psutil
 import time
 import datetime
+import sys
 import tensorflow as tf
 from model import *
+from layer_memory import get_model_memory_usage
+
+# The memory monitor is shared with the TensorFlow benchmark in the parent directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from memory_monitor import MemoryMonitor
+import steady_state
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "benchmark_runner"))
+import allocator
+import topology
 
 from tensorflow.python.saved_model import builder as saved_model_builder
 from tensorflow.python.saved_model.signature_def_utils import predict_signature_def
@@ -63,12 +73,12 @@ parser.add_argument("--epochs",
 					help="Number of epochs")
 parser.add_argument("--intraop_threads",
 					type = int,
-					default=psutil.cpu_count(logical=False),
-					help="Number of intraop threads")
+					default=None,
+					help="Number of intraop threads (default: one per physical core)")
 parser.add_argument("--interop_threads",
 					type = int,
-					default=2,
-					help="Number of interop threads")
+					default=None,
+					help="Number of interop threads (default: one per socket)")
 parser.add_argument("--blocktime",
 					type = int,
 					default=0,
@@ -81,6 +91,10 @@ parser.add_argument("--use_upsampling",
 					action="store_true",
 					default=False,
 					help="Use upsampling instead of transposed convolution")
+parser.add_argument("--channels_first",
+					action="store_true",
+					default=False,
+					help="Use NCDHW (channels_first) instead of NDHWC tensors")
 parser.add_argument("--D2",
 					action="store_true",
 					default=False,
@@ -97,17 +111,44 @@ parser.add_argument("--inference",
 					action="store_true",
 					default=False,
 					help="Test inference speed. Default=Test training speed")
+parser.add_argument("--warmup_steps",
+					type = int,
+					default=3,
+					help="Number of steps recorded as the warmup phase")
+parser.add_argument("--memory_interval",
+					type = float,
+					default=0.1,
+					help="Seconds between memory samples")
+parser.add_argument("--memory_file",
+					default="memory_profile.csv",
+					help="Append the memory samples to this CSV file")
+steady_state.add_arguments(parser)
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
 
 args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+
+topology.setup_threads(args)
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
 if args.mkl_verbose:
 	os.environ["MKL_VERBOSE"] = "1"  # Print out messages from MKL operations
 	os.environ["MKLDNN_VERBOSE"] = "1"  # Print out messages from MKL-DNN operations
-os.environ["OMP_NUM_THREADS"] = str(args.intraop_threads)
-os.environ["KMP_BLOCKTIME"] = str(args.blocktime)
-os.environ["KMP_AFFINITY"] = "granularity=thread,compact,1,0"
 
+monitor = MemoryMonitor(interval=args.memory_interval)
+monitor.start()
+if args.D2:
+	tensor_size = "{0}x{0}".format(args.dim_length)
+else:
+	tensor_size = "{0}x{0}x{0}".format(args.dim_length)
+monitor.save_at_exit(args.memory_file,
+					 {"tensor_size": tensor_size, "bz": args.bz,
+					  "mode": "inference" if args.inference else "train",
+					  "model": ("conv" if args.single_class_output else "unet") +
+							   ("2D" if args.D2 else "3D"),
+					  "data_format": "channels_first" if args.channels_first
+									 else "channels_last"})
 
 print("Started script on {}".format(datetime.datetime.now()))
 
@@ -120,24 +161,6 @@ import keras as K
 
 print("Keras API version: {}".format(K.__version__))
 
-def get_model_memory_usage(batch_size, model):
-
-    shapes_mem_count = 0
-    for l in model.layers:
-        single_layer_mem = 1
-        for s in l.output_shape:
-            if s is None:
-                continue
-            single_layer_mem *= s
-        shapes_mem_count += single_layer_mem
-
-    trainable_count = np.sum([K.backend.count_params(p) for p in set(model.trainable_weights)])
-    non_trainable_count = np.sum([K.backend.count_params(p) for p in set(model.non_trainable_weights)])
-
-    total_memory = 4.0*batch_size*(shapes_mem_count + trainable_count + non_trainable_count)
-    gbytes = np.round(total_memory / (1024.0 ** 3), 3)
-    return gbytes
-
 if args.D2:  # Define shape of the tensors (2D)
 	dims = (1,2)
 	tensor_shape = (args.dim_length,
@@ -157,6 +180,11 @@ else:        # Define shape of the tensors (3D)
 					args.dim_length,
 					args.num_outputs)
 
+set_channels_first(args.channels_first)
+if args.channels_first:
+	# Move the channels in front of the image axes (CHW or CDHW)
+	tensor_shape = tensor_shape[-1:] + tensor_shape[:-1]
+
 # Optimize CPU threads for TensorFlow
 config = tf.ConfigProto(
 		inter_op_parallelism_threads=args.interop_threads,
@@ -170,6 +198,7 @@ sess = tf.Session(config=config)
 
 K.backend.set_session(sess)
 
+monitor.set_phase("graph_build")
 if args.single_class_output:
 	if args.D2:    # 2D convnet model
 		pred, model = conv2D(tensor_shape,
@@ -209,14 +238,34 @@ else:
               metrics=[dice_coef, "accuracy"])
 
 
+class PhaseCallback(K.callbacks.Callback):
+	"""
+	Mark the warmup and steady state training steps, time each step
+	and stop the training once the detector says so
+	"""
+	def __init__(self, detector):
+		super(PhaseCallback, self).__init__()
+		self.detector = detector
+		self.step = 0
+		self.step_start = None
+
+	def on_batch_begin(self, batch, logs=None):
+		if self.step == 0:
+			monitor.set_phase("warmup")
+		elif self.step == args.warmup_steps:
+			monitor.set_phase("steady_state")
+		self.step += 1
+		self.step_start = time.time()
+
+	def on_batch_end(self, batch, logs=None):
+		if self.detector.add_step(time.time() - self.step_start):
+			self.model.stop_training = True
+
 def get_imgs():
 
 	# Just feed completely random data in for the benchmark testing
 	sh = [args.bz] + list(tensor_shape)
-	imgs = np.random.rand(*sh)
-
-	while True:
-		yield imgs
+	return np.random.rand(*sh)
 
 def get_batch():
 
@@ -244,17 +293,33 @@ if args.inference:
 else:
 	print("Testing training speed.")
 
-print("Estimated memory for model = {} GB".format(get_model_memory_usage(args.bz, model)))
+print("Estimated memory for model = {} GB".format(
+	get_model_memory_usage(args.bz, model, training=not args.inference)))
+print("Run layer_memory_report.py for the measured memory per layer.")
+
+detector = steady_state.SteadyStateDetector.from_args(args)
 
-start_time = time.time()
+detector.start()
 if args.inference:
-   for _ in range(args.epochs):
-       model.predict_generator(get_imgs(), steps=total_steps, verbose=1)
+	imgs = get_imgs()
+	for step in range(args.epochs*total_steps):
+		if step == 0:
+			monitor.set_phase("warmup")
+		elif step == args.warmup_steps:
+			monitor.set_phase("steady_state")
+		step_start = time.time()
+		model.predict_on_batch(imgs)
+		if detector.add_step(time.time() - step_start):
+			break
 else:
-  	model.fit_generator(get_batch(), steps_per_epoch=total_steps,
-					    epochs=args.epochs, verbose=1)
+	model.fit_generator(get_batch(), steps_per_epoch=total_steps,
+						epochs=args.epochs, verbose=1,
+						callbacks=[PhaseCallback(detector)])
+
+detector.print_summary(args.bz)
 
 if args.inference:
+   monitor.set_phase("save")
    import shutil
    dirName = "./tensorflow_serving_model"
    if args.single_class_output:
@@ -279,9 +344,4 @@ if args.inference:
    builder.save()
    print("Saved TensorFlow Serving model to: {}".format(dirName))
 
-stop_time = time.time()
-
-print("\n\nTotal time = {:,.3f} seconds".format(stop_time - start_time))
-print("Total images = {:,}".format(args.epochs*args.num_datapoints))
-print("Speed = {:,.3f} images per second".format( \
-			(args.epochs*args.num_datapoints)/(stop_time - start_time)))
+monitor.stop()
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Per layer memory of a Keras model: an analytical estimate and the
+allocations measured from the step stats of one traced step.
+Used by layer_memory_report.py and benchmark_model.py.
+"""
+
+import numpy as np
+
+BYTES_PER_FLOAT = 4
+ADAM_SLOTS = 2   # First and second moment for each weight
+
+FORWARD = "forward"
+BACKWARD = "backward"
+OPTIMIZER = "optimizer"
+OTHER = "other"
+
+
+def get_layer_shape_size(layer):
+	"""
+	Number of elements in the output of the layer for one sample
+	"""
+	size = 1
+	for s in layer.output_shape[1:]:
+		if s is not None:
+			size *= s
+	return size
+
+
+def estimate_layer_memory(model, batch_size, training=True,
+						  optimizer_slots=ADAM_SLOTS):
+	"""
+	Estimated bytes per layer.
+	Inference keeps the activations and the weights.
+	Training also keeps the gradient of each activation, the gradient
+	of each weight and the optimizer state (2 slots per weight for Adam).
+	"""
+	estimate = {}
+	for layer in model.layers:
+		activations = BYTES_PER_FLOAT * batch_size * get_layer_shape_size(layer)
+		params = BYTES_PER_FLOAT * layer.count_params()
+		# Only trainable weights have gradients and optimizer state
+		# (not the BatchNormalization moving mean and variance)
+		trainable = BYTES_PER_FLOAT * int(np.sum(
+			[np.prod(w.get_shape().as_list()) for w in layer.trainable_weights]))
+
+		layer_estimate = {"activations": activations, "weights": params,
+						  "activation_gradients": 0, "weight_gradients": 0,
+						  "optimizer_state": 0}
+		if training:
+			layer_estimate["activation_gradients"] = activations
+			layer_estimate["weight_gradients"] = trainable
+			layer_estimate["optimizer_state"] = optimizer_slots * trainable
+
+		layer_estimate["total"] = sum(layer_estimate.values())
+		estimate[layer.name] = layer_estimate
+
+	return estimate
+
+
+def get_model_memory_usage(batch_size, model, training=True,
+						   optimizer_slots=ADAM_SLOTS):
+	"""
+	Total estimated memory of the model in GB
+	"""
+	estimate = estimate_layer_memory(model, batch_size, training,
+									 optimizer_slots)
+	total = sum(layer["total"] for layer in estimate.values())
+	return np.round(total / (1024.0 ** 3), 3)
+
+
+def get_layer_for_node(node_name, layer_names):
+	"""
+	Map a TensorFlow node name to (Keras layer, phase).
+	Keras names the ops of a layer "<layer>/..." and the gradient ops
+	"training/<optimizer>/gradients/<layer>/...". The optimizer
+	updates are not scoped by layer.
+	"""
+	parts = node_name.split("/")
+
+	if "gradients" in parts:
+		for part in parts[parts.index("gradients")+1:]:
+			if part in layer_names:
+				return part, BACKWARD
+		return OTHER, BACKWARD
+
+	if parts[0] == "training":
+		return OPTIMIZER, OPTIMIZER
+
+	for part in parts:
+		if part in layer_names:
+			return part, FORWARD
+
+	return OTHER, FORWARD
+
+
+def get_node_bytes(node):
+	"""
+	Bytes allocated by one op: its output tensors plus temporary
+	workspace (e.g. the MKL-DNN scratch buffers and reorders).
+	"""
+	output_bytes = 0
+	for output in node.output:
+		output_bytes += output.tensor_description.allocation_description.\
+			allocated_bytes
+
+	temp_bytes = 0
+	if node.HasField("memory_stats"):
+		stats = node.memory_stats
+		temp_bytes = getattr(stats, "temp_memory_size", 0) or \
+			getattr(stats, "host_temp_memory_size", 0)
+
+	return output_bytes, temp_bytes
+
+
+def measure_layer_memory(run_metadata, model):
+	"""
+	Aggregate the allocations in the step stats per Keras layer.
+	Returns the per layer bytes and the layer running when the
+	allocator reached its peak bytes in use (None if the TensorFlow
+	build does not record allocator_bytes_in_use).
+	"""
+	layer_names = set(layer.name for layer in model.layers)
+	measured = {}
+	peak_bytes_in_use = 0
+	peak_layer = None
+
+	for dev_stats in run_metadata.step_stats.dev_stats:
+		for node in dev_stats.node_stats:
+
+			layer, phase = get_layer_for_node(node.node_name, layer_names)
+			output_bytes, temp_bytes = get_node_bytes(node)
+
+			if layer not in measured:
+				measured[layer] = {FORWARD: 0, BACKWARD: 0, OPTIMIZER: 0,
+								   "temp": 0, "peak_op_bytes": 0}
+			measured[layer][phase] += output_bytes
+			measured[layer]["temp"] += temp_bytes
+
+			for memory in node.memory:
+				measured[layer]["peak_op_bytes"] = max(
+					measured[layer]["peak_op_bytes"], memory.peak_bytes)
+				in_use = getattr(memory, "allocator_bytes_in_use", 0)
+				if in_use > peak_bytes_in_use:
+					peak_bytes_in_use = in_use
+					peak_layer = (layer, phase)
+
+	for layer in measured.values():
+		layer["total"] = layer[FORWARD] + layer[BACKWARD] + \
+			layer[OPTIMIZER] + layer["temp"]
+
+	return measured, peak_layer, peak_bytes_in_use
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Compare the estimated and the measured memory of each layer of the
+U-Net. One training (or inference) step is traced and the allocations
+in the RunMetadata step stats are aggregated per Keras layer.
+
+	python layer_memory_report.py --dim_length 128 --bz 1
+	python layer_memory_report.py --dim_length 512 --D2 --inference
+"""
+
+import numpy as np
+import os
+import argparse
+import csv
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "benchmark_runner"))
+import topology
+
+parser = argparse.ArgumentParser(
+	description="Estimated vs measured memory per layer", add_help=True)
+parser.add_argument("--dim_length",
+					type = int,
+					default=64,
+					help="Tensor cube length of side")
+parser.add_argument("--num_channels",
+					type = int,
+					default=1,
+					help="Number of channels")
+parser.add_argument("--num_outputs",
+					type = int,
+					default=1,
+					help="Number of outputs")
+parser.add_argument("--bz",
+					type = int,
+					default=1,
+					help="Batch size")
+parser.add_argument("--D2",
+					action="store_true",
+					default=False,
+					help="Use 2D model and images instead of 3D.")
+parser.add_argument("--use_upsampling",
+					action="store_true",
+					default=False,
+					help="Use upsampling instead of transposed convolution")
+parser.add_argument("--inference",
+					action="store_true",
+					default=False,
+					help="Trace an inference step. Default=Trace a training step")
+parser.add_argument("--intraop_threads",
+					type = int,
+					default=None,
+					help="Number of intraop threads (default: one per physical core)")
+parser.add_argument("--interop_threads",
+					type = int,
+					default=None,
+					help="Number of interop threads (default: one per socket)")
+parser.add_argument("--blocktime",
+					type = int,
+					default=0,
+					help="Block time for CPU threads")
+parser.add_argument("--output",
+					default="layer_memory_report.csv",
+					help="Save the per layer report to this CSV file")
+topology.add_arguments(parser)
+
+args = parser.parse_args()
+
+topology.setup_threads(args)
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
+
+import tensorflow as tf
+import keras as K
+from model import *
+from layer_memory import *
+
+MB = 1024.0**2
+
+config = tf.ConfigProto(
+		inter_op_parallelism_threads=args.interop_threads,
+		intra_op_parallelism_threads=args.intraop_threads)
+sess = tf.Session(config=config)
+K.backend.set_session(sess)
+
+if args.D2:
+	tensor_shape = (args.dim_length, args.dim_length, args.num_channels)
+	pred, model = unet2D(tensor_shape, use_upsampling=args.use_upsampling,
+						 n_out=args.num_outputs, return_model=True)
+else:
+	tensor_shape = (args.dim_length, args.dim_length, args.dim_length,
+					args.num_channels)
+	pred, model = unet3D(tensor_shape, use_upsampling=args.use_upsampling,
+						 n_out=args.num_outputs, return_model=True)
+
+# Keras passes these through to Session.run
+run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+run_metadata = tf.RunMetadata()
+model.compile(loss=dice_coef_loss, optimizer="adam",
+			  options=run_options, run_metadata=run_metadata)
+
+imgs = np.random.rand(args.bz, *tensor_shape)
+msks = np.random.rand(args.bz, *model.output_shape[1:])
+
+# The first step also allocates the weights and the optimizer state,
+# so run it twice and keep the trace of the second step.
+for _ in range(2):
+	run_metadata.Clear()
+	if args.inference:
+		model.predict_on_batch(imgs)
+	else:
+		model.train_on_batch(imgs, msks)
+
+estimate = estimate_layer_memory(model, args.bz, training=not args.inference)
+measured, peak_layer, peak_bytes_in_use = measure_layer_memory(run_metadata,
+															   model)
+
+columns = ["layer", "estimated_mb", "est_activations_mb",
+		   "est_weights_mb", "est_gradients_mb", "est_optimizer_mb",
+		   "measured_mb", "forward_mb", "backward_mb", "temp_mb", "ratio"]
+rows = []
+for name in [layer.name for layer in model.layers] + [OPTIMIZER, OTHER]:
+	est = estimate.get(name, {})
+	meas = measured.get(name, {})
+	if not est and not meas:
+		continue
+	row = {"layer": name,
+		   "estimated_mb": est.get("total", 0) / MB,
+		   "est_activations_mb": est.get("activations", 0) / MB,
+		   "est_weights_mb": est.get("weights", 0) / MB,
+		   "est_gradients_mb": (est.get("activation_gradients", 0) +
+								est.get("weight_gradients", 0)) / MB,
+		   "est_optimizer_mb": est.get("optimizer_state", 0) / MB,
+		   "measured_mb": meas.get("total", 0) / MB,
+		   "forward_mb": meas.get(FORWARD, 0) / MB,
+		   "backward_mb": (meas.get(BACKWARD, 0) + meas.get(OPTIMIZER, 0)) / MB,
+		   "temp_mb": meas.get("temp", 0) / MB}
+	row["ratio"] = row["measured_mb"] / row["estimated_mb"] \
+		if row["estimated_mb"] > 0 else float("nan")
+	rows.append(row)
+
+print("\n{:>24} {:>12} {:>12} {:>12} {:>12} {:>10} {:>8}".format(
+	"layer", "estimate_MB", "measured_MB", "forward_MB", "backward_MB",
+	"temp_MB", "ratio"))
+for row in rows:
+	print("{:>24} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f} {:>10.1f} "
+		  "{:>8.2f}".format(row["layer"], row["estimated_mb"],
+							row["measured_mb"], row["forward_mb"],
+							row["backward_mb"], row["temp_mb"], row["ratio"]))
+
+total_estimate = sum(row["estimated_mb"] for row in rows)
+total_measured = sum(row["measured_mb"] for row in rows)
+print("{:>24} {:>12.1f} {:>12.1f}".format("Total", total_estimate,
+										  total_measured))
+
+largest = max(rows, key=lambda row: row["measured_mb"])
+print("\nLargest measured layer: {} ({:.1f} MB)".format(
+	largest["layer"], largest["measured_mb"]))
+if peak_layer is not None:
+	print("Peak allocator memory: {:.1f} MB while running {} ({})".format(
+		peak_bytes_in_use / MB, *peak_layer))
+else:
+	print("This TensorFlow build does not record allocator_bytes_in_use, "
+		  "so the peak layer is the largest measured layer.")
+
+with open(args.output, "w") as f:
+	writer = csv.DictWriter(f, fieldnames=columns)
+	writer.writeheader()
+	writer.writerows(rows)
+print("Saved report to {}".format(args.output))
@@ -1,7 +1,6 @@
 #!/bin/bash
 
-pip install memory_profiler
-rm *.dat 
+rm -f memory_profile.csv
 rm *.log
 
 using_gpu=${1:-True}
@@ -9,29 +8,29 @@ using_gpu=${1:-True}
 for dim_length in 32 56 64 80 128 184 200 256 320 400 480 512 600
 do
 
-   num=1000000  # Run for a long time because timeout will automatically stop the script after a certain number of seconds
-   secs=600  # Number of seconds to record memory
+   num=1000000  # Enough steps that the run is stopped by --duration or once the step time is steady
+   secs=300  # Longest time to run each configuration
+   margin=60  # timeout kills a run that hangs past --duration
 
    # Training batch size 1
    if [ $using_gpu == True ]; then
    	timeout 5 bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz1_train.log
    
-   	timeout $secs mprof run benchmark_model.py --dim_length $dim_length \
+   	timeout $((secs + margin)) bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz1_train.log &
+
+   	timeout $((secs + margin)) python benchmark_model.py --duration $secs --dim_length $dim_length \
   		 --num_datapoints 5 --epochs $num --bz 1 \
-        	 2>&1 | tee train_unet_${dim_length}_bz1.log &
+        	 2>&1 | tee train_unet_${dim_length}_bz1.log
 
-   	timeout $secs bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz1_train.log
+   	kill $! 2>/dev/null
 
    else
 
-	timeout $secs mprof run benchmark_model.py --dim_length $dim_length \
+	timeout $((secs + margin)) python benchmark_model.py --duration $secs --dim_length $dim_length \
                	 --num_datapoints 5 --epochs $num --bz 1 \
                  2>&1 | tee train_unet_${dim_length}_bz1.log
    fi
 
-   pattern="mprofile_*.dat"
-   files=( $pattern )
-   mv ${files[0]}  unet3d_train_len${dim_length}_bz1.dat
  
    bash clear_caches.sh
 
@@ -39,21 +38,20 @@ do
    if [ $using_gpu == True ]; then
    	timeout 5 bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz2_train.log
   
-   	timeout $secs mprof run  benchmark_model.py --dim_length $dim_length \
+   	timeout $((secs + margin)) bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz2_train.log &
+
+   	timeout $((secs + margin)) python benchmark_model.py --duration $secs --dim_length $dim_length \
 		--num_datapoints 5 --epochs $num --bz 2 \
-         	2>&1 | tee train_unet_${dim_length}_bz2.log &
+         	2>&1 | tee train_unet_${dim_length}_bz2.log
 
-   	timeout $secs bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz2_train.log
+   	kill $! 2>/dev/null
 
    else
-	timeout $secs mprof run  benchmark_model.py --dim_length $dim_length \
+	timeout $((secs + margin)) python benchmark_model.py --duration $secs --dim_length $dim_length \
                	--num_datapoints 5 --epochs $num --bz 2 \
                	2>&1 | tee train_unet_${dim_length}_bz2.log
    fi
 
-   pattern="mprofile_*.dat"
-   files=( $pattern )
-   mv ${files[0]} unet3d_train_len${dim_length}_bz2.dat
 
    bash clear_caches.sh
 
@@ -61,24 +59,24 @@ do
    if [ $using_gpu == True ]; then
    	timeout 5 bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz1_inference.log
    
-   	timeout $secs mprof run benchmark_model.py --dim_length $dim_length \
+   	timeout $((secs + margin)) bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz1_inference.log &
+
+   	timeout $((secs + margin)) python benchmark_model.py --duration $secs --dim_length $dim_length \
 		--inference --num_datapoints 5 --epochs $num --bz 1 \
-        	 2>&1 | tee inference_unet_${dim_length}_bz1.log &
+        	 2>&1 | tee inference_unet_${dim_length}_bz1.log
 
-   	timeout $secs bash check_gpu_memory.sh > gpu_memory_${dim_length}_bz1_inference.log
+   	kill $! 2>/dev/null
    else
-	timeout $secs mprof run benchmark_model.py --dim_length $dim_length \
+	timeout $((secs + margin)) python benchmark_model.py --duration $secs --dim_length $dim_length \
                	--inference --num_datapoints 5 --epochs $num --bz 1 \
                  2>&1 | tee inference_unet_${dim_length}_bz1.log
    fi
 
-   pattern="mprofile_*.dat"
-   files=( $pattern )
-   mv ${files[0]} unet3d_inference_len${dim_length}_bz1.dat
 
    bash clear_caches.sh
 
 done
 
 clear
+python ../print_max_memory.py --memory_file memory_profile.csv
 echo "All done. Remember to copy the logs."
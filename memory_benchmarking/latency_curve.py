@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Latency vs throughput of U-Net inference for online serving.
+
+For each thread count a worker process builds the unet2D or unet3D
+model once and times --requests inference calls at every batch size.
+Each request is one batch, so every image in it waits for the whole
+batch. The latency distribution of every configuration is saved, and
+the configurations on the throughput / p99 latency Pareto frontier are
+printed. With --sla_ms the fastest configuration within the SLA is named.
+
+	python latency_curve.py --dim_length 128 --bz 1 2 4 8 --threads 7 14 28 --sla_ms 500
+	python latency_curve.py --D2 --dim_length 512 --bz 1 4 16 --threads 14 28
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_runner"))
+import allocator
+import topology
+import workers
+
+import numpy as np
+
+parser = argparse.ArgumentParser(
+	description="Latency vs batch size and threads for U-Net inference",
+	add_help=True)
+parser.add_argument("--dim_length",
+					type = int,
+					default=64,
+					help="Tensor length of side")
+parser.add_argument("--num_channels",
+					type = int,
+					default=1,
+					help="Number of channels")
+parser.add_argument("--D2",
+					action="store_true",
+					default=False,
+					help="Use the 2D U-Net instead of the 3D U-Net")
+parser.add_argument("--use_upsampling",
+					action="store_true",
+					default=False,
+					help="Use upsampling instead of transposed convolution")
+parser.add_argument("--bz",
+					type = int,
+					nargs="+",
+					default=[1, 2, 4, 8],
+					help="Batch sizes to try")
+parser.add_argument("--threads",
+					type = int,
+					nargs="+",
+					default=None,
+					help="Intra-op thread counts to try (default: one per physical core)")
+parser.add_argument("--requests",
+					type = int,
+					default=100,
+					help="Timed requests per configuration")
+parser.add_argument("--warmup",
+					type = int,
+					default=5,
+					help="Untimed requests before each batch size")
+parser.add_argument("--blocktime",
+					type = int,
+					default=0,
+					help="Block time for CPU threads")
+parser.add_argument("--sla_ms",
+					type = float,
+					default=None,
+					help="p99 latency SLA in ms")
+parser.add_argument("--python",
+					default=sys.executable,
+					help="Python interpreter for the workers")
+parser.add_argument("--output",
+					default="latency_curve.csv",
+					help="Save the latency of every request to this CSV file")
+parser.add_argument("--summary",
+					default="latency_curve_summary.csv",
+					help="Save the statistics of each configuration "
+						 "to this CSV file")
+# Used by the driver to start a worker with one thread count
+parser.add_argument("--worker_threads",
+					type = int,
+					default=None,
+					help=argparse.SUPPRESS)
+topology.add_arguments(parser)
+allocator.add_arguments(parser)
+args = parser.parse_args()
+allocator.use_allocator(args.allocator)
+if args.threads is None:
+	args.threads = [topology.plan_threads(args.processes_per_node,
+										  args.use_smt)["intra_threads"]]
+
+LATENCY_COLUMNS = ["threads", "bz", "request", "latency_ms"]
+
+
+def get_image_shape():
+	shape = [args.dim_length, args.dim_length]
+	if not args.D2:
+		shape.append(args.dim_length)
+	return shape + [args.num_channels]
+
+
+def run_worker(threads):
+	"""
+	Time every batch size with one thread count and append
+	the latency of each request to args.output
+	"""
+	args.worker_threads = threads
+	topology.setup_threads(args, intra="worker_threads", inter=None)
+	os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
+
+	import tensorflow as tf
+	import keras as K
+	from model import unet2D, unet3D
+
+	config = tf.ConfigProto(inter_op_parallelism_threads=1,
+							intra_op_parallelism_threads=threads)
+	sess = tf.Session(config=config)
+	K.backend.set_session(sess)
+	K.backend.set_learning_phase(False)
+
+	# Leave the batch dimension open so one graph serves every batch size
+	img = tf.placeholder(tf.float32, shape=[None] + get_image_shape())
+	if args.D2:
+		predictions = unet2D(img, use_upsampling=args.use_upsampling)
+	else:
+		predictions = unet3D(img, use_upsampling=args.use_upsampling)
+	sess.run(tf.global_variables_initializer())
+
+	with open(args.output, "a") as f:
+		writer = csv.DictWriter(f, fieldnames=LATENCY_COLUMNS)
+		for bz in args.bz:
+			imgs = np.random.rand(bz, *get_image_shape())
+			for _ in range(args.warmup):
+				sess.run(predictions, feed_dict={img: imgs})
+			for request in range(args.requests):
+				start_time = time.time()
+				sess.run(predictions, feed_dict={img: imgs})
+				writer.writerow({"threads": threads, "bz": bz,
+								 "request": request,
+								 "latency_ms": 1000.0*(time.time() - start_time)})
+			f.flush()
+			print("threads={} bz={} done".format(threads, bz))
+
+
+def summarize(latencies):
+	"""
+	Statistics of each (threads, bz) configuration
+	"""
+	rows = []
+	for (threads, bz), values in sorted(latencies.items()):
+		values = np.array(values)
+		rows.append({"threads": threads, "bz": bz,
+					 "p50_ms": float(np.percentile(values, 50)),
+					 "p90_ms": float(np.percentile(values, 90)),
+					 "p99_ms": float(np.percentile(values, 99)),
+					 "mean_ms": float(np.mean(values)),
+					 "images_per_sec": 1000.0*bz / np.mean(values)})
+	return rows
+
+
+def pareto_frontier(rows):
+	"""
+	Configurations that no other configuration beats on both
+	throughput and p99 latency, from fastest to lowest latency
+	"""
+	frontier = []
+	best_p99 = float("inf")
+	for row in sorted(rows, key=lambda r: (-r["images_per_sec"], r["p99_ms"])):
+		if row["p99_ms"] < best_p99:
+			frontier.append(row)
+			best_p99 = row["p99_ms"]
+	return frontier
+
+
+def print_rows(title, rows):
+	print("\n{}".format(title))
+	print("{:>8} {:>5} {:>10} {:>10} {:>10} {:>14}".format(
+		"threads", "bz", "p50_ms", "p90_ms", "p99_ms", "images/sec"))
+	for row in rows:
+		print("{:>8} {:>5} {:>10.1f} {:>10.1f} {:>10.1f} {:>14,.2f}".format(
+			row["threads"], row["bz"], row["p50_ms"], row["p90_ms"],
+			row["p99_ms"], row["images_per_sec"]))
+
+
+if args.worker_threads is not None:
+	run_worker(args.worker_threads)
+	sys.exit(0)
+
+latencies = {}
+for row in workers.run_workers(
+		args.python, args.output, LATENCY_COLUMNS,
+		[("{} thread(s)".format(threads), ["--worker_threads", str(threads)],
+		  None) for threads in args.threads]):
+	key = (int(row["threads"]), int(row["bz"]))
+	latencies.setdefault(key, []).append(float(row["latency_ms"]))
+
+if len(latencies) == 0:
+	print("No requests were timed.")
+	sys.exit(1)
+
+rows = summarize(latencies)
+with open(args.summary, "w") as f:
+	writer = csv.DictWriter(f, fieldnames=["threads", "bz", "p50_ms", "p90_ms",
+										   "p99_ms", "mean_ms",
+										   "images_per_sec"])
+	writer.writeheader()
+	writer.writerows(rows)
+print("\nSaved the latency of every request to {} and the statistics "
+	  "to {}".format(args.output, args.summary))
+
+print_rows("All configurations", rows)
+print_rows("Pareto frontier (throughput vs p99 latency)", pareto_frontier(rows))
+
+if args.sla_ms is not None:
+	within = [row for row in rows if row["p99_ms"] <= args.sla_ms]
+	if len(within) == 0:
+		fastest = min(rows, key=lambda r: r["p99_ms"])
+		print("\nNo configuration meets the {:.1f} ms p99 SLA. The lowest "
+			  "p99 is {:.1f} ms (threads={}, bz={}).".format(
+				  args.sla_ms, fastest["p99_ms"], fastest["threads"],
+				  fastest["bz"]))
+	else:
+		best = max(within, key=lambda r: r["images_per_sec"])
+		print("\nBest within the {:.1f} ms p99 SLA: threads={}, bz={} "
+			  "({:,.2f} images/sec, p99 {:.1f} ms)".format(
+				  args.sla_ms, best["threads"], best["bz"],
+				  best["images_per_sec"], best["p99_ms"]))
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+In-process memory sampling for the benchmark scripts.
+Replaces mprof, concat_dat_files.sh and the old print_max_memory.py.
+
+	monitor = MemoryMonitor(interval=0.1)
+	monitor.start()
+	monitor.set_phase("graph_build")
+	...
+	monitor.set_phase("steady_state")
+	...
+	monitor.stop()
+	monitor.save("memory_profile.csv", {"tensor_size": "64x64x64", "bz": 1})
+
+Each sample is one row of a tidy CSV file. Runs append to the same file,
+so print_max_memory.py can report the peak of every configuration.
+Use save_at_exit() instead of save() so that the samples are still written
+when the run is stopped by timeout (SIGTERM).
+"""
+
+import atexit
+import csv
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+
+import psutil
+
+COLUMNS = ["phase", "elapsed_sec", "rss_mb", "uss_mb",
+		   "minor_faults", "major_faults"]
+
+
+class MemoryMonitor(threading.Thread):
+	"""
+	Background thread that samples the RSS, USS and page faults
+	of this process and tags each sample with the current phase.
+	"""
+
+	def __init__(self, interval=0.1, use_uss=True):
+		super(MemoryMonitor, self).__init__()
+		self.daemon = True   # Never keep the benchmark from exiting
+		self.interval = interval
+		self.use_uss = use_uss
+		self.process = psutil.Process(os.getpid())
+		self.phase = "start"
+		self.samples = []
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.saved = False
+		self.start_time = time.time()
+
+	def sample(self):
+		"""
+		Record one sample. USS needs /proc/<pid>/smaps, which is
+		slower to read, so it can be turned off for short intervals.
+		"""
+		if self.use_uss:
+			try:
+				info = self.process.memory_full_info()
+				uss = info.uss / 1024.0**2
+			except (psutil.AccessDenied, AttributeError):
+				info = self.process.memory_info()
+				uss = None
+		else:
+			info = self.process.memory_info()
+			uss = None
+
+		usage = resource.getrusage(resource.RUSAGE_SELF)
+
+		with self.lock:
+			self.samples.append({"phase": self.phase,
+								 "elapsed_sec": time.time() - self.start_time,
+								 "rss_mb": info.rss / 1024.0**2,
+								 "uss_mb": uss,
+								 "minor_faults": usage.ru_minflt,
+								 "major_faults": usage.ru_majflt})
+
+	def run(self):
+		while not self.stopped.is_set():
+			self.sample()
+			self.stopped.wait(self.interval)
+
+	def set_phase(self, phase):
+		"""
+		Start a new phase (e.g. graph_build, init, warmup, steady_state).
+		A sample is taken at the boundary so short phases are not missed.
+		"""
+		self.sample()
+		with self.lock:
+			self.phase = phase
+		self.sample()
+
+	def stop(self):
+		if self.stopped.is_set():
+			return
+		self.stopped.set()
+		if self.is_alive():
+			self.join()
+		self.sample()
+
+	def summary(self):
+		"""
+		Peak memory and page faults of each phase in the order they ran
+		"""
+		phases = []
+		stats = {}
+		previous_faults = (0, 0)
+		with self.lock:
+			samples = list(self.samples)
+		for s in samples:
+			if s["phase"] not in stats:
+				phases.append(s["phase"])
+				stats[s["phase"]] = {"peak_rss_mb": 0.0, "peak_uss_mb": None,
+									 "minor_faults": 0, "major_faults": 0,
+									 "start_faults": previous_faults}
+			phase = stats[s["phase"]]
+			phase["peak_rss_mb"] = max(phase["peak_rss_mb"], s["rss_mb"])
+			if s["uss_mb"] is not None:
+				phase["peak_uss_mb"] = max(phase["peak_uss_mb"] or 0.0,
+										   s["uss_mb"])
+			phase["minor_faults"] = s["minor_faults"] - phase["start_faults"][0]
+			phase["major_faults"] = s["major_faults"] - phase["start_faults"][1]
+			previous_faults = (s["minor_faults"], s["major_faults"])
+
+		for phase in stats.values():
+			del phase["start_faults"]
+
+		return [(name, stats[name]) for name in phases]
+
+	def print_summary(self):
+		print("\nMemory by phase:")
+		print("{:>14} {:>12} {:>12} {:>14} {:>14}".format(
+			"phase", "peak_rss_MB", "peak_uss_MB",
+			"minor_faults", "major_faults"))
+		for name, phase in self.summary():
+			print("{:>14} {:>12.1f} {:>12} {:>14,} {:>14,}".format(
+				name, phase["peak_rss_mb"],
+				"-" if phase["peak_uss_mb"] is None
+				else "{:.1f}".format(phase["peak_uss_mb"]),
+				phase["minor_faults"], phase["major_faults"]))
+
+	def save(self, filename, config):
+		"""
+		Append the samples to a tidy CSV file.
+		config (e.g. tensor size, batch size, mode) is repeated on every
+		row so several runs can share the file. A file with other columns
+		(e.g. from an older version of the benchmark) is moved aside
+		rather than failing at exit and losing the samples.
+		"""
+		fieldnames = ["run_id"] + sorted(config.keys()) + COLUMNS
+		if os.path.isfile(filename):
+			with open(filename) as f:
+				header = next(csv.reader(f), None)
+			if header != fieldnames:
+				base, ext = os.path.splitext(filename)
+				old_filename = "{}_{}{}".format(base, time.strftime(
+					"%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(filename))),
+					ext)
+				os.rename(filename, old_filename)
+				print("WARNING: {} has columns {}, expected {}. "
+					  "Moved it to {}.".format(filename, header, fieldnames,
+											   old_filename))
+		new_file = not os.path.isfile(filename)
+
+		run_id = "{}_{}".format(int(self.start_time), os.getpid())
+		with self.lock:
+			samples = list(self.samples)
+		with open(filename, "a") as f:
+			writer = csv.DictWriter(f, fieldnames=fieldnames)
+			if new_file:
+				writer.writeheader()
+			for s in samples:
+				row = dict(config, run_id=run_id, **s)
+				writer.writerow(row)
+
+		self.saved = True
+		print("Saved {} memory samples to {}".format(len(samples), filename))
+
+	def save_at_exit(self, filename, config):
+		"""
+		Stop, print the summary and save when the script exits,
+		including when it is terminated with SIGTERM.
+		"""
+		def finish():
+			if not self.saved:
+				self.stop()
+				self.print_summary()
+				self.save(filename, config)
+
+		def terminate(signum, frame):
+			sys.exit(128 + signum)   # Runs the atexit handlers
+
+		atexit.register(finish)
+		signal.signal(signal.SIGTERM, terminate)
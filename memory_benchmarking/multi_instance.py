@@ -0,0 +1,259 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Multi-instance inference throughput.
+
+Runs N copies of benchmark_model.py --inference at the same time. Each
+copy is pinned with sched_setaffinity to its own set of physical cores
+and gets a matching OMP_NUM_THREADS and KMP_AFFINITY proclist. The sweep
+covers instances x threads per instance x batch size and reports the
+aggregate images/sec and the step latency of the instances.
+
+	python multi_instance.py --dim_length 128 --instances 1 2 4 8 --bz 1 2 4
+
+--threads defaults to all of the cores split evenly between the
+instances. Any other arguments are passed to benchmark_model.py.
+The deployment shape with the highest aggregate throughput is
+recommended (within --max_latency_ms if given).
+"""
+
+import argparse
+import csv
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_runner"))
+import topology
+
+parser = argparse.ArgumentParser(
+	description="Sweep the number of pinned inference instances",
+	add_help=True)
+parser.add_argument("--dim_length",
+					type = int,
+					default=64,
+					help="Tensor cube length of side")
+parser.add_argument("--instances",
+					type = int,
+					nargs="+",
+					default=[1, 2, 4],
+					help="Numbers of concurrent instances to try")
+parser.add_argument("--threads",
+					type = int,
+					nargs="*",
+					default=None,
+					help="Threads (cores) per instance to try. "
+						 "Default is all cores / instances.")
+parser.add_argument("--bz",
+					type = int,
+					nargs="+",
+					default=[1, 2, 4],
+					help="Batch sizes to try")
+parser.add_argument("--duration",
+					type = float,
+					default=60,
+					help="Seconds of inference per instance")
+parser.add_argument("--timeout",
+					type = int,
+					default=900,
+					help="Seconds before the instances of a configuration "
+						 "are killed")
+parser.add_argument("--max_latency_ms",
+					type = float,
+					default=None,
+					help="Only recommend shapes whose worst instance p99 step "
+						 "latency is under this")
+parser.add_argument("--python",
+					default=sys.executable,
+					help="Python interpreter for the instances")
+parser.add_argument("--log_dir",
+					default="multi_instance_runs",
+					help="Directory for the output of every instance")
+parser.add_argument("--output",
+					default="multi_instance.csv",
+					help="Save every configuration to this CSV file")
+args, benchmark_args = parser.parse_known_args()
+
+benchmark = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+						 "benchmark_model.py")
+
+STEADY_SPEED = re.compile(
+	r"^Steady state speed = ([\d,.]+) images per second", re.M)
+STEP_TIME = re.compile(
+	r"^Step time after \d+ warmup steps \(ms\): mean=([\d.]+), "
+	r"std=([\d.]+), p50=([\d.]+), p90=([\d.]+), p99=([\d.]+)", re.M)
+
+
+def launch(run_dir, cpus, bz):
+	"""
+	Start one instance pinned to cpus
+	"""
+	env = dict(os.environ)
+	env["OMP_NUM_THREADS"] = str(len(cpus))
+	env["KMP_AFFINITY"] = "granularity=fine,proclist=[{}],explicit".format(
+		",".join(str(cpu) for cpu in cpus))
+
+	cmd = [args.python, benchmark, "--inference",
+		   "--dim_lengthx", str(args.dim_length),
+		   "--dim_lengthy", str(args.dim_length),
+		   "--dim_lengthz", str(args.dim_length),
+		   "--bz", str(bz),
+		   "--intraop_threads", str(len(cpus)),
+		   "--interop_threads", "1",
+		   "--num_datapoints", str(10**9),
+		   "--epochs", "1",
+		   # Every instance runs for the full duration so that they
+		   # compete with each other for the whole measurement
+		   "--duration", str(args.duration),
+		   "--cv_threshold", "0",
+		   "--memory_file", "memory_profile.csv"] + benchmark_args
+
+	if not os.path.isdir(run_dir):
+		os.makedirs(run_dir)
+	log = open(os.path.join(run_dir, "output.log"), "w")
+	proc = subprocess.Popen(cmd, cwd=run_dir, env=env, stdout=log,
+							stderr=subprocess.STDOUT,
+							preexec_fn=lambda: os.sched_setaffinity(0, cpus))
+	log.close()
+	return proc
+
+
+def parse_instance(run_dir):
+	"""
+	Steady state images/sec and step latency of one instance
+	"""
+	with open(os.path.join(run_dir, "output.log")) as f:
+		log = f.read()
+	speed = STEADY_SPEED.findall(log)
+	step = STEP_TIME.findall(log)
+	if len(speed) == 0 or len(step) == 0:
+		return None
+	mean, std, p50, p90, p99 = [float(v) for v in step[-1]]
+	return {"images_per_sec": float(speed[-1].replace(",", "")),
+			"mean_ms": mean, "p50_ms": p50, "p90_ms": p90, "p99_ms": p99}
+
+
+def run_config(num_instances, threads, bz, cores):
+	"""
+	Run num_instances pinned instances at the same time
+	"""
+	name = "instances{}_threads{}_bz{}".format(num_instances, threads, bz)
+	print("Running {} instance(s) x {} thread(s), bz={}".format(
+		num_instances, threads, bz), end="", flush=True)
+
+	procs = []
+	run_dirs = []
+	for i in range(num_instances):
+		cpus = cores[i*threads:(i+1)*threads]
+		run_dir = os.path.join(args.log_dir, name, "instance{}".format(i))
+		procs.append(launch(run_dir, cpus, bz))
+		run_dirs.append(run_dir)
+
+	status = "ok"
+	start_time = time.time()
+	while any(proc.poll() is None for proc in procs):
+		if time.time() - start_time > args.timeout:
+			status = "timeout"
+			for proc in procs:
+				if proc.poll() is None:
+					proc.send_signal(signal.SIGKILL)
+		time.sleep(0.5)
+
+	instances = [parse_instance(run_dir) for run_dir in run_dirs]
+	if status == "ok" and (any(proc.returncode != 0 for proc in procs) or
+						   any(instance is None for instance in instances)):
+		status = "failed"
+
+	result = {"instances": num_instances, "threads": threads, "bz": bz,
+			  "status": status}
+	if status == "ok":
+		result["images_per_sec"] = sum(i["images_per_sec"] for i in instances)
+		result["mean_ms"] = float(np.mean([i["mean_ms"] for i in instances]))
+		result["p50_ms"] = float(np.mean([i["p50_ms"] for i in instances]))
+		result["worst_p99_ms"] = max(i["p99_ms"] for i in instances)
+		print(" {:,.2f} images/sec, mean step {:.1f} ms, worst p99 {:.1f} ms"
+			  .format(result["images_per_sec"], result["mean_ms"],
+					  result["worst_p99_ms"]))
+		for idx, instance in enumerate(instances):
+			print("    instance {}: {:,.2f} images/sec, p50 {:.1f} ms, "
+				  "p99 {:.1f} ms".format(idx, instance["images_per_sec"],
+										 instance["p50_ms"],
+										 instance["p99_ms"]))
+	else:
+		print(" {} (see {})".format(status, os.path.join(args.log_dir, name)))
+
+	return result
+
+
+# First logical CPU of each physical core, hyperthread siblings left out
+cores = [core["cpus"][0] for core in topology.get_cores()]
+print("{} physical cores available: {}".format(len(cores), cores))
+
+configs = []
+for num_instances in args.instances:
+	if args.threads:
+		thread_counts = args.threads
+	else:
+		thread_counts = [len(cores) // num_instances]
+	for threads in thread_counts:
+		if threads < 1 or num_instances*threads > len(cores):
+			print("Skipping {} instance(s) x {} thread(s): only {} cores"
+				  .format(num_instances, threads, len(cores)))
+			continue
+		for bz in args.bz:
+			configs.append((num_instances, threads, bz))
+
+results = [run_config(num_instances, threads, bz, cores)
+		   for num_instances, threads, bz in configs]
+
+columns = ["instances", "threads", "bz", "status", "images_per_sec",
+		   "mean_ms", "p50_ms", "worst_p99_ms"]
+with open(args.output, "w") as f:
+	writer = csv.DictWriter(f, fieldnames=columns)
+	writer.writeheader()
+	writer.writerows(results)
+print("\nSaved {} configurations to {}".format(len(results), args.output))
+
+ok = [r for r in results if r["status"] == "ok"]
+print("\n{:>10} {:>8} {:>5} {:>14} {:>10} {:>14}".format(
+	"instances", "threads", "bz", "images/sec", "mean_ms", "worst_p99_ms"))
+for r in sorted(ok, key=lambda r: -r["images_per_sec"]):
+	print("{:>10} {:>8} {:>5} {:>14,.2f} {:>10.1f} {:>14.1f}".format(
+		r["instances"], r["threads"], r["bz"], r["images_per_sec"],
+		r["mean_ms"], r["worst_p99_ms"]))
+
+candidates = ok
+if args.max_latency_ms is not None:
+	candidates = [r for r in ok if r["worst_p99_ms"] <= args.max_latency_ms]
+
+if len(candidates) == 0:
+	print("\nNo configuration met the requirements.")
+else:
+	best = max(candidates, key=lambda r: r["images_per_sec"])
+	print("\nRecommended deployment: {} instance(s) x {} core(s), "
+		  "batch size {}: {:,.2f} images/sec, worst p99 step latency "
+		  "{:.1f} ms".format(best["instances"], best["threads"], best["bz"],
+							 best["images_per_sec"], best["worst_p99_ms"]))
+	if len(cores) > best["instances"]*best["threads"]:
+		print("({} cores are left idle by this shape)".format(
+			len(cores) - best["instances"]*best["threads"]))
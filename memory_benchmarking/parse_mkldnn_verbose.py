@@ -0,0 +1,250 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Summarize the MKLDNN_VERBOSE output of a benchmark run: time per
+primitive kind (convolution, reorder, batch_normalization, pooling, ...),
+per shape and per layout, and how much of the time goes to reorders
+between the plain (NHWC/NDHWC, NCHW/NCDHW) and the blocked
+(nChw16c, nCdhw16c, ...) formats.
+
+Run a benchmark and capture the log:
+	python parse_mkldnn_verbose.py --save_log mkldnn.log -- \
+		python benchmark_model.py --dim_lengthx 64 --dim_lengthy 64 \
+			--dim_lengthz 64 --num_datapoints 16 --epochs 1
+
+Or parse a saved log:
+	python parse_mkldnn_verbose.py --log mkldnn.log
+"""
+
+import argparse
+import csv
+import os
+import re
+import subprocess
+import sys
+
+parser = argparse.ArgumentParser(
+	description="Parse MKL-DNN verbose logs", add_help=True)
+parser.add_argument("--log",
+					default=None,
+					help="Parse this log instead of running a command")
+parser.add_argument("--save_log",
+					default="mkldnn_verbose.log",
+					help="Save the log of the command to this file")
+parser.add_argument("--skip",
+					type = int,
+					default=0,
+					help="Skip this many primitive executions at the start "
+						 "(e.g. the first step)")
+parser.add_argument("--top",
+					type = int,
+					default=20,
+					help="Number of rows to print")
+parser.add_argument("--csv",
+					default=None,
+					help="Save every primitive execution to this CSV file")
+parser.add_argument("command",
+					nargs=argparse.REMAINDER,
+					help="Benchmark command to run with MKLDNN_VERBOSE=1 "
+						 "(after --)")
+args = parser.parse_args()
+
+# Blocked layouts have an inner block size, e.g. nChw16c, OIdhw16i16o, aBcd16b
+BLOCKED = re.compile(r"\d+[a-zA-Z]")
+
+
+def get_layout_kind(layout):
+	"""
+	plain, blocked or other (e.g. x for a bias) for a memory format
+	"""
+	fmt = layout.split(":")[-1] if ":" in layout else layout
+	fmt = fmt.split("_")[-1]
+	if BLOCKED.search(fmt):
+		return "blocked"
+	if fmt in ("x", "undef", "any", ""):
+		return "other"
+	return "plain"
+
+
+def get_layouts(field):
+	"""
+	Memory formats of the primitive.
+	MKL-DNN 0.x: "in:f32_nchw out:f32_nChw16c" or "fsrc:nChw16c fdst:..."
+	DNNL 1.x:    "src_f32::blocked:aBcd16b:f0 dst_f32::blocked:abcd:f0"
+	"""
+	layouts = []
+	for item in field.split():
+		name, _, value = item.partition(":")
+		if not value:
+			continue
+		if "::" in item:   # DNNL 1.x: src_f32::blocked:aBcd16b:f0
+			parts = item.split(":")
+			name = parts[0].split("_")[0]
+			value = parts[-2] if len(parts) > 3 else parts[-1]
+		else:
+			value = value.split("_")[-1]
+		layouts.append((name, value))
+	return layouts
+
+
+def parse_line(line):
+	"""
+	One primitive execution or None for other lines. The fields are
+	mkldnn_verbose,exec,[cpu,]kind,impl,prop_kind,formats,...,shape,time
+	"""
+	if "_verbose," not in line:
+		return None
+	fields = line.strip().split(",")
+	fields = fields[[i for i, f in enumerate(fields)
+					 if f.endswith("_verbose")][0]:]
+	if len(fields) < 6 or fields[1] != "exec":
+		return None
+	if fields[2] in ("cpu", "gpu"):
+		del fields[2]
+
+	try:
+		time_ms = float(fields[-1])
+	except ValueError:
+		return None
+
+	layout_field = ""
+	for f in fields[5:-2]:
+		if ":" in f and not f.startswith("alg:"):
+			layout_field = f
+			break
+	layouts = get_layouts(layout_field)
+
+	return {"kind": fields[2],
+			"impl": fields[3],
+			"prop_kind": fields[4],
+			"layouts": " ".join("{}:{}".format(n, v) for n, v in layouts),
+			"layout_kinds": [(get_layout_kind(v), v) for _, v in layouts],
+			"shape": fields[-2],
+			"time_ms": time_ms}
+
+
+def get_reorder_direction(entry):
+	"""
+	Source and destination of a reorder with the name of the plain
+	formats, e.g. ndhwc->blocked, blocked->ndhwc, blocked->blocked
+	"""
+	kinds = [v if k == "plain" else k
+			 for k, v in entry["layout_kinds"] if k != "other"]
+	if len(kinds) >= 2:
+		return "{}->{}".format(kinds[0], kinds[-1])
+	return "unknown"
+
+
+def run_command():
+	"""
+	Run the benchmark with MKLDNN_VERBOSE=1, echo its output
+	and return the log lines
+	"""
+	command = args.command
+	if command and command[0] == "--":
+		command = command[1:]
+	env = dict(os.environ, MKLDNN_VERBOSE="1", DNNL_VERBOSE="1")
+	proc = subprocess.Popen(command, env=env, stdout=subprocess.PIPE,
+							stderr=subprocess.STDOUT,
+							universal_newlines=True)
+	lines = []
+	with open(args.save_log, "w") as log:
+		for line in proc.stdout:
+			log.write(line)
+			lines.append(line)
+			if "_verbose," not in line:   # Keep the benchmark output visible
+				sys.stdout.write(line)
+	proc.wait()
+	print("Saved MKL-DNN log to {}".format(args.save_log))
+	if proc.returncode != 0:
+		print("Command exited with {}".format(proc.returncode))
+	return lines
+
+
+def print_table(title, groups, total_ms):
+	print("\n{}".format(title))
+	print("{:>60} {:>8} {:>12} {:>8}".format("", "count", "time_ms", "%"))
+	for key, (count, time_ms) in sorted(groups.items(),
+										key=lambda kv: -kv[1][1])[:args.top]:
+		print("{:>60} {:>8} {:>12.2f} {:>8.1f}".format(
+			key[:60], count, time_ms, 100.0 * time_ms / total_ms))
+
+
+def add(groups, key, time_ms):
+	count, total = groups.get(key, (0, 0.0))
+	groups[key] = (count + 1, total + time_ms)
+
+
+if args.log is not None:
+	with open(args.log) as f:
+		lines = f.readlines()
+elif args.command:
+	lines = run_command()
+else:
+	parser.error("Give --log or a command to run after --")
+
+entries = [e for e in (parse_line(l) for l in lines) if e is not None]
+entries = entries[args.skip:]
+if len(entries) == 0:
+	print("No MKL-DNN primitive executions found. Is TensorFlow built "
+		  "with MKL-DNN and was MKLDNN_VERBOSE=1 set?")
+	sys.exit(1)
+
+total_ms = sum(e["time_ms"] for e in entries)
+
+by_kind = {}
+by_shape = {}
+by_layout = {}
+by_reorder = {}
+for e in entries:
+	add(by_kind, e["kind"], e["time_ms"])
+	add(by_shape, "{} {} {}".format(e["kind"], e["prop_kind"], e["shape"]),
+		e["time_ms"])
+	add(by_layout, "{} {}".format(e["kind"], e["layouts"]), e["time_ms"])
+	if e["kind"] == "reorder":
+		add(by_reorder, get_reorder_direction(e), e["time_ms"])
+
+print("\n{} primitive executions, {:.2f} ms in MKL-DNN".format(len(entries),
+															   total_ms))
+print_table("Time by primitive kind", by_kind, total_ms)
+print_table("Time by shape", by_shape, total_ms)
+print_table("Time by layout", by_layout, total_ms)
+
+reorder_ms = by_kind.get("reorder", (0, 0.0))[1]
+print("\nReorders: {:.2f} ms ({:.1f}% of the MKL-DNN time)".format(
+	reorder_ms, 100.0 * reorder_ms / total_ms))
+for direction, (count, time_ms) in sorted(by_reorder.items(),
+										  key=lambda kv: -kv[1][1]):
+	print("{:>20} {:>8} calls {:>12.2f} ms {:>8.1f}%".format(
+		direction, count, time_ms, 100.0 * time_ms / total_ms))
+
+plain_ms = sum(t for d, (c, t) in by_reorder.items()
+			   if d != "blocked->blocked" and d != "unknown")
+print("\nUp to {:.1f}% of the MKL-DNN time is spent converting to or from "
+	  "the plain layout of the model (data_format in model.py). "
+	  "If this is large, try the other data_format or keep the tensors "
+	  "in the MKL layout between layers.".format(100.0 * plain_ms / total_ms))
+
+if args.csv is not None:
+	with open(args.csv, "w") as f:
+		writer = csv.DictWriter(f, fieldnames=["kind", "impl", "prop_kind",
+											   "layouts", "shape", "time_ms"],
+								extrasaction="ignore")
+		writer.writeheader()
+		writer.writerows(entries)
+	print("Saved {} primitive executions to {}".format(len(entries), args.csv))
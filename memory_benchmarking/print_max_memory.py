@@ -1,12 +1,62 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Print the peak training and inference memory of every configuration
+in the memory_profile.csv written by benchmark_model.py.
+
+	python print_max_memory.py --memory_file memory_profile.csv
+"""
+
+import argparse
 import pandas as pd
 
-df = pd.read_csv("training_concat.csv")
+parser = argparse.ArgumentParser(
+	description="Peak memory per configuration", add_help=True)
+parser.add_argument("--memory_file",
+					default="memory_profile.csv",
+					help="Memory samples from benchmark_model.py")
+parser.add_argument("--by_phase",
+					action="store_true",
+					default=False,
+					help="Also show the peak of each phase")
+args = parser.parse_args()
+
+df = pd.read_csv(args.memory_file)
+
+# Files written before --channels_first have no data_format column
+config = [c for c in ["model", "mode", "tensor_size", "bz", "data_format"]
+		  if c in df.columns]
+stats = {"rss_mb": "max", "uss_mb": "max",
+		 "major_faults": "max", "minor_faults": "max"}
 
-print("Training")
-print(df.max())
+# Latest run of each configuration
+latest = df.groupby(config)["run_id"].transform("max")
+df = df[df["run_id"] == latest]
 
-df = pd.read_csv("inference_concat.csv")
+for mode in ["train", "inference"]:
+	runs = df[df["mode"] == mode]
+	if len(runs) == 0:
+		continue
 
-print("Inference")
-print(df.max())
+	print("\n{}".format("Training" if mode == "train" else "Inference"))
+	print(runs.groupby(config).agg(stats).rename(
+		columns={"rss_mb": "peak_rss_mb", "uss_mb": "peak_uss_mb"}).to_string())
 
+	if args.by_phase:
+		print(runs.pivot_table(index=config, columns="phase",
+							   values="rss_mb", aggfunc="max").to_string())
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+# ----------------------------------------------------------------------------
+# Copyright 2018 Intel
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Decide when a benchmark has run long enough.
+
+	detector = SteadyStateDetector(warmup_steps=3, duration=120)
+	detector.start()
+	while True:
+		start = time.time()
+		sess.run(...)
+		if detector.add_step(time.time() - start):
+			break
+	detector.print_summary(batch_size)
+
+The run stops at the first of:
+	converged - the coefficient of variation (std / mean) of the
+				last cv_window step times is below cv_threshold
+	duration  - duration seconds have passed since start()
+	max_steps - max_steps steps have run
+The warmup steps are never part of the window or of the statistics.
+"""
+
+import time
+
+import numpy as np
+
+CONVERGED = "converged"
+DURATION = "duration"
+MAX_STEPS = "max_steps"
+COMPLETED = "completed"   # The benchmark ran all of its steps
+
+
+def add_arguments(parser):
+	"""
+	Add the stopping options to a benchmark's argparse parser
+	"""
+	parser.add_argument("--duration",
+						type = float,
+						default=None,
+						help="Stop after this many seconds")
+	parser.add_argument("--max_steps",
+						type = int,
+						default=None,
+						help="Stop after this many steps")
+	parser.add_argument("--cv_window",
+						type = int,
+						default=20,
+						help="Number of recent steps used to detect "
+							 "the steady state")
+	parser.add_argument("--cv_threshold",
+						type = float,
+						default=0.05,
+						help="Stop once the coefficient of variation of the "
+							 "last --cv_window step times is below this. "
+							 "0 turns the detection off.")
+
+
+class SteadyStateDetector(object):
+	"""
+	Collects the step times of a benchmark and tells it when to stop
+	"""
+
+	def __init__(self, warmup_steps=3, cv_window=20, cv_threshold=0.05,
+				 duration=None, max_steps=None):
+		self.warmup_steps = warmup_steps
+		self.cv_window = cv_window
+		self.cv_threshold = cv_threshold
+		self.duration = duration
+		self.max_steps = max_steps
+		self.step_times = []
+		self.stop_reason = None
+		self.start_time = None
+		self.stop_time = None
+
+	@classmethod
+	def from_args(cls, args):
+		return cls(warmup_steps=args.warmup_steps, cv_window=args.cv_window,
+				   cv_threshold=args.cv_threshold, duration=args.duration,
+				   max_steps=args.max_steps)
+
+	def start(self):
+		self.start_time = time.time()
+
+	def timed_steps(self):
+		"""
+		Step times after the warmup
+		"""
+		return self.step_times[self.warmup_steps:]
+
+	def rolling_cv(self):
+		"""
+		Coefficient of variation of the last cv_window step times,
+		or None until there are enough steps after the warmup
+		"""
+		steps = self.timed_steps()
+		if self.cv_window < 2 or len(steps) < self.cv_window:
+			return None
+		window = np.array(steps[-self.cv_window:])
+		mean = np.mean(window)
+		if mean <= 0:
+			return None
+		return float(np.std(window) / mean)
+
+	def add_step(self, seconds):
+		"""
+		Record one step. Returns True when the benchmark should stop.
+		"""
+		if self.start_time is None:
+			self.start()
+		self.step_times.append(seconds)
+
+		if self.max_steps is not None and len(self.step_times) >= self.max_steps:
+			self.stop_reason = MAX_STEPS
+		elif self.duration is not None and \
+				time.time() - self.start_time >= self.duration:
+			self.stop_reason = DURATION
+		elif self.cv_threshold > 0:
+			cv = self.rolling_cv()
+			if cv is not None and cv < self.cv_threshold:
+				self.stop_reason = CONVERGED
+
+		if self.stop_reason is not None:
+			self.stop_time = time.time()
+			return True
+		return False
+
+	def finish(self):
+		"""
+		Call when the benchmark ran out of steps before a stop condition
+		"""
+		if self.stop_reason is None:
+			self.stop_reason = COMPLETED
+			self.stop_time = time.time()
+
+	def summary(self, batch_size):
+		"""
+		Dictionary of the run statistics
+		"""
+		self.finish()
+		total_time = self.stop_time - self.start_time
+		summary = {"stop_reason": self.stop_reason,
+				   "steps": len(self.step_times),
+				   "warmup_steps": min(self.warmup_steps, len(self.step_times)),
+				   "total_time": total_time,
+				   "images": batch_size * len(self.step_times),
+				   "images_per_sec": batch_size * len(self.step_times) /
+									 total_time if total_time > 0 else 0.0,
+				   "rolling_cv": self.rolling_cv()}
+
+		steps = self.timed_steps()
+		summary["timed_steps"] = len(steps)
+		if len(steps) > 0:
+			step_ms = 1000.0 * np.array(steps)
+			summary["step_ms"] = {"mean": float(np.mean(step_ms)),
+								  "std": float(np.std(step_ms)),
+								  "min": float(np.min(step_ms)),
+								  "p50": float(np.percentile(step_ms, 50)),
+								  "p90": float(np.percentile(step_ms, 90)),
+								  "p99": float(np.percentile(step_ms, 99)),
+								  "max": float(np.max(step_ms))}
+			summary["steady_images_per_sec"] = batch_size * len(steps) / \
+				np.sum(steps)
+		return summary
+
+	def print_summary(self, batch_size):
+		summary = self.summary(batch_size)
+		print("\n\nStopped after {:,} steps ({})".format(summary["steps"],
+													   summary["stop_reason"]))
+		if summary["rolling_cv"] is not None:
+			print("Coefficient of variation of the last {} steps = "
+				  "{:.4f}".format(self.cv_window, summary["rolling_cv"]))
+		print("Total time = {:,.3f} seconds".format(summary["total_time"]))
+		print("Total images = {:,}".format(summary["images"]))
+		print("Speed = {:,.3f} images per second".format(
+			summary["images_per_sec"]))
+		if summary["timed_steps"] > 0:
+			step_ms = summary["step_ms"]
+			print("Step time after {} warmup steps (ms): mean={:.2f}, "
+				  "std={:.2f}, p50={:.2f}, p90={:.2f}, p99={:.2f}".format(
+					  summary["warmup_steps"], step_ms["mean"], step_ms["std"],
+					  step_ms["p50"], step_ms["p90"], step_ms["p99"]))
+			print("Steady state speed = {:,.3f} images per second".format(
+				summary["steady_images_per_sec"]))
+		else:
+			print("No steps after the warmup. Increase --max_steps "
+				  "or --duration.")
+		return summary
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Offline NMT inference throughput.
+
+Translates local text with the Transformer in transformer.py (greedy
+decoding) and measures the tokens/sec and the sentence latency of each
+batching strategy:
+    --batch_types examples  fixed number of sentences per batch
+    --batch_types tokens    token budget (sentences x longest sentence)
+    --orders none           sentences in file order
+    --orders sort / bucket  sentences grouped by length to cut padding
+
+Each thread setting (optimized: OMP/KMP settings and one thread per
+physical core, see topology.worker_env; unoptimized: the defaults) runs
+in its own process.
+
+    python benchmark_nmt_inference.py --src data/toy-ende/src-test.txt \
+        --src_vocab data/toy-ende/src-vocab.txt
+    python benchmark_nmt_inference.py --model_dir nmt_training/model
+
+Without --model_dir the weights are random, so the output length is set
+by --length_ratio (output tokens per source token) instead of </s>.
+Without --src random sentences are used.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "benchmark_runner"))
+import allocator
+import topology
+import workers
+
+import numpy as np
+
+import nmt_data
+
+COLUMNS = ["settings", "batch_type", "batch_size", "order", "batches",
+           "sentences", "src_tokens", "tgt_tokens", "padding", "total_time",
+           "sentences_per_sec", "src_tokens_per_sec", "tgt_tokens_per_sec",
+           "latency_ms_p50", "latency_ms_p90", "latency_ms_p99"]
+
+parser = argparse.ArgumentParser(
+    description="Offline NMT inference throughput and latency",
+    add_help=True)
+parser.add_argument("--src", default=None,
+                    help="Source text, one tokenized sentence per line. "
+                    "Default is random sentences.")
+parser.add_argument("--num_sentences", type=int, default=1000,
+                    help="Number of sentences to translate")
+parser.add_argument("--src_vocab", default=None,
+                    help="Source vocabulary (onmt-build-vocab file). "
+                    "Default is built from --src.")
+parser.add_argument("--tgt_vocab", default=None,
+                    help="Target vocabulary. Default has --vocab_size tokens.")
+parser.add_argument("--vocab_size", type=int, default=32000,
+                    help="Size of the vocabularies that are not given")
+parser.add_argument("--model", default="small", choices=["small", "base"],
+                    help="Transformer size (without --model_dir)")
+parser.add_argument("--model_dir", default=None,
+                    help="Checkpoint, vocabularies and model sizes saved "
+                    "by benchmark_nmt_training.py")
+parser.add_argument("--length_ratio", type=float, default=1.2,
+                    help="Maximum output tokens per source token")
+parser.add_argument("--max_length", type=int, default=250,
+                    help="Longest source and output sentence")
+parser.add_argument("--batch_types", nargs="+",
+                    default=["examples", "tokens"],
+                    choices=["examples", "tokens"],
+                    help="Fixed size or token budget batches")
+parser.add_argument("--example_batch_sizes", type=int, nargs="+",
+                    default=[1, 16, 64],
+                    help="Sentences per batch for --batch_types examples")
+parser.add_argument("--token_batch_sizes", type=int, nargs="+",
+                    default=[512, 2048],
+                    help="Token budgets for --batch_types tokens")
+parser.add_argument("--orders", nargs="+", default=["none", "sort"],
+                    choices=["none", "sort", "bucket"],
+                    help="Order of the sentences before batching")
+parser.add_argument("--bucket_width", type=int, default=5,
+                    help="Sentence length range of a bucket")
+parser.add_argument("--settings", nargs="+",
+                    default=["optimized", "unoptimized"],
+                    choices=["optimized", "unoptimized"],
+                    help="Thread settings")
+parser.add_argument("--num_threads", type=int, default=None,
+                    help="Intra-op threads for the optimized settings "
+                    "(default: one per physical core)")
+parser.add_argument("--inter_threads", type=int, default=2,
+                    help="Inter-op threads for the optimized settings")
+parser.add_argument("--warmup_batches", type=int, default=2,
+                    help="Untimed batches before each configuration")
+parser.add_argument("--python", default=sys.executable,
+                    help="Python interpreter for the workers")
+parser.add_argument("--output", default="nmt_inference.csv",
+                    help="Save the results to this CSV file")
+# Used by the driver to run one thread setting
+parser.add_argument("--worker_settings", default=None,
+                    help=argparse.SUPPRESS)
+
+
+def load_data():
+    """
+    Source sentences as ids and the two vocabulary sizes
+    """
+    if args.model_dir is not None:
+        src_vocab = nmt_data.load_vocab(os.path.join(args.model_dir,
+                                                     "src_vocab.txt"))
+        tgt_vocab = nmt_data.load_vocab(os.path.join(args.model_dir,
+                                                     "tgt_vocab.txt"))
+    else:
+        src_vocab = nmt_data.load_vocab(args.src_vocab) \
+            if args.src_vocab else None
+        tgt_vocab = nmt_data.load_vocab(args.tgt_vocab) \
+            if args.tgt_vocab else None
+
+    if args.src is not None:
+        sentences = nmt_data.read_sentences(args.src, args.num_sentences)
+    else:
+        sentences = nmt_data.random_sentences(args.num_sentences,
+                                              args.vocab_size)
+    if src_vocab is None:
+        src_vocab = nmt_data.build_vocab(sentences, args.vocab_size)
+    tgt_vocab_size = len(tgt_vocab) if tgt_vocab else args.vocab_size
+
+    ids = nmt_data.encode(sentences, src_vocab, args.max_length)
+    return ids, len(src_vocab), tgt_vocab_size
+
+
+def get_configs():
+    configs = []
+    for batch_type in args.batch_types:
+        sizes = args.example_batch_sizes if batch_type == "examples" \
+            else args.token_batch_sizes
+        for batch_size in sizes:
+            for order in args.orders:
+                configs.append((batch_type, batch_size, order))
+    return configs
+
+
+def run_worker(settings):
+    """
+    Time every batching configuration with one thread setting
+    and append the results to args.output
+    """
+    import tensorflow as tf
+    from transformer import Transformer, MODELS
+
+    ids, src_vocab_size, tgt_vocab_size = load_data()
+    lengths = [len(s) for s in ids]
+
+    if settings == "optimized":
+        config = tf.ConfigProto(intra_op_parallelism_threads=args.num_threads,
+                                inter_op_parallelism_threads=args.inter_threads)
+    else:
+        config = tf.ConfigProto()
+    sess = tf.Session(config=config)
+
+    if args.model_dir is not None:
+        # The sizes the checkpoint was trained with
+        name, sizes = nmt_data.load_model_config(
+            os.path.join(args.model_dir, "model.json"))
+        print("{} Transformer from {}".format(name, args.model_dir))
+    else:
+        sizes = MODELS[args.model]
+    model = Transformer(src_vocab_size, tgt_vocab_size, **sizes)
+    src_ids = tf.placeholder(tf.int32, [None, None], name="src_ids")
+    src_lengths = tf.placeholder(tf.int32, [None], name="src_lengths")
+    max_lengths = tf.placeholder(tf.int32, [None], name="max_lengths")
+    _, output_lengths = model.greedy_decode(src_ids, src_lengths, max_lengths)
+
+    if args.model_dir is not None:
+        tf.train.Saver().restore(sess,
+                                 tf.train.latest_checkpoint(args.model_dir))
+    else:
+        sess.run(tf.global_variables_initializer())
+
+    def translate(batch):
+        src, src_len = nmt_data.pad_batch([ids[i] for i in batch])
+        max_len = np.minimum(np.ceil(src_len * args.length_ratio),
+                             args.max_length).astype(np.int32)
+        start_time = time.time()
+        out_len = sess.run(output_lengths,
+                           feed_dict={src_ids: src, src_lengths: src_len,
+                                      max_lengths: max_len})
+        return time.time() - start_time, int(np.sum(out_len))
+
+    with open(args.output, "a") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        for batch_type, batch_size, order in get_configs():
+            batches = nmt_data.make_batches(lengths, batch_type, batch_size,
+                                            order, args.bucket_width)
+            for batch in batches[:args.warmup_batches]:
+                translate(batch)
+
+            latencies = []
+            total_time = 0.0
+            tgt_tokens = 0
+            for batch in batches:
+                seconds, tokens = translate(batch)
+                total_time += seconds
+                tgt_tokens += tokens
+                # Every sentence of a batch is done when the batch is done
+                latencies += [1000.0 * seconds] * len(batch)
+
+            writer.writerow({
+                "settings": settings, "batch_type": batch_type,
+                "batch_size": batch_size, "order": order,
+                "batches": len(batches), "sentences": len(ids),
+                "src_tokens": sum(lengths), "tgt_tokens": tgt_tokens,
+                "padding": nmt_data.padding_fraction(batches, lengths),
+                "total_time": total_time,
+                "sentences_per_sec": len(ids) / total_time,
+                "src_tokens_per_sec": sum(lengths) / total_time,
+                "tgt_tokens_per_sec": tgt_tokens / total_time,
+                "latency_ms_p50": np.percentile(latencies, 50),
+                "latency_ms_p90": np.percentile(latencies, 90),
+                "latency_ms_p99": np.percentile(latencies, 99)})
+            f.flush()
+            print("{} {} {} {}: {:,.1f} target tokens/sec".format(
+                settings, batch_type, batch_size, order,
+                tgt_tokens / total_time))
+
+
+if __name__ == "__main__":
+
+    allocator.add_arguments(parser)
+    args = parser.parse_args()
+    allocator.use_allocator(args.allocator)
+
+    if args.worker_settings is not None:
+        run_worker(args.worker_settings)
+        sys.exit(0)
+
+    if args.num_threads is None:
+        args.num_threads = topology.plan_threads()["intra_threads"]
+    rows = workers.run_workers(
+        args.python, args.output, COLUMNS,
+        [("the {} settings".format(settings),
+          ["--worker_settings", settings, "--num_threads",
+           str(args.num_threads)],
+          topology.worker_env(settings, args.num_threads))
+         for settings in args.settings])
+    if len(rows) == 0:
+        print("No configurations were timed.")
+        sys.exit(1)
+    print("\nSaved the results to {}".format(args.output))
+
+    print("\n{:>12} {:>9} {:>6} {:>7} {:>8} {:>12} {:>12} {:>9} {:>9}".format(
+        "settings", "batch", "size", "order", "padding", "src_tok/s",
+        "tgt_tok/s", "p50_ms", "p99_ms"))
+    for row in rows:
+        print("{:>12} {:>9} {:>6} {:>7} {:>8.1%} {:>12,.1f} {:>12,.1f} "
+              "{:>9.1f} {:>9.1f}".format(
+                  row["settings"], row["batch_type"], row["batch_size"],
+                  row["order"], float(row["padding"]),
+                  float(row["src_tokens_per_sec"]),
+                  float(row["tgt_tokens_per_sec"]),
+                  float(row["latency_ms_p50"]), float(row["latency_ms_p99"])))
+
+    best = max(rows, key=lambda r: float(r["tgt_tokens_per_sec"]))
+    print("\nHighest throughput: {} settings, {} batches of {}, order {} "
+          "({:,.1f} target tokens/sec, p99 latency {:.1f} ms)".format(
+              best["settings"], best["batch_type"], best["batch_size"],
+              best["order"], float(best["tgt_tokens_per_sec"]),
+              float(best["latency_ms_p99"])))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Offline NMT training step time.
+
+Trains the Transformer in transformer.py on local parallel text (e.g.
+the toy-ende data of OpenNMT-tf) with token budget batches of similar
+length sentences, and reports the source and target tokens/sec.
+
+Every --trace_every steps one step is traced, and the op time of the
+step is split into the phases
+    embedding, encoder, decoder, softmax (projection and loss), optimizer
+with the backward ops counted in the phase of their forward op. The
+traced steps are left out of the throughput.
+
+Each intra-op x inter-op thread count runs in its own process with the
+optimized OMP/KMP settings (see topology.worker_env). The batch sizes (in tokens) run in the
+same process.
+
+    python benchmark_nmt_training.py --src data/toy-ende/src-train.txt \
+        --tgt data/toy-ende/tgt-train.txt --batch_sizes 1024 2048 4096 \
+        --intra_threads 14 28 --inter_threads 1 2
+
+--model_dir saves the weights, the vocabularies and the Transformer
+sizes for benchmark_nmt_inference.py. Without --src and --tgt random sentences
+are used.
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "benchmark_runner"))
+import allocator
+import topology
+import workers
+
+import numpy as np
+
+import nmt_data
+
+PHASES = ["embedding", "encoder", "decoder", "softmax", "optimizer", "other"]
+PHASE = re.compile(r"^(?:gradients(?:_\d+)?/)?"
+                   r"(embedding|encoder|decoder|softmax|optimizer)(?:_\d+)?/")
+
+COLUMNS = ["intra_threads", "inter_threads", "batch_size", "steps",
+           "step_ms_mean", "step_ms_p50", "step_ms_p90",
+           "src_tokens_per_sec", "tgt_tokens_per_sec", "traced_steps"] + \
+    ["{}_ms".format(p) for p in PHASES] + \
+    ["{}_pct".format(p) for p in PHASES]
+
+parser = argparse.ArgumentParser(
+    description="Offline NMT training step time with a phase breakdown",
+    add_help=True)
+parser.add_argument("--src", default=None,
+                    help="Source training text, one tokenized sentence "
+                    "per line")
+parser.add_argument("--tgt", default=None,
+                    help="Target training text, aligned with --src")
+parser.add_argument("--num_sentences", type=int, default=10000,
+                    help="Number of sentence pairs to read")
+parser.add_argument("--src_vocab", default=None,
+                    help="Source vocabulary (onmt-build-vocab file). "
+                    "Default is built from --src.")
+parser.add_argument("--tgt_vocab", default=None,
+                    help="Target vocabulary. Default is built from --tgt.")
+parser.add_argument("--vocab_size", type=int, default=50000,
+                    help="Size of the vocabularies that are built")
+parser.add_argument("--model", default="small", choices=["small", "base"],
+                    help="Transformer size")
+parser.add_argument("--max_length", type=int, default=100,
+                    help="Longest source and target sentence")
+parser.add_argument("--batch_sizes", type=int, nargs="+",
+                    default=[1024, 2048, 4096],
+                    help="Batch sizes in tokens (sentences x longest "
+                    "sentence)")
+parser.add_argument("--intra_threads", type=int, nargs="+",
+                    default=None,
+                    help="Intra-op thread counts (default: one per "
+                    "physical core)")
+parser.add_argument("--inter_threads", type=int, nargs="+", default=[2],
+                    help="Inter-op thread counts")
+parser.add_argument("--steps", type=int, default=100,
+                    help="Timed steps per batch size")
+parser.add_argument("--warmup_steps", type=int, default=5,
+                    help="Untimed steps before each batch size")
+parser.add_argument("--trace_every", type=int, default=10,
+                    help="Trace one step out of this many. 0 turns "
+                    "tracing off.")
+parser.add_argument("--learningrate", type=float, default=0.0002,
+                    help="Learning rate")
+parser.add_argument("--model_dir", default=None,
+                    help="Save the weights, vocabularies and model "
+                    "sizes here")
+parser.add_argument("--python", default=sys.executable,
+                    help="Python interpreter for the workers")
+parser.add_argument("--output", default="nmt_training.csv",
+                    help="Save the results to this CSV file")
+# Used by the driver to run one thread count
+parser.add_argument("--worker_threads", type=int, nargs=2, default=None,
+                    help=argparse.SUPPRESS)
+
+
+def load_data():
+    """
+    Source and target ids of the sentence pairs and the vocabularies
+    """
+    if args.src is not None and args.tgt is not None:
+        src = nmt_data.read_sentences(args.src, args.num_sentences)
+        tgt = nmt_data.read_sentences(args.tgt, args.num_sentences)
+    else:
+        src = nmt_data.random_sentences(args.num_sentences, args.vocab_size)
+        tgt = nmt_data.random_sentences(args.num_sentences, args.vocab_size,
+                                        seed=817)
+    src_vocab = nmt_data.load_vocab(args.src_vocab) if args.src_vocab \
+        else nmt_data.build_vocab(src, args.vocab_size)
+    tgt_vocab = nmt_data.load_vocab(args.tgt_vocab) if args.tgt_vocab \
+        else nmt_data.build_vocab(tgt, args.vocab_size)
+    # The target gets <s> in front for the input and </s> at the end
+    # for the labels, so it keeps one token less
+    return nmt_data.encode(src, src_vocab, args.max_length), \
+        nmt_data.encode(tgt, tgt_vocab, args.max_length - 1), \
+        src_vocab, tgt_vocab
+
+
+def get_phase(node_name):
+    match = PHASE.match(node_name)
+    return match.group(1) if match else "other"
+
+
+def phase_times(step_stats):
+    """
+    Op time (ms) of each phase in one traced step
+    """
+    times = dict((p, 0.0) for p in PHASES)
+    for device in step_stats.dev_stats:
+        if "stream:all" in device.device:   # GPU totals repeat the streams
+            continue
+        for node in device.node_stats:
+            times[get_phase(node.node_name)] += node.all_end_rel_micros / 1e3
+    return times
+
+
+def run_worker(intra, inter):
+    """
+    Time every batch size with one thread count and append
+    the results to args.output
+    """
+    import tensorflow as tf
+    from transformer import Transformer, MODELS
+
+    src, tgt, src_vocab, tgt_vocab = load_data()
+    lengths = [max(len(s), len(t) + 1) for s, t in zip(src, tgt)]
+
+    sess = tf.Session(config=tf.ConfigProto(
+        intra_op_parallelism_threads=intra,
+        inter_op_parallelism_threads=inter))
+
+    model = Transformer(len(src_vocab), len(tgt_vocab), **MODELS[args.model])
+    src_ids = tf.placeholder(tf.int32, [None, None], name="src_ids")
+    src_lengths = tf.placeholder(tf.int32, [None], name="src_lengths")
+    tgt_in_ids = tf.placeholder(tf.int32, [None, None], name="tgt_in_ids")
+    tgt_out_ids = tf.placeholder(tf.int32, [None, None], name="tgt_out_ids")
+    tgt_lengths = tf.placeholder(tf.int32, [None], name="tgt_lengths")
+    loss = model.loss(src_ids, src_lengths, tgt_in_ids, tgt_out_ids,
+                      tgt_lengths)
+
+    opt = tf.train.AdamOptimizer(args.learningrate, beta2=0.998)
+    gradients = opt.compute_gradients(loss)
+    with tf.name_scope("optimizer"):
+        train_op = opt.apply_gradients(gradients)
+    sess.run(tf.global_variables_initializer())
+
+    def feed(batch):
+        src_batch, src_len = nmt_data.pad_batch([src[i] for i in batch])
+        tgt_in, tgt_len = nmt_data.pad_batch(
+            [[nmt_data.BOS] + tgt[i] for i in batch])
+        tgt_out, _ = nmt_data.pad_batch(
+            [tgt[i] + [nmt_data.EOS] for i in batch])
+        return {src_ids: src_batch, src_lengths: src_len,
+                tgt_in_ids: tgt_in, tgt_out_ids: tgt_out,
+                tgt_lengths: tgt_len}, int(np.sum(src_len)), \
+            int(np.sum(tgt_len))
+
+    rng = np.random.RandomState(816)
+    run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+
+    with open(args.output, "a") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        for batch_size in args.batch_sizes:
+            # Similar length sentences in a batch, the batches in random order
+            batches = nmt_data.make_batches(lengths, "tokens", batch_size,
+                                            "bucket")
+            rng.shuffle(batches)
+            feeds = itertools.cycle(batches)
+
+            for _ in range(args.warmup_steps):
+                sess.run(train_op, feed_dict=feed(next(feeds))[0])
+
+            step_times = []
+            src_tokens = 0
+            tgt_tokens = 0
+            traces = []
+            for step in range(args.steps):
+                feed_dict, num_src, num_tgt = feed(next(feeds))
+                if args.trace_every > 0 and step % args.trace_every == 0:
+                    run_metadata = tf.RunMetadata()
+                    sess.run(train_op, feed_dict=feed_dict,
+                             options=run_options, run_metadata=run_metadata)
+                    traces.append(phase_times(run_metadata.step_stats))
+                    continue
+                start_time = time.time()
+                sess.run(train_op, feed_dict=feed_dict)
+                step_times.append(time.time() - start_time)
+                src_tokens += num_src
+                tgt_tokens += num_tgt
+
+            step_ms = 1000.0 * np.array(step_times)
+            row = {"intra_threads": intra, "inter_threads": inter,
+                   "batch_size": batch_size, "steps": len(step_times),
+                   "step_ms_mean": float(np.mean(step_ms)),
+                   "step_ms_p50": float(np.percentile(step_ms, 50)),
+                   "step_ms_p90": float(np.percentile(step_ms, 90)),
+                   "src_tokens_per_sec": src_tokens / np.sum(step_times),
+                   "tgt_tokens_per_sec": tgt_tokens / np.sum(step_times),
+                   "traced_steps": len(traces)}
+            if len(traces) > 0:
+                total = sum(sum(t.values()) for t in traces)
+                for p in PHASES:
+                    phase_ms = sum(t[p] for t in traces)
+                    row["{}_ms".format(p)] = phase_ms / len(traces)
+                    row["{}_pct".format(p)] = 100.0 * phase_ms / total
+            writer.writerow(row)
+            f.flush()
+            print("intra={} inter={} batch={} tokens: {:.1f} ms/step, "
+                  "{:,.1f} target tokens/sec".format(
+                      intra, inter, batch_size, row["step_ms_mean"],
+                      row["tgt_tokens_per_sec"]))
+
+    if args.model_dir is not None:
+        if not os.path.isdir(args.model_dir):
+            os.makedirs(args.model_dir)
+        tf.train.Saver().save(sess, os.path.join(args.model_dir, "model"))
+        nmt_data.save_vocab(src_vocab, os.path.join(args.model_dir,
+                                                    "src_vocab.txt"))
+        nmt_data.save_vocab(tgt_vocab, os.path.join(args.model_dir,
+                                                    "tgt_vocab.txt"))
+        nmt_data.save_model_config(args.model, MODELS[args.model],
+                                   os.path.join(args.model_dir, "model.json"))
+        print("Saved the model to {}".format(args.model_dir))
+
+
+if __name__ == "__main__":
+
+    allocator.add_arguments(parser)
+    args = parser.parse_args()
+    allocator.use_allocator(args.allocator)
+
+    if args.worker_threads is not None:
+        run_worker(*args.worker_threads)
+        sys.exit(0)
+
+    plan = topology.plan_threads()
+    if args.intra_threads is None:
+        args.intra_threads = [plan["intra_threads"]]
+    rows = workers.run_workers(
+        args.python, args.output, COLUMNS,
+        [("intra={} inter={}".format(intra, inter),
+          ["--worker_threads", str(intra), str(inter)],
+          topology.worker_env("optimized", intra, plan))
+         for intra, inter in itertools.product(args.intra_threads,
+                                               args.inter_threads)])
+    if len(rows) == 0:
+        print("No configurations were timed.")
+        sys.exit(1)
+    print("\nSaved the results to {}".format(args.output))
+
+    print("\n{:>6} {:>6} {:>7} {:>9} {:>11} ".format(
+        "intra", "inter", "batch", "step_ms", "tgt_tok/s") +
+        " ".join("{:>9}".format(p) for p in PHASES))
+    for row in rows:
+        phases = " ".join("{:>8.1f}%".format(float(row["{}_pct".format(p)]))
+                          if row["{}_pct".format(p)] else "{:>9}".format("")
+                          for p in PHASES)
+        print("{:>6} {:>6} {:>7} {:>9.1f} {:>11,.1f} {}".format(
+            row["intra_threads"], row["inter_threads"], row["batch_size"],
+            float(row["step_ms_mean"]), float(row["tgt_tokens_per_sec"]),
+            phases))
+
+    best = max(rows, key=lambda r: float(r["tgt_tokens_per_sec"]))
+    print("\nHighest throughput: --intra_threads {} --inter_threads {} "
+          "with batches of {} tokens ({:,.1f} target tokens/sec)".format(
+              best["intra_threads"], best["inter_threads"],
+              best["batch_size"], float(best["tgt_tokens_per_sec"])))
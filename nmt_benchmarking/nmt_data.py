@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Text, vocabulary and batching helpers shared by the NMT benchmarks.
+Nothing is downloaded: the vocabularies are built from local text files
+(or read from onmt-build-vocab files).
+"""
+
+import collections
+import json
+import math
+
+import numpy as np
+
+PAD, UNK, BOS, EOS = 0, 1, 2, 3
+SPECIAL_TOKENS = ["<blank>", "<unk>", "<s>", "</s>"]
+
+
+def read_sentences(filename, limit=None):
+    """
+    Whitespace tokenized lines of a text file
+    """
+    sentences = []
+    with open(filename) as f:
+        for line in f:
+            sentences.append(line.split())
+            if limit is not None and len(sentences) >= limit:
+                break
+    return sentences
+
+
+def random_sentences(num_sentences, vocab_size, mean_length=25, seed=816):
+    """
+    Sentences of random token ids with a long tailed length distribution,
+    for when no text is available
+    """
+    rng = np.random.RandomState(seed)
+    lengths = np.clip(rng.lognormal(math.log(mean_length), 0.5,
+                                    size=num_sentences), 1, 250).astype(int)
+    return [["w{}".format(i) for i in rng.randint(vocab_size, size=n)]
+            for n in lengths]
+
+
+def build_vocab(sentences, size):
+    """
+    Special tokens followed by the size most frequent tokens
+    """
+    counts = collections.Counter(t for s in sentences for t in s)
+    tokens = [t for t, _ in counts.most_common(size)
+              if t not in SPECIAL_TOKENS]
+    return SPECIAL_TOKENS + tokens
+
+
+def load_vocab(filename):
+    """
+    onmt-build-vocab file (one token per line, special tokens first)
+    """
+    with open(filename) as f:
+        tokens = [line.rstrip("\n").split("\t")[0] for line in f]
+    return SPECIAL_TOKENS + [t for t in tokens if t not in SPECIAL_TOKENS]
+
+
+def save_vocab(vocab, filename):
+    with open(filename, "w") as f:
+        for token in vocab:
+            f.write(token + "\n")
+
+
+def save_model_config(name, sizes, filename):
+    """
+    Transformer name (e.g. small) and sizes of a checkpoint
+    """
+    with open(filename, "w") as f:
+        json.dump(dict(sizes, model=name), f, indent=4)
+
+
+def load_model_config(filename):
+    """
+    Transformer name and sizes saved by save_model_config
+    """
+    with open(filename) as f:
+        sizes = json.load(f)
+    return sizes.pop("model"), sizes
+
+
+def encode(sentences, vocab, max_length=None):
+    """
+    Token ids of each sentence (without <s> and </s>)
+    """
+    index = {t: i for i, t in enumerate(vocab)}
+    ids = [[index.get(t, UNK) for t in s] for s in sentences]
+    if max_length is not None:
+        ids = [s[:max_length] for s in ids]
+    return [s if len(s) > 0 else [UNK] for s in ids]
+
+
+def pad_batch(sequences):
+    """
+    int32 [batch, max length] array and the lengths
+    """
+    lengths = np.array([len(s) for s in sequences], dtype=np.int32)
+    batch = np.full((len(sequences), lengths.max()), PAD, dtype=np.int32)
+    for i, s in enumerate(sequences):
+        batch[i, :len(s)] = s
+    return batch, lengths
+
+
+def order_by_length(lengths, order, bucket_width=5):
+    """
+    Indices of the sentences in the order they are batched:
+        none   - as in the file
+        sort   - by length
+        bucket - by length // bucket_width, in file order within a bucket
+    """
+    if order == "sort":
+        keys = np.asarray(lengths)
+    elif order == "bucket":
+        keys = np.asarray(lengths) // bucket_width
+    else:
+        return list(range(len(lengths)))
+    return [int(i) for i in np.argsort(keys, kind="stable")]
+
+
+def make_batches(lengths, batch_type, batch_size, order="none",
+                 bucket_width=5):
+    """
+    Lists of sentence indices. With batch_type "examples" every batch has
+    batch_size sentences. With "tokens" a batch takes sentences while its
+    padded size (sentences x longest sentence) stays within batch_size.
+    """
+    batches = []
+    batch = []
+    longest = 0
+    for i in order_by_length(lengths, order, bucket_width):
+        if batch_type == "examples":
+            full = len(batch) == batch_size
+        else:
+            full = len(batch) > 0 and \
+                (len(batch) + 1) * max(longest, lengths[i]) > batch_size
+        if full:
+            batches.append(batch)
+            batch = []
+            longest = 0
+        batch.append(i)
+        longest = max(longest, lengths[i])
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def padding_fraction(batches, lengths):
+    """
+    Fraction of the padded batch elements that are padding
+    """
+    padded = sum(len(b) * max(lengths[i] for i in b) for b in batches)
+    return 1.0 - float(sum(lengths)) / padded if padded > 0 else 0.0
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: EPL-2.0
+#
+
+"""
+Small Transformer encoder-decoder used by the NMT benchmarks
+(TensorFlow 1.x graph).
+
+The ops are created in the name scopes embedding, encoder, decoder and
+softmax, so that a trace can be split into these phases.
+"""
+
+import math
+
+import tensorflow as tf
+
+from nmt_data import PAD, BOS, EOS
+
+MODELS = {"small": {"num_layers": 2, "hidden_size": 256, "num_heads": 4,
+                    "ffn_size": 1024},
+          "base": {"num_layers": 6, "hidden_size": 512, "num_heads": 8,
+                   "ffn_size": 2048}}
+
+
+class Transformer(object):
+    """
+    Pre-norm Transformer encoder-decoder (TensorFlow 1.x graph)
+    """
+
+    def __init__(self, src_vocab_size, tgt_vocab_size, num_layers=2,
+                 hidden_size=256, num_heads=4, ffn_size=1024, dropout=0.1):
+        self.src_vocab_size = src_vocab_size
+        self.tgt_vocab_size = tgt_vocab_size
+        self.num_layers = num_layers
+        self.hidden_size = hidden_size
+        self.num_heads = num_heads
+        self.ffn_size = ffn_size
+        self.dropout = dropout
+
+    def embed(self, ids, vocab_size, name, training):
+        with tf.variable_scope("embedding", reuse=tf.AUTO_REUSE):
+            table = tf.get_variable(name, [vocab_size, self.hidden_size])
+            x = tf.nn.embedding_lookup(table, ids) * self.hidden_size**0.5
+
+            # Sinusoidal position encoding
+            length = tf.shape(ids)[1]
+            position = tf.cast(tf.range(length), tf.float32)
+            num_timescales = self.hidden_size // 2
+            inv_timescales = tf.exp(tf.cast(tf.range(num_timescales),
+                                            tf.float32) *
+                                    -(math.log(10000.0) / num_timescales))
+            scaled = tf.expand_dims(position, 1) * \
+                tf.expand_dims(inv_timescales, 0)
+            x += tf.concat([tf.sin(scaled), tf.cos(scaled)], axis=1)
+            return self.drop(x, training)
+
+    def drop(self, x, training):
+        if training and self.dropout > 0:
+            return tf.nn.dropout(x, keep_prob=1.0 - self.dropout)
+        return x
+
+    def norm(self, x, name):
+        with tf.variable_scope(name):
+            gamma = tf.get_variable("gamma", [self.hidden_size],
+                                    initializer=tf.ones_initializer())
+            beta = tf.get_variable("beta", [self.hidden_size],
+                                   initializer=tf.zeros_initializer())
+            mean, variance = tf.nn.moments(x, [-1], keep_dims=True)
+            return (x - mean) * tf.rsqrt(variance + 1e-6) * gamma + beta
+
+    def attention(self, queries, memory, bias, name):
+        def split_heads(x):
+            shape = tf.shape(x)
+            x = tf.reshape(x, [shape[0], shape[1], self.num_heads,
+                               self.hidden_size // self.num_heads])
+            return tf.transpose(x, [0, 2, 1, 3])
+
+        with tf.variable_scope(name):
+            q = split_heads(tf.layers.dense(queries, self.hidden_size,
+                                            use_bias=False, name="query"))
+            k = split_heads(tf.layers.dense(memory, self.hidden_size,
+                                            use_bias=False, name="key"))
+            v = split_heads(tf.layers.dense(memory, self.hidden_size,
+                                            use_bias=False, name="value"))
+            depth = self.hidden_size // self.num_heads
+            logits = tf.matmul(q, k, transpose_b=True) * depth**-0.5 + bias
+            context = tf.matmul(tf.nn.softmax(logits), v)
+            context = tf.transpose(context, [0, 2, 1, 3])
+            shape = tf.shape(context)
+            context = tf.reshape(context, [shape[0], shape[1],
+                                           self.hidden_size])
+            return tf.layers.dense(context, self.hidden_size,
+                                   use_bias=False, name="output")
+
+    def feed_forward(self, x, name):
+        with tf.variable_scope(name):
+            x = tf.layers.dense(x, self.ffn_size, activation=tf.nn.relu,
+                                name="inner")
+            return tf.layers.dense(x, self.hidden_size, name="outer")
+
+    def encode(self, src_ids, src_lengths, training=False):
+        """
+        Encoder outputs [batch, src length, hidden] and the attention
+        bias that masks the source padding
+        """
+        x = self.embed(src_ids, self.src_vocab_size, "source", training)
+
+        with tf.variable_scope("encoder", reuse=tf.AUTO_REUSE):
+            mask = tf.sequence_mask(src_lengths, tf.shape(src_ids)[1],
+                                    dtype=tf.float32)
+            bias = tf.reshape((1.0 - mask) * -1e9, [tf.shape(src_ids)[0], 1,
+                                                    1, tf.shape(src_ids)[1]])
+            for layer in range(self.num_layers):
+                with tf.variable_scope("layer_{}".format(layer)):
+                    y = self.norm(x, "norm_attention")
+                    x += self.drop(self.attention(y, y, bias,
+                                                  "self_attention"), training)
+                    x += self.drop(self.feed_forward(
+                        self.norm(x, "norm_ffn"), "ffn"), training)
+            return self.norm(x, "norm_output"), bias
+
+    def decode(self, tgt_ids, memory, memory_bias, training=False):
+        """
+        Decoder outputs [batch, tgt length, hidden] (before the softmax)
+        """
+        x = self.embed(tgt_ids, self.tgt_vocab_size, "target", training)
+
+        with tf.variable_scope("decoder", reuse=tf.AUTO_REUSE):
+            # Each position only sees the positions before it
+            length = tf.shape(tgt_ids)[1]
+            causal = tf.matrix_band_part(tf.ones([length, length]), -1, 0)
+            causal_bias = tf.reshape((1.0 - causal) * -1e9,
+                                     [1, 1, length, length])
+            for layer in range(self.num_layers):
+                with tf.variable_scope("layer_{}".format(layer)):
+                    y = self.norm(x, "norm_self_attention")
+                    x += self.drop(self.attention(y, y, causal_bias,
+                                                  "self_attention"), training)
+                    x += self.drop(self.attention(
+                        self.norm(x, "norm_attention"), memory, memory_bias,
+                        "attention"), training)
+                    x += self.drop(self.feed_forward(
+                        self.norm(x, "norm_ffn"), "ffn"), training)
+            return self.norm(x, "norm_output")
+
+    def logits(self, outputs):
+        with tf.variable_scope("softmax", reuse=tf.AUTO_REUSE):
+            return tf.layers.dense(outputs, self.tgt_vocab_size,
+                                   name="projection")
+
+    def loss(self, src_ids, src_lengths, tgt_in_ids, tgt_out_ids,
+             tgt_lengths):
+        """
+        Mean cross entropy per target token (teacher forcing)
+        """
+        memory, bias = self.encode(src_ids, src_lengths, training=True)
+        outputs = self.decode(tgt_in_ids, memory, bias, training=True)
+        logits = self.logits(outputs)
+        with tf.name_scope("softmax/loss"):
+            mask = tf.sequence_mask(tgt_lengths, tf.shape(tgt_out_ids)[1],
+                                    dtype=tf.float32)
+            cross_entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                labels=tgt_out_ids, logits=logits)
+            return tf.reduce_sum(cross_entropy * mask) / tf.reduce_sum(mask)
+
+    def greedy_decode(self, src_ids, src_lengths, max_lengths):
+        """
+        Greedy translation of a batch. Every step reruns the decoder on
+        the whole prefix. A sentence stops at </s> or after max_lengths
+        tokens, which with random weights gives a realistic output length.
+        Returns the token ids and the output lengths.
+        """
+        memory, bias = self.encode(src_ids, src_lengths)
+        batch_size = tf.shape(src_ids)[0]
+
+        def next_token(ids):
+            outputs = self.decode(ids, memory, bias)
+            return tf.argmax(self.logits(outputs[:, -1]), axis=-1,
+                             output_type=tf.int32)
+
+        # The first step is outside of the loop so that the decoder
+        # variables are not created inside of the while loop
+        ids = tf.fill([batch_size, 1], BOS)
+        token = next_token(ids)
+        ids = tf.concat([ids, tf.expand_dims(token, 1)], axis=1)
+        lengths = tf.ones([batch_size], dtype=tf.int32)
+        finished = tf.logical_or(tf.equal(token, EOS), max_lengths <= 1)
+
+        def condition(step, ids, lengths, finished):
+            return tf.logical_and(step < tf.reduce_max(max_lengths),
+                                  tf.logical_not(tf.reduce_all(finished)))
+
+        def body(step, ids, lengths, finished):
+            token = tf.where(finished, tf.fill([batch_size], PAD),
+                             next_token(ids))
+            lengths += tf.cast(tf.logical_not(finished), tf.int32)
+            finished = tf.logical_or(finished, tf.logical_or(
+                tf.equal(token, EOS), step + 1 >= max_lengths))
+            ids = tf.concat([ids, tf.expand_dims(token, 1)], axis=1)
+            return step + 1, ids, lengths, finished
+
+        with tf.name_scope("decoder"):
+            _, ids, lengths, _ = tf.while_loop(
+                condition, body, [tf.constant(1), ids, lengths, finished],
+                shape_invariants=[tf.TensorShape([]),
+                                  tf.TensorShape([None, None]),
+                                  tf.TensorShape([None]),
+                                  tf.TensorShape([None])],
+                back_prop=False)
+        return ids[:, 1:], lengths
@@ -19,7 +19,6 @@
 #
 
 import os
-import psutil
 
 BASE = "../../data/Brats2018/240x240/"
 PATCH_HEIGHT = 128  # Train on this patch size
@@ -39,9 +38,10 @@ PRINT_MODEL = False
 MODE = 1  # 1, 2, or 3
 
 BLOCKTIME = 0
-NUM_INTER_THREADS = 2
-# Total number of physical cores across all sockets
-NUM_INTRA_THREADS = psutil.cpu_count(logical=False)
+# None = from the CPU topology (benchmark_runner/topology.py):
+# one inter op thread per socket, one intra op thread per physical core
+NUM_INTER_THREADS = None
+NUM_INTRA_THREADS = None
 
 CHANNELS_FIRST = False
 USE_KERAS_API = True
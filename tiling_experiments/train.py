@@ -22,6 +22,15 @@ import settings    # Use the custom settings.py file for default parameters
 import h5py
 
 import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "benchmark_runner"))
+import allocator
+import autotune
+import topology
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--use_upsampling",
                     help="use upsampling instead of transposed convolution",
@@ -39,8 +48,8 @@ parser.add_argument("--batch_size", type=int, default=settings.BATCH_SIZE,
 parser.add_argument(
     "--blocktime",
     type=int,
-    default=settings.BLOCKTIME,
-    help="blocktime")
+    default=None,
+    help="blocktime (default: tuned, or settings.BLOCKTIME)")
 parser.add_argument("--epochs", type=int, default=settings.EPOCHS,
                     help="number of epochs to train")
 parser.add_argument("--patchheight", type=int, default=settings.PATCH_HEIGHT, help="height of patch to train on")
@@ -79,10 +88,20 @@ parser.add_argument("--num_input_channels", type=int, default=1,
 parser.add_argument("--num_output_channels", type=int, default=1,
                     help="number of output channels")
 
+topology.add_arguments(parser)
+autotune.add_arguments(parser)
+allocator.add_arguments(parser)
 args = parser.parse_args()
+allocator.use_allocator(args.allocator)
 
 import os
 
+# Bind to this process's share of the cores, with the settings found by
+# "run_sweep.py autotune" on this host if any
+topology.setup_threads(args, intra="num_threads", inter="num_inter_threads",
+                       default_blocktime=settings.BLOCKTIME, model="unet2d",
+                       height=args.patchheight, width=args.patchwidth,
+                       bz=args.batch_size)
 num_threads = args.num_threads
 num_inter_op_threads = args.num_inter_threads
 
@@ -95,9 +114,6 @@ os.environ["CUDA_VISIBLE_DEVICES"]="0"   # Which GPU to use
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"  # Get rid of the AVX, SSE warnings
 
 os.environ["KMP_BLOCKTIME"] = blocktime
-os.environ["KMP_AFFINITY"] = "compact,1,0,granularity=fine"
-
-os.environ["OMP_NUM_THREADS"] = str(num_threads)
 os.environ["INTRA_THREADS"] = str(num_threads)
 os.environ["INTER_THREADS"] = str(num_inter_op_threads)
 os.environ["KMP_SETTINGS"] = "0"  # Show the settings at runtime